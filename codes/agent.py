@@ -1,85 +1,174 @@
 import mesa
-import random
 import numpy as np
+from array import array
+
+# Missing belonging score
+NAN = float("nan")
 
 
 # Create Bar class to represent bars
 class Bar:
-    def __init__(self, fixed_affinity, name=None, gamma=0.5, adaptive_update_interval=10):
+    def __init__(self, fixed_affinity, name=None, gamma=0.5, adaptive_update_interval=10,
+                 keep_full_history=False, affinity_rows=None, reporter_prefix=None, on_gamma_change=None):
         self.name = name
+        self.reporter_prefix = reporter_prefix
         self.fixed_affinity = fixed_affinity
-        self.gamma = gamma
-        self.visitor_history = []
+        self._gamma = gamma
+        # Called after gamma changes, so the owner can refresh what it
+        # derives from the effective affinities
+        self.on_gamma_change = on_gamma_change
         self.current_visitors = []
         self.update_count = 0  
 
+        # Full per-round visitor lists are only kept for debugging
+        self.keep_full_history = keep_full_history
+        self.visitor_history = [] if keep_full_history else None
+
+        # Ring buffer of per-group visitor counts for the last X rounds,
+        # with a rolling sum over the buffer
+        self.count_history = [[0] * len(IDENTITY_GROUPS) for _ in range(adaptive_update_interval)]
+        self.history_position = 0
+        self.rounds_recorded = 0
+        self.window_counts = [0] * len(IDENTITY_GROUPS)
+
+        # Running per-group visitor counts for the current round
+        self.visitor_counts = {group: 0 for group in IDENTITY_GROUPS}
+        self.population = 0
+
+        # Fixed, adaptive and effective affinity vectors (in IDENTITY_GROUPS
+        # order) are rows of the model's (K, 3) affinity arrays, or arrays of
+        # their own for a bar used on its own
+        if affinity_rows is None:
+            affinity_rows = tuple(np.empty(len(IDENTITY_GROUPS)) for _ in range(3))
+        self.fixed_values, self.adaptive_values, self.effective_values = affinity_rows
+        self.fixed_values[:] = [fixed_affinity[group] for group in IDENTITY_GROUPS]
+
         # Initialize adaptive affinity to match fixed affinity proportions
         total_fixed = sum(fixed_affinity.values())
-        self.adaptive_affinity = {group: affinity / total_fixed 
-                for group, affinity in fixed_affinity.items()}
+        self.adaptive_values[:] = [fixed_affinity[group] / total_fixed for group in IDENTITY_GROUPS]
+        self.refresh_effective_affinity()
         
         # Update every X rounds (10 by default)
         self.adaptive_update_interval = adaptive_update_interval
+    
+    @property
+    def gamma(self):
+        return self._gamma
+    
+    @gamma.setter
+    def gamma(self, value):
+        self._gamma = value
+        self.refresh_effective_affinity()
+        if self.on_gamma_change is not None:
+            self.on_gamma_change()
+    
+    @property
+    def adaptive_affinity(self):
+        return {group: float(self.adaptive_values[i]) for i, group in enumerate(IDENTITY_GROUPS)}
+    
+    def refresh_effective_affinity(self):
+        # Effective affinity only changes with gamma or an adaptive update,
+        # so it is computed here once and read from the cache in between
+        self.effective_values[:] = self._gamma * self.fixed_values + (1 - self._gamma) * self.adaptive_values
+        self.effective_list = self.effective_values.tolist()
+        self.effective_affinity = dict(zip(IDENTITY_GROUPS, self.effective_list))
         
     def calculate_effective_affinity(self):
-        effective = {}
-        for group in IDENTITY_GROUPS:
-            effective[group] = (self.gamma * self.fixed_affinity[group] + 
-                              (1 - self.gamma) * self.adaptive_affinity[group])
-        return effective
+        # Cached {group: effective affinity}; treat as read-only
+        return self.effective_affinity
     
     def update_adaptive_affinity(self, force=False):
         self.update_count += 1
+        updated = False
         
         # Update adaptive affinity every X rounds
         if self.update_count >= self.adaptive_update_interval or force:
-            if len(self.visitor_history) > 0:
-                # Calculate average visitor ratios for each group over last X rounds
-                history_range = min(len(self.visitor_history), self.adaptive_update_interval)
-                recent_history = self.visitor_history[-history_range:]
-                
-                # Count visitors for each group and total visitors
-                visitor_counts = {group: 0 for group in IDENTITY_GROUPS}
-                total_visitors = 0
-                for visitors in recent_history:
-                    total_visitors += len(visitors)
-                    for visitor in visitors:
-                        visitor_counts[visitor] += 1
+            if self.rounds_recorded > 0:
+                # Average visitor ratios for each group over last X rounds,
+                # read from the rolling sum of the history buffer
+                total_visitors = sum(self.window_counts)
                 
                 # Calculate average visitor ratios
                 if total_visitors > 0:
-                    avg_ratios = {group: visitor_counts[group] / total_visitors for group in IDENTITY_GROUPS}
+                    avg_ratios = {group: self.window_counts[i] / total_visitors
+                                  for i, group in enumerate(IDENTITY_GROUPS)}
                 else:
                     avg_ratios = {group: 0.0 for group in IDENTITY_GROUPS}
                 
                 # Update adaptive affinity based on historical average ratios
                 # adaptive_affinity = 1.0 * historical_average_ratio for each group
-                for group in IDENTITY_GROUPS:
-                    self.adaptive_affinity[group] = avg_ratios[group]
+                for i, group in enumerate(IDENTITY_GROUPS):
+                    self.adaptive_values[i] = avg_ratios[group]
+                self.refresh_effective_affinity()
+                updated = True
             
             self.update_count = 0  # Reset counter
+        
+        return updated
     
     def add_visitors(self, visitors):
         self.current_visitors.extend(visitors)
+        for visitor in visitors:
+            self.visitor_counts[visitor] += 1
+        self.population += len(visitors)
+    
+    def add_group_counts(self, counts):
+        # Bulk version of add_visitors taking {group: number of arrivals}
+        for group in IDENTITY_GROUPS:
+            self.current_visitors.extend([group] * counts[group])
+            self.visitor_counts[group] += counts[group]
+            self.population += counts[group]
+    
+    def start_round(self):
+        # Clear current visitors and reset the running counts
+        self.current_visitors = []
+        for group in IDENTITY_GROUPS:
+            self.visitor_counts[group] = 0
+        self.population = 0
     
     def end_round(self):
-        self.visitor_history.append(self.current_visitors.copy())
-        self.update_adaptive_affinity()
+        if self.keep_full_history:
+            self.visitor_history.append(self.current_visitors.copy())
+        self.record_round_counts()
+        return self.update_adaptive_affinity()
+    
+    def record_round_counts(self):
+        # Overwrite the oldest round in the ring buffer and update the rolling sum
+        counts = [self.visitor_counts[group] for group in IDENTITY_GROUPS]
+        oldest = self.count_history[self.history_position]
+        for i in range(len(IDENTITY_GROUPS)):
+            self.window_counts[i] += counts[i] - oldest[i]
+        self.count_history[self.history_position] = counts
+        self.history_position = (self.history_position + 1) % len(self.count_history)
+        self.rounds_recorded += 1
+    
+    def get_last_round_counts(self):
+        if self.rounds_recorded == 0:
+            return {group: 0 for group in IDENTITY_GROUPS}
+        last = self.count_history[self.history_position - 1]
+        return {group: last[i] for i, group in enumerate(IDENTITY_GROUPS)}
     
     def get_current_population_ratios(self):
-        if not self.current_visitors:
+        if self.population == 0:
             return {group: 0.0 for group in IDENTITY_GROUPS}
         
-        counts = {group: 0 for group in IDENTITY_GROUPS}
-        for visitor in self.current_visitors:
-            counts[visitor] += 1
-        
-        total = len(self.current_visitors)
-        return {group: counts[group] / total for group in IDENTITY_GROUPS}
+        # Read ratios from the running counts instead of rescanning visitors
+        total = self.population
+        return {group: self.visitor_counts[group] / total for group in IDENTITY_GROUPS}
+    
+    def get_group_ratio(self, group):
+        if self.population == 0:
+            return 0.0
+        return self.visitor_counts[group] / self.population
 
 
 # Define three identity groups
 IDENTITY_GROUPS = ["QW", "NQW", "QNW"]
+GROUP_INDEX = {group: i for i, group in enumerate(IDENTITY_GROUPS)}
+
+# Possible agent statuses and their integer codes
+AGENT_STATUSES = ["active", "temp_exited", "permanently_exited"]
+ACTIVE, TEMP_EXITED, PERM_EXITED = range(len(AGENT_STATUSES))
 
 # Base belonging matrix - represents belonging relationships between different groups
 BASE_BELONGING_MATRIX = {
@@ -90,61 +179,96 @@ BASE_BELONGING_MATRIX = {
 # Standard deviation for normal distribution of belonging values
 BELONGING_STD_DEV = 0.1
 
+# Base belonging matrix as a (3, 3) array in IDENTITY_GROUPS order
+BASE_BELONGING_ARRAY = np.array([[BASE_BELONGING_MATRIX[from_group][to_group] for to_group in IDENTITY_GROUPS]
+                                 for from_group in IDENTITY_GROUPS])
+
+
+def generate_belonging_rows(group_codes, rng):
+    """
+    Draw every agent's own belonging row at once as an (N, 3) array,
+    clipped to [0, 1], from a numpy Generator
+    """
+    means = BASE_BELONGING_ARRAY[np.asarray(group_codes, dtype=np.int64)]
+    return np.clip(rng.normal(means, BELONGING_STD_DEV), 0.0, 1.0)
+
+
 # Create PersonAgent class
 class PersonAgent(mesa.Agent):
-    def __init__(self, model, identity_group, threshold=0.5):
+    # Compact layout: identity group and status are stored as integer codes,
+    # and only the agent's own row of its belonging matrix is kept
+    __slots__ = ("group_code", "threshold", "status_code", "current_bar", "exit_counter",
+                 "cooldown_duration", "exit_attempts", "belonging_row", "last_bar_scores",
+                 "has_scores")
+    
+    def __init__(self, model, identity_group, threshold=0.5, cooldown_duration=None, belonging_row=None):
         super().__init__(model)  
-        self.identity_group = identity_group
+        self.group_code = GROUP_INDEX[identity_group]
         self.threshold = threshold  
-        self.last_bar_scores = {} 
         self.current_bar = None  
-        self.status = "active"  
+        self.status_code = ACTIVE
         self.exit_counter = 0  
-        self.cooldown_duration = model.random.randint(5, 15)
+        if cooldown_duration is None:
+            cooldown_duration = model.random.randint(5, 15)
+        self.cooldown_duration = cooldown_duration
         self.exit_attempts = 0  
-        self.permanent_exit = False  
-        self.belonging_matrix = self.generate_belonging_matrix()
+        
+        # Only the row for the agent's own identity group is ever read;
+        # the model normally draws all rows at once and passes them in
+        if belonging_row is None:
+            belonging_matrix = self.generate_belonging_matrix()
+            belonging_row = [belonging_matrix[identity_group][group] for group in IDENTITY_GROUPS]
+        self.belonging_row = array("d", belonging_row)
+        
+        # Last belonging score per bar, NaN while the bar has no score (None)
+        self.last_bar_scores = array("d", [NAN]) * len(model.bars)
+        self.has_scores = False
+        
+        # Register with the model's per-(status, group) counters
+        model.status_counts[self.status][self.identity_group] += 1
     
-        # Initialize last scores for all bars as None
-        for bar_id in range(2):
-            self.last_bar_scores[bar_id] = None
+    @property
+    def identity_group(self):
+        return IDENTITY_GROUPS[self.group_code]
+    
+    @property
+    def status(self):
+        return AGENT_STATUSES[self.status_code]
+    
+    @property
+    def permanent_exit(self):
+        return self.status_code == PERM_EXITED
     
     def generate_belonging_matrix(self):
-        personal_matrix = {}
-        
         # Seed the random generator with the agent ID for reproducibility
         rng = np.random.RandomState(self.unique_id)
         
-        # Generate values for all group combinations
-        for from_group in IDENTITY_GROUPS:
-            personal_matrix[from_group] = {}
-            for to_group in IDENTITY_GROUPS:
-                # Use group pair mean and sample from normal distribution
-                mean = BASE_BELONGING_MATRIX[from_group][to_group]
-                value = rng.normal(mean, BELONGING_STD_DEV)
-                # Clamp between 0 and 1
-                value = max(0.0, min(1.0, value))
-                personal_matrix[from_group][to_group] = value
+        # Sample all group pairs around their base values in one call (same
+        # values as one scalar draw per pair) and clamp between 0 and 1
+        values = np.clip(rng.normal(BASE_BELONGING_ARRAY, BELONGING_STD_DEV), 0.0, 1.0)
+        
+        personal_matrix = {}
+        for i, from_group in enumerate(IDENTITY_GROUPS):
+            personal_matrix[from_group] = dict(zip(IDENTITY_GROUPS, values[i].tolist()))
         
         return personal_matrix
     
     def calculate_belonging(self, bar):
-        if self.status == "temp_exited" or self.status == "permanently_exited" or self.permanent_exit:
+        if self.status_code != ACTIVE:
             return 0.0
         
         alpha = self.model.alpha  # Weight of structural inclusion
         
         # Get the bar's current affinity for the agent's group
-        effective_affinity = bar.calculate_effective_affinity()
-        bar_affinity = effective_affinity[self.identity_group]
+        bar_affinity = bar.effective_list[self.group_code]
         
         # Compute influence of peer group composition
         population_ratios = bar.get_current_population_ratios()
         social_belonging = 0.0
         
-        for other_group in IDENTITY_GROUPS:
+        for i, other_group in enumerate(IDENTITY_GROUPS):
             # Get personal coefficient toward each group 
-            group_belonging = self.belonging_matrix[self.identity_group][other_group]
+            group_belonging = self.belonging_row[i]
             # Multiply by population share
             social_belonging += group_belonging * population_ratios[other_group]
         
@@ -153,64 +277,68 @@ class PersonAgent(mesa.Agent):
         
         return total_belonging
     
+    def set_status(self, status):
+        # Move the agent between the model's status counters
+        counts = self.model.status_counts
+        group = self.identity_group
+        counts[self.status][group] -= 1
+        counts[status][group] += 1
+        self.status_code = AGENT_STATUSES.index(status)
+    
     def update_last_score(self, bar_id, belonging_score):
         self.last_bar_scores[bar_id] = belonging_score
+        self.has_scores = True
+    
+    def clear_last_scores(self):
+        for bar_id in range(len(self.last_bar_scores)):
+            self.last_bar_scores[bar_id] = NAN
+        self.has_scores = False
     
     def choose_bar(self):
-        if self.status == "permanently_exited" or self.permanent_exit:
+        if self.status_code == PERM_EXITED:
             return None
             
-        if self.status == "temp_exited":
+        if self.status_code == TEMP_EXITED:
             self.exit_counter += 1
 
             if self.exit_counter >= self.cooldown_duration:
                 if self.exit_attempts >= 2: 
-                    self.status = "permanently_exited"
-                    self.permanent_exit = True
+                    self.set_status("permanently_exited")
                     return None
                 else:
-                    self.status = "active"
+                    self.set_status("active")
                     self.exit_counter = 0
                     # Clear last scores when returning from temp exit
-                    for bar_id in range(2):
-                        self.last_bar_scores[bar_id] = None
+                    self.clear_last_scores()
             else:
                 return None
 
         current_step = self.model.steps
         
         # During initial steps or when no previous scores: choose based on bar affinity
-        if current_step < 5 or all(score is None for score in self.last_bar_scores.values()):
-            # Calculate affinity score for each bar
-            bar_affinities = []
-            for bar_id, bar in enumerate(self.model.bars):
-                effective_affinity = bar.calculate_effective_affinity()
-                affinity = effective_affinity[self.identity_group]
-                bar_affinities.append((bar_id, affinity))
+        if current_step < 5 or not self.has_scores:
+            # Affinity of every bar for the agent's group
+            weights = self.model.effective_weights[self.identity_group]
+            bar_ids = range(len(weights))
             
             # Choose a bar weighted by Affinity
-            weights = [tol for _, tol in bar_affinities]
-            bar_ids = [bid for bid, _ in bar_affinities]
-            
             if sum(weights) > 0:
-                chosen_bar = random.choices(bar_ids, weights=weights, k=1)[0]
+                chosen_bar = self.model.random.choices(bar_ids, weights=weights, k=1)[0]
                 return chosen_bar
             else:
                 # If all weights are zero, pick randomly
-                chosen_bar = random.choice(range(2))
+                chosen_bar = self.model.random.choice(bar_ids)
                 return chosen_bar
         
         # After initial rounds: choose based on last belonging scores
-        valid_bars = []
-        
-        for bar_id in range(2):
-            last_score = self.last_bar_scores[bar_id]
-            if last_score is not None and last_score >= self.threshold:
-                valid_bars.append(bar_id)
+        # (NaN, i.e. no score, never passes the threshold)
+        threshold = self.threshold
+        valid_bars = [bar_id for bar_id, last_score in enumerate(self.last_bar_scores)
+                      if last_score >= threshold]
         
         # No valid bar found: temporarily exit
         if not valid_bars:
-            self.status = "temp_exited"
+            self.set_status("temp_exited")
             self.exit_counter = 0
             self.exit_attempts += 1
             return None
@@ -222,10 +350,10 @@ class PersonAgent(mesa.Agent):
             
             if total_score > 0:
                 probs = [valid_scores[bar_id] / total_score for bar_id in valid_bars]
-                chosen_bar = random.choices(valid_bars, weights=probs, k=1)[0]
+                chosen_bar = self.model.random.choices(valid_bars, weights=probs, k=1)[0]
                 return chosen_bar
             else:
-                chosen_bar = random.choice(valid_bars)
+                chosen_bar = self.model.random.choice(valid_bars)
                 return chosen_bar
         
         return None
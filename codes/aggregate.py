@@ -0,0 +1,305 @@
+import numpy as np
+from numpy.polynomial.hermite_e import hermegauss
+from agent import (IDENTITY_GROUPS, GROUP_INDEX, AGENT_STATUSES, ACTIVE, TEMP_EXITED, PERM_EXITED,
+                   BASE_BELONGING_ARRAY, BELONGING_STD_DEV)
+from metrics import MetricsCollector
+from model import make_bar_configs, reporter_dtypes
+
+QW = IDENTITY_GROUPS.index("QW")
+
+# Agent threshold distribution: uniform within THRESHOLD_SPREAD of the
+# base threshold, as drawn by LGBTQBarModel
+BASE_THRESHOLD = 0.55
+THRESHOLD_SPREAD = 0.15
+
+# Cooldown durations drawn by LGBTQBarModel (randint, both ends included)
+COOLDOWNS = np.arange(5, 16)
+
+# Columns of a cell key; the remaining columns hold one score bin per bar
+# (0 while the bar has no score)
+TYPE, STATUS, ATTEMPTS, COOLDOWN, REMAINING = range(5)
+SCORES = 5
+
+# Occupied cells grow about threefold per bar (one score bin per bar in
+# the key): with the default settings some 5e5 cells after 40 steps at 6
+# bars, taking ~0.5s a step. More bars are refused rather than left to
+# exhaust memory; use the agent engines for them
+MAX_BARS = 6
+
+
+def belonging_nodes(group_code, num_nodes):
+    """
+    Quadrature of one group's personal belonging rows: the clipped
+    N(base, BELONGING_STD_DEV) distribution of each entry is represented by
+    num_nodes Gauss-Hermite nodes, and rows are their product over the
+    three entries. Returns (rows, weights) with weights summing to 1
+    """
+    nodes, weights = hermegauss(num_nodes)
+    weights = weights / weights.sum()
+    base = BASE_BELONGING_ARRAY[group_code]
+    values = np.clip(base[:, None] + BELONGING_STD_DEV * nodes[None, :], 0.0, 1.0)
+    grid = np.stack(np.meshgrid(*[np.arange(num_nodes)] * len(base), indexing="ij"), axis=-1)
+    grid = grid.reshape(-1, len(base))
+    rows = values[np.arange(len(base)), grid]
+    return rows, weights[grid].prod(axis=1)
+
+
+# Mean-field version of LGBTQBarModel for very large populations. Instead
+# of agents it tracks the fraction of the population in each cell of
+# (agent type, status, exit attempts, cooldown, remaining cooldown, score
+# bin per bar), where an agent type is an identity group with one
+# quadrature node of the belonging rows and of the thresholds. Every step
+# moves the expected fraction of each cell along the model's choice rules,
+# so per-step cost depends on the number of occupied cells, not on N.
+#
+# Arrivals are scored against the round's final bar composition: for large
+# N the sequential and synchronous update modes coincide. Scores are
+# rounded to score_bins bins in [0, 1]. At most MAX_BARS bars are supported.
+# Reporters have the DataCollector names, with populations and agent counts
+# as expected (fractional) values.
+#
+#     model = AggregateBarModel(population_size=5_000_000, gamma=0.3)
+#     for _ in range(100):
+#         model.step()
+#     model.datacollector.get_model_vars_dataframe()
+class AggregateBarModel:
+    def __init__(self,
+                 population_size=200,
+                 alpha=0.5,
+                 gamma=0.5,
+                 init_identity_ratios=None,
+                 QW_ratio=0.4,
+                 QNW_ratio=0.3,
+                 adaptive_update_interval=10,
+                 num_bars=2,
+                 bar_affinities=None,
+                 bar_names=None,
+                 score_bins=50,
+                 belonging_nodes_per_entry=3,
+                 threshold_nodes=6):
+        self.num_agents = population_size
+        self.alpha = alpha
+        self.gamma = gamma
+        self.interval = adaptive_update_interval
+        self.score_bins = score_bins
+        self.running = True
+        self.steps = 0
+
+        if init_identity_ratios is None:
+            init_identity_ratios = {"QW": QW_ratio, "NQW": 1.0 - QW_ratio - QNW_ratio, "QNW": QNW_ratio}
+
+        # Bars: fixed, adaptive and effective (K, 3) affinities as in the model
+        bar_configs = make_bar_configs(num_bars, bar_affinities, bar_names)
+        if len(bar_configs) > MAX_BARS:
+            raise ValueError(f"AggregateBarModel supports at most {MAX_BARS} bars, got {len(bar_configs)}")
+        self.num_bars = len(bar_configs)
+        self.bar_names = [name for name, _, _ in bar_configs]
+        self.reporter_prefixes = [prefix for _, prefix, _ in bar_configs]
+        self.fixed = np.array([[affinity[group] for group in IDENTITY_GROUPS] for _, _, affinity in bar_configs])
+        self.adaptive = self.fixed / self.fixed.sum(axis=1, keepdims=True)
+        self.effective = gamma * self.fixed + (1 - gamma) * self.adaptive
+
+        # This round's expected arrivals per (bar, group) and the ring buffer
+        # of the last `interval` rounds with its rolling sum
+        n_groups = len(IDENTITY_GROUPS)
+        self.counts = np.zeros((self.num_bars, n_groups))
+        self.count_history = np.zeros((self.interval, self.num_bars, n_groups))
+        self.window_counts = np.zeros((self.num_bars, n_groups))
+        self.history_position = 0
+        self.rounds_recorded = 0
+        self.update_count = 0
+
+        # Group shares follow the model's cumulative assignment of identities
+        cumulative = np.minimum(np.cumsum([0.0] + list(init_identity_ratios.values())), 1.0)
+        group_shares = dict(zip(init_identity_ratios, np.diff(cumulative)))
+
+        # Agent types: group x belonging node x threshold node (midpoints of
+        # equal-probability slices of the uniform threshold distribution)
+        thresholds = BASE_THRESHOLD + THRESHOLD_SPREAD * ((np.arange(threshold_nodes) + 0.5) / threshold_nodes * 2 - 1)
+        type_group, type_belonging, type_threshold, type_share = [], [], [], []
+        for group in IDENTITY_GROUPS:
+            rows, weights = belonging_nodes(GROUP_INDEX[group], belonging_nodes_per_entry)
+            for row, weight in zip(rows, weights):
+                for threshold in thresholds:
+                    type_group.append(GROUP_INDEX[group])
+                    type_belonging.append(row)
+                    type_threshold.append(threshold)
+                    type_share.append(group_shares.get(group, 0.0) * weight / threshold_nodes)
+        self.type_group = np.array(type_group, dtype=np.int64)
+        self.type_belonging = np.array(type_belonging)
+        self.type_threshold = np.array(type_threshold)
+
+        # Every agent starts active, with no exits and no scores
+        occupied = np.flatnonzero(np.array(type_share) > 0)
+        self.keys = np.zeros((len(occupied), SCORES + self.num_bars), dtype=np.int64)
+        self.keys[:, TYPE] = occupied
+        self.keys[:, STATUS] = ACTIVE
+        self.mass = np.array(type_share)[occupied]
+
+        # Sizes of the key columns, to merge cells on one integer code per
+        # key; None when the codes would not fit in an int64
+        self.key_dims = ((len(type_share), len(AGENT_STATUSES), 3, COOLDOWNS.max() + 1, COOLDOWNS.max() + 1)
+                         + (score_bins + 1,) * self.num_bars)
+        if np.prod([float(size) for size in self.key_dims]) >= 2 ** 63:
+            self.key_dims = None
+
+        self.datacollector = MetricsCollector(self.reporter_dtypes())
+
+    @property
+    def num_cells(self):
+        return len(self.mass)
+
+    def reporter_dtypes(self):
+        # The model's reporters; counts are expected values, so all are floats
+        return {name: np.float64 for name in reporter_dtypes(self.reporter_prefixes)}
+
+    def score_values(self, bins):
+        # Centre of each score bin, NaN for no score
+        with np.errstate(invalid="ignore"):
+            return np.where(bins > 0, (bins - 0.5) / self.score_bins, np.nan)
+
+    def advance_cooldowns(self):
+        keys = self.keys
+        temp = keys[:, STATUS] == TEMP_EXITED
+        keys[temp, REMAINING] -= 1
+        done = temp & (keys[:, REMAINING] <= 0)
+        to_perm = done & (keys[:, ATTEMPTS] >= 2)
+        returning = done & ~to_perm
+        keys[to_perm, STATUS] = PERM_EXITED
+        keys[to_perm, ATTEMPTS:] = 0
+        # Returning agents come back with no scores (cleared on exit)
+        keys[returning, STATUS] = ACTIVE
+        keys[returning, REMAINING] = 0
+
+    def choice_probabilities(self, keys):
+        """
+        (cells, K) probability of choosing each bar for active cells; rows of
+        cells whose agents all exit this step are zero
+        """
+        groups = self.type_group[keys[:, TYPE]]
+        bins = keys[:, SCORES:]
+        probs = np.zeros((len(keys), self.num_bars))
+
+        # During initial steps or with no previous scores: weight by bar affinity
+        if self.steps < 5:
+            warm = np.ones(len(keys), dtype=bool)
+        else:
+            warm = (bins == 0).all(axis=1)
+        weights = self.effective[:, groups[warm]].T
+        total = weights.sum(axis=1, keepdims=True)
+        # If all weights are zero, pick uniformly
+        probs[warm] = np.where(total > 0, weights / np.where(total > 0, total, 1.0), 1.0 / self.num_bars)
+
+        # After initial rounds: bars scoring above the threshold, weighted by score
+        scores = self.score_values(bins[~warm])
+        with np.errstate(invalid="ignore"):
+            valid = scores >= self.type_threshold[keys[~warm, TYPE], None]
+        weights = np.where(valid, scores, 0.0)
+        total = weights.sum(axis=1, keepdims=True)
+        count = valid.sum(axis=1, keepdims=True)
+        probs[~warm] = np.where(total > 0, weights / np.where(total > 0, total, 1.0),
+                                valid / np.maximum(count, 1))
+        return probs
+
+    def merge(self, keys, mass):
+        # Sum the mass of identical cells
+        keep = mass > 0
+        if self.key_dims is None:
+            keys, inverse = np.unique(keys[keep], axis=0, return_inverse=True)
+        else:
+            codes, inverse = np.unique(np.ravel_multi_index(keys[keep].T, self.key_dims), return_inverse=True)
+            keys = np.stack(np.unravel_index(codes, self.key_dims), axis=1)
+        self.keys = keys
+        self.mass = np.bincount(inverse.ravel(), weights=mass[keep], minlength=len(keys))
+
+    def step(self):
+        self.steps += 1
+        self.advance_cooldowns()
+        keys, mass = self.keys, self.mass
+        active = keys[:, STATUS] == ACTIVE
+        others = ~active
+        keys_active, mass_active = keys[active], mass[active]
+        probs = self.choice_probabilities(keys_active)
+
+        # No valid bar found: temporarily exit. The cooldown of a first exit
+        # is drawn from COOLDOWNS; an agent keeps it for a second exit
+        leaving = probs.sum(axis=1) == 0
+        exits = keys_active[leaving]
+        exit_mass = mass_active[leaving]
+        exits[:, STATUS] = TEMP_EXITED
+        exits[:, ATTEMPTS] += 1
+        exits[:, SCORES:] = 0
+        undrawn = exits[:, COOLDOWN] == 0
+        drawn = exits[undrawn].repeat(len(COOLDOWNS), axis=0)
+        drawn[:, COOLDOWN] = np.tile(COOLDOWNS, undrawn.sum())
+        drawn_mass = exit_mass[undrawn].repeat(len(COOLDOWNS)) / len(COOLDOWNS)
+        exits = np.concatenate([exits[~undrawn], drawn])
+        exit_mass = np.concatenate([exit_mass[~undrawn], drawn_mass])
+        exits[:, REMAINING] = exits[:, COOLDOWN]
+
+        # Expected arrivals per (bar, group), and the final composition
+        groups = self.type_group[keys_active[:, TYPE]]
+        n_groups = len(IDENTITY_GROUPS)
+        self.counts = self.num_agents * (np.eye(n_groups)[groups] * mass_active[:, None]).T @ probs
+        self.counts = self.counts.T
+        population = self.counts.sum(axis=1, keepdims=True)
+        ratios = self.counts / np.where(population > 0, population, 1.0)
+
+        # Score of every agent type in every bar, rounded to its bin
+        type_scores = (self.alpha * self.effective[:, self.type_group].T
+                       + (1 - self.alpha) * self.type_belonging @ ratios.T)
+        type_bins = np.clip(np.floor(type_scores * self.score_bins).astype(np.int64), 0, self.score_bins - 1) + 1
+
+        # Each cell splits over the bars its agents choose, with the chosen
+        # bar's score replaced by this round's
+        rows, bars = np.nonzero(probs)
+        arrivals = keys_active[rows]
+        arrivals[np.arange(len(rows)), SCORES + bars] = type_bins[arrivals[:, TYPE], bars]
+        arrival_mass = mass_active[rows] * probs[rows, bars]
+
+        self.merge(np.concatenate([keys[others], exits, arrivals]),
+                   np.concatenate([mass[others], exit_mass, arrival_mass]))
+        self.end_round()
+        self.datacollector.collect(self)
+
+    def end_round(self):
+        # Record the round in the ring buffer and, every interval rounds,
+        # set the adaptive affinity to the window's average group ratios
+        oldest = self.count_history[self.history_position]
+        self.window_counts += self.counts - oldest
+        self.count_history[self.history_position] = self.counts
+        self.history_position = (self.history_position + 1) % self.interval
+        self.rounds_recorded += 1
+
+        self.update_count += 1
+        if self.update_count >= self.interval:
+            if self.rounds_recorded > 0:
+                total = self.window_counts.sum(axis=1, keepdims=True)
+                self.adaptive[:] = np.where(total > 0, self.window_counts / np.where(total > 0, total, 1.0), 0.0)
+                self.effective[:] = self.gamma * self.fixed + (1 - self.gamma) * self.adaptive
+            self.update_count = 0
+
+    def status_counts(self):
+        # (statuses, groups) expected number of agents
+        n_groups = len(IDENTITY_GROUPS)
+        codes = self.keys[:, STATUS] * n_groups + self.type_group[self.keys[:, TYPE]]
+        counts = np.bincount(codes, weights=self.mass, minlength=len(AGENT_STATUSES) * n_groups)
+        return self.num_agents * counts.reshape(len(AGENT_STATUSES), n_groups)
+
+    def compute_metrics(self):
+        metrics = {}
+        population = self.counts.sum(axis=1)
+        for bar_id, prefix in enumerate(self.reporter_prefixes):
+            for i, group in enumerate(IDENTITY_GROUPS):
+                metrics[f"{prefix}_{group}_Ratio"] = (self.counts[bar_id, i] / population[bar_id]
+                                                     if population[bar_id] > 0 else 0.0)
+            metrics[f"{prefix}_Population"] = population[bar_id]
+            for i, group in enumerate(IDENTITY_GROUPS):
+                metrics[f"{prefix}_{group}_AdaptiveAffinity"] = self.adaptive[bar_id, i]
+            metrics[f"{prefix}_QW_EffectiveAffinity"] = self.effective[bar_id, QW]
+        status_counts = self.status_counts()
+        metrics["TempExited_Agents"] = status_counts[TEMP_EXITED].sum()
+        metrics["PermExited_Agents"] = status_counts[PERM_EXITED].sum()
+        for i, group in enumerate(IDENTITY_GROUPS):
+            metrics[f"Active_{group}"] = status_counts[ACTIVE, i]
+        return metrics
@@ -3,96 +3,175 @@ from mesa.visualization import Slider, SolaraViz
 import solara
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
-import random
+import numpy as np
+from agent import TEMP_EXITED, PERM_EXITED
+from live import LiveRunner, get_agent_states
 from mesa.visualization.utils import update_counter, force_update
 
-# Create agent map component
-@solara.component
-def AgentMapComponent(model):
 
-    update_counter.get()
-    
+def get_bar_positions(num_bars):
+    # Bars spread evenly along the middle of the map
+    return [(0.1 + 0.8 * (i + 0.5) / num_bars, 0.5) for i in range(num_bars)]
+
+
+def get_bar_color(bar_id):
+    # Blue and green for the first two bars, then the tab10 palette
+    if bar_id < 2:
+        return ["blue", "green"][bar_id]
+    return plt.cm.tab10(bar_id % 10)
+
+
+# Colors for each identity group
+GROUP_COLORS = {
+    "QW": "red",
+    "NQW": "pink",
+    "QNW": "purple"
+}
+
+# Fixed coordinates of the exit zones
+TEMP_EXIT_POSITION = (0.5, 0.2)
+PERM_EXIT_POSITION = (0.5, 0.8)
+
+
+# Longest series drawn by the trend components; longer runs are thinned
+MAX_TREND_POINTS = 2000
+
+
+def get_trend_series(model, names):
+    """
+    (steps, [values per reporter]) collected so far, read from the model's
+    data collector rather than from separate dashboard histories. Columns
+    of the numpy and memmap collectors are views, so only the rows drawn
+    are read; runs longer than MAX_TREND_POINTS steps are thinned, keeping
+    the latest step
+    """
+    collector = model.datacollector
+    if hasattr(collector, "get_column"):
+        columns = [collector.get_column(name) for name in names]
+    else:
+        # Mesa DataCollector
+        columns = [np.asarray(collector.model_vars.get(name, [])) for name in names]
+    length = len(columns[0])
+    stride = max(1, -(-length // MAX_TREND_POINTS))
+    start = (length - 1) % stride if length else 0
+    steps = np.arange(model.steps - length + 1, model.steps + 1)[start::stride]
+    return steps, [column[start::stride] for column in columns]
+
+
+def use_figure(model, create):
+    """
+    Figure of one component, built once per model by create() and kept in
+    the component's state for later renders; create returns (figure,
+    artists to update). A hook, so call it unconditionally
+    """
+    return solara.use_memo(create, dependencies=[model])
+
+
+def show_figure(model, fig, format="svg"):
+    # Re-render the figure image only when the model has stepped
+    return solara.FigureMatplotlib(figure=fig, dependencies=[id(model), model.steps], format=format)
+
+
+def update_step_axis(ax, steps, autoscale_y=False):
+    # Rescale to the updated lines and keep integer x-axis ticks
+    ax.relim()
+    ax.autoscale_view(scalex=True, scaley=autoscale_y)
+    if len(steps) > 1:
+        ax.set_xticks(range(0, max(steps) + 1, max(1, max(steps) // 10)))
+
+
+def create_trend_figure(lines):
+    """
+    Trend figure with one empty line per (label, color); returns the
+    figure, its axes and the line artists in the same order
+    """
+    fig = Figure(figsize=(12, 5))  # Reduced height
+    ax = fig.add_subplot(111)
+    artists = [ax.plot([], [], label=label, color=color, marker='o', markersize=4, linewidth=2)[0]
+               for label, color in lines]
+    return fig, ax, artists
+
+
+def create_agent_map(bar_names, bar_positions):
+    """
+    Agent map figure with the bar and exit zones drawn and one empty
+    scatter per identity group; returns (figure, (axes, scatters))
+    """
     fig = Figure(figsize=(10, 6))
     ax = fig.add_subplot(111)
     
-    # Set fixed coordinates for bar and exit zones
-    bar_positions = [(0.3, 0.5), (0.7, 0.5)] 
-    temp_exit_position = (0.5, 0.2)  
-    perm_exit_position = (0.5, 0.8)
-    
     # Draw bar positions
-    for i, pos in enumerate(bar_positions):
-        if i < len(model.bars):
-            ax.scatter(pos[0], pos[1], s=300, color='gray', alpha=0.5, marker='s')
-            ax.text(pos[0], pos[1], model.bars[i].name, ha='center', va='center', fontsize=13)
+    for name, pos in zip(bar_names, bar_positions):
+        ax.scatter(pos[0], pos[1], s=300, color='gray', alpha=0.5, marker='s')
+        ax.text(pos[0], pos[1], name, ha='center', va='center', fontsize=13)
     
     # Draw temporary exit zone
-    ax.scatter(temp_exit_position[0], temp_exit_position[1], s=300, color='orange', alpha=0.2, marker='s')
-    ax.text(temp_exit_position[0], temp_exit_position[1], 'Temp Exit (5-15 rounds)', ha='center', va='center', fontsize=13)
+    ax.scatter(TEMP_EXIT_POSITION[0], TEMP_EXIT_POSITION[1], s=300, color='orange', alpha=0.2, marker='s')
+    ax.text(TEMP_EXIT_POSITION[0], TEMP_EXIT_POSITION[1], 'Temp Exit (5-15 rounds)', ha='center', va='center', fontsize=13)
     
     # Draw permanent exit zone
-    ax.scatter(perm_exit_position[0], perm_exit_position[1], s=300, color='red', alpha=0.2, marker='s')
-    ax.text(perm_exit_position[0], perm_exit_position[1], 'Permanent Exit', ha='center', va='center', fontsize=13)
-    
-    # Define colors for each identity group
-    colors = {
-        "QW": "red",
-        "NQW": "pink", 
-        "QNW": "purple"
-    }
-    
-    # Count agents in each area
-    temp_count = 0
-    perm_count = 0
-    bar_counts = [0, 0]
-    
-    # Draw each agent
-    for agent in model.agents:
-        # Determine agent position
-        if agent.status == "permanently_exited" or agent.permanent_exit:
-            # If permanently exited, place randomly near permanent exit zone
-            x = perm_exit_position[0] + (random.random() - 0.5) * 0.2
-            y = perm_exit_position[1] + (random.random() - 0.5) * 0.2
-            perm_count += 1
-        elif agent.status == "temp_exited":
-            # If temporarily exited, place randomly near temporary exit zone
-            x = temp_exit_position[0] + (random.random() - 0.5) * 0.2
-            y = temp_exit_position[1] + (random.random() - 0.5) * 0.2
-            temp_count += 1
-        elif agent.current_bar is not None:
-            # If in a bar, place randomly near the bar location
-            bar_pos = bar_positions[agent.current_bar]
-            x = bar_pos[0] + (random.random() - 0.5) * 0.2
-            y = bar_pos[1] + (random.random() - 0.5) * 0.2
-            if agent.current_bar < len(bar_counts):
-                bar_counts[agent.current_bar] += 1
-        else:
-            # Skip if no valid location
-            continue
-        
-        # Draw point using identity group color
-        ax.scatter(x, y, s=50, color=colors[agent.identity_group], alpha=0.7)
-    
-    # Add legend
-    for group, color in colors.items():
-        ax.scatter([], [], color=color, label=group)
+    ax.scatter(PERM_EXIT_POSITION[0], PERM_EXIT_POSITION[1], s=300, color='red', alpha=0.2, marker='s')
+    ax.text(PERM_EXIT_POSITION[0], PERM_EXIT_POSITION[1], 'Permanent Exit', ha='center', va='center', fontsize=13)
     
+    # One scatter per identity group, whose points are moved on updates
+    scatters = [ax.scatter(np.empty(0), np.empty(0), s=50, color=color, alpha=0.7, label=group)
+                for group, color in GROUP_COLORS.items()]
     ax.legend(loc='upper right')
     
-    # Set axis limits and plot title
+    # Set axis limits and hide axis ticks
     ax.set_xlim(0, 1)
     ax.set_ylim(0, 1)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    return fig, (ax, scatters)
+
+
+def update_agent_map(ax, scatters, bar_positions, groups, statuses, current_bars, jitter, step, shown=None):
+    """
+    Move each group's points to its agents' zones; shown optionally
+    selects the agents drawn (counts in the title cover all agents)
+    """
+    # Anchor of each agent's zone: permanent exit, temporary exit or its bar
+    perm = statuses == PERM_EXITED
+    temp = statuses == TEMP_EXITED
+    in_bar = ~perm & ~temp & (current_bars >= 0)
+    anchors = np.full((len(groups), 2), np.nan)
+    anchors[perm] = PERM_EXIT_POSITION
+    anchors[temp] = TEMP_EXIT_POSITION
+    anchors[in_bar] = np.array(bar_positions)[current_bars[in_bar]]
+    positions = anchors + jitter
+    
+    # Agents without a valid location are not drawn
+    visible = perm | temp | in_bar
+    if shown is not None:
+        visible &= shown
+    for group_code, scatter in enumerate(scatters):
+        scatter.set_offsets(positions[visible & (groups == group_code)])
     
     # Show agent count summary (for debugging)
-    step_text = model.steps
-    title = f'Agent Distribution (Step: {step_text}, Active: {sum(bar_counts)}, Temp: {temp_count}, Perm: {perm_count})'
+    title = (f'Agent Distribution (Step: {step}, Active: {int(in_bar.sum())}, '
+             f'Temp: {int(temp.sum())}, Perm: {int(perm.sum())})')
     ax.set_title(title)
+
+
+# Create agent map component
+@solara.component
+def AgentMapComponent(model):
+
+    update_counter.get()
     
-    # Hide axis ticks
-    ax.set_xticks([])
-    ax.set_yticks([])
+    bar_positions = get_bar_positions(len(model.bars))
+    fig, (ax, scatters) = use_figure(
+        model, lambda: create_agent_map([bar.name for bar in model.bars], bar_positions))
+    groups, statuses, current_bars = get_agent_states(model)
+    
+    # Each agent keeps its offset from its zone's anchor across frames
+    jitter = solara.use_memo(lambda: (np.random.default_rng().random((len(groups), 2)) - 0.5) * 0.2,
+                             dependencies=[model])
+    update_agent_map(ax, scatters, bar_positions, groups, statuses, current_bars, jitter, model.steps)
     
-    return solara.FigureMatplotlib(figure=fig)
+    # Raster output stays fast with thousands of points
+    return show_figure(model, fig, format="png")
 
 # Create bar population proportion component
 @solara.component
@@ -100,206 +179,96 @@ def BarProportionTrendsComponent(model):
 
     update_counter.get()
     
-    # Get current simulation step
-    current_step = model.steps
+    def create(bar_id):
+        fig, ax, lines = create_trend_figure(list(GROUP_COLORS.items()))
+        ax.set_xlabel('Step')
+        ax.set_ylabel('Proportion')
+        ax.set_title(f'{model.bars[bar_id].name} Visitor Proportion by Group')
+        ax.set_ylim(0, 1)
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.legend()
+        fig.tight_layout()  # Ensure tight layout
+        return fig, (ax, lines)
     
-    # Initialize time series history on first step
-    if not hasattr(model, 'time_series_history'):
-        model.time_series_history = {
-            'steps': [],
-            'bars': {},
-        }
-        # Initialize data structures for each bar
-        for i in range(len(model.bars)):
-            model.time_series_history['bars'][i] = {
-                'QW': [],
-                'NQW': [],
-                'QNW': [],
-                'total': []
-            }
-    
-    # Only record once per step
-    if not model.time_series_history['steps'] or model.time_series_history['steps'][-1] != current_step:
-        # Record current step
-        model.time_series_history['steps'].append(current_step)
-        
-        # Collect data per bar using visitor history
-        for bar_id, bar in enumerate(model.bars):
-            # Use last round of visitor history
-            if bar.visitor_history and len(bar.visitor_history) > 0:
-                last_visitors = bar.visitor_history[-1]
-                
-                # Count visitors by group
-                counts = {'QW': 0, 'NQW': 0, 'QNW': 0}
-                for visitor in last_visitors:
-                    counts[visitor] += 1
-                
-                total_visitors = sum(counts.values())
-                
-                # Log counts and total to time series history
-                for group in counts:
-                    model.time_series_history['bars'][bar_id][group].append(counts[group])
-                model.time_series_history['bars'][bar_id]['total'].append(total_visitors)
-            else:
-                # Append zero if no history
-                for group in ['QW', 'NQW', 'QNW']:
-                    model.time_series_history['bars'][bar_id][group].append(0)
-                model.time_series_history['bars'][bar_id]['total'].append(0)
+    # One figure per bar, built together so the hook is called once
+    figures = use_figure(model, lambda: [create(bar_id) for bar_id in range(len(model.bars))])
     
     # Create time series plot for each bar
     with solara.Column():
         
-        for bar_id in range(len(model.bars)):
+        for bar_id, bar in enumerate(model.bars):
+            names = [f"{bar.reporter_prefix}_{group}_Ratio" for group in GROUP_COLORS]
+            steps, ratios = get_trend_series(model, names)
             # Get current total population
-            current_total = (model.time_series_history['bars'][bar_id]['total'][-1] 
-                           if model.time_series_history['bars'][bar_id]['total'] else 0)
+            current_total = bar.population if model.steps > 0 else 0
             
             solara.Markdown(f"### {model.bars[bar_id].name} Population Proportion Trends (Current Total: {current_total})")
             
-            # Create proportion trend plot
-            fig = Figure(figsize=(12, 5))  # Reduced height
-            ax = fig.add_subplot(111)
-            
-            # Plot lines for each identity group proportion
-            steps = model.time_series_history['steps']
-            
-            # Define colors for each identity group
-            colors = {
-                "QW": "red",
-                "NQW": "pink", 
-                "QNW": "purple"
-            }
-            
-            # Calculate and plot proportions for each group
-            for group, color in colors.items():
-                counts = model.time_series_history['bars'][bar_id][group]
-                totals = model.time_series_history['bars'][bar_id]['total']
-                
-                # Calculate proportions
-                proportions = []
-                for i in range(len(counts)):
-                    if totals[i] > 0:
-                        proportions.append(counts[i] / totals[i])
-                    else:
-                        proportions.append(0.0)
-                
-                ax.plot(steps, proportions, label=group, color=color, marker='o', markersize=4)
-            
-            # Set plot properties
-            ax.set_xlabel('Step')
-            ax.set_ylabel('Proportion')
-            ax.set_title(f'{model.bars[bar_id].name} Visitor Proportion by Group')
-            ax.set_ylim(0, 1)
-            ax.grid(True, linestyle='--', alpha=0.7)
-            ax.legend()
-            
-            # Set integer x-axis ticks
-            if len(steps) > 1:
-                ax.set_xticks(range(0, max(steps) + 1, max(1, max(steps) // 10)))
-            
-            plt.tight_layout()  # Ensure tight layout
-            solara.FigureMatplotlib(figure=fig)
+            fig, (ax, lines) = figures[bar_id]
+            for line, values in zip(lines, ratios):
+                line.set_data(steps, values)
+            update_step_axis(ax, steps)
+            show_figure(model, fig)
             
 
 # Create bar visitor count trends component
 @solara.component  
 def BarVisitorCountTrendsComponent(model):
     update_counter.get()
+    steps, totals = get_trend_series(model, [f"{bar.reporter_prefix}_Population" for bar in model.bars])
+    
+    def create():
+        fig, ax, lines = create_trend_figure([(bar.name, get_bar_color(i)) for i, bar in enumerate(model.bars)])
+        ax.set_xlabel('Step')
+        ax.set_ylabel('Total Visitor Count')
+        ax.set_title('Total Visitor Count Comparison Between Bars')
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.legend()
+        fig.tight_layout()  # Ensure tight layout
+        return fig, (ax, lines)
+    
+    fig, (ax, lines) = use_figure(model, create)
     
     with solara.Column():
         solara.Markdown("### Bar Visitor Count Trends")
         
-        if hasattr(model, 'time_series_history') and model.time_series_history['steps']:
-            steps = model.time_series_history['steps'] 
-            
-            fig = Figure(figsize=(12, 5))  # Reduced height
-            ax = fig.add_subplot(111)
-            
-            # Colors for each bar
-            bar_colors = ["blue", "green"]
-            
+        if len(steps):
             # Plot total visitor count for each bar
-            for i, bar in enumerate(model.bars):
-                if 'total' in model.time_series_history['bars'][i]:
-                    totals = model.time_series_history['bars'][i]['total']
-                    ax.plot(steps, totals, label=f"{bar.name}", color=bar_colors[i], 
-                           marker='o', markersize=4, linewidth=2)
-            
-            # Set plot properties
-            ax.set_xlabel('Step')
-            ax.set_ylabel('Total Visitor Count')
-            ax.set_title('Total Visitor Count Comparison Between Bars')
-            ax.grid(True, linestyle='--', alpha=0.7)
-            ax.legend()
-            
-            # Set integer x-axis ticks
-            if len(steps) > 1:
-                ax.set_xticks(range(0, max(steps) + 1, max(1, max(steps) // 10)))
-            
-            plt.tight_layout()  # Ensure tight layout
-            solara.FigureMatplotlib(figure=fig)
+            for line, values in zip(lines, totals):
+                line.set_data(steps, values)
+            update_step_axis(ax, steps, autoscale_y=True)
+            show_figure(model, fig)
 
 
 # Create effective affinity trends component
 @solara.component
 def EffectiveAffinityTrendsComponent(model):
     update_counter.get()
+    steps, affinities = get_trend_series(model, [f"{bar.reporter_prefix}_QW_EffectiveAffinity"
+                                                 for bar in model.bars])
     
-    # Get current simulation step
-    current_step = model.steps
+    def create():
+        fig, ax, lines = create_trend_figure([(bar.name, get_bar_color(i)) for i, bar in enumerate(model.bars)])
+        ax.set_xlabel('Step')
+        ax.set_ylabel('Effective Affinity for QW')
+        ax.set_title('Effective Affinity for QW Comparison Between Bars')
+        ax.set_ylim(0, 1)
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.legend()
+        fig.tight_layout()  # Ensure tight layout
+        return fig, (ax, lines)
     
-    # Initialize effective affinity history
-    if not hasattr(model, 'effective_affinity_history'):
-        model.effective_affinity_history = {
-            'steps': [],
-            'bars': {}
-        }
-        # Initialize for each bar
-        for i in range(len(model.bars)):
-            model.effective_affinity_history['bars'][i] = []
-    
-    # Record effective affinity once per step
-    if not model.effective_affinity_history['steps'] or model.effective_affinity_history['steps'][-1] != current_step:
-        model.effective_affinity_history['steps'].append(current_step)
-        
-        # Record effective affinity for QW in each bar
-        for bar_id, bar in enumerate(model.bars):
-            effective_affinity = bar.calculate_effective_affinity()
-            qw_affinity = effective_affinity["QW"]
-            model.effective_affinity_history['bars'][bar_id].append(qw_affinity)
+    fig, (ax, lines) = use_figure(model, create)
     
     with solara.Column():
         solara.Markdown("### Effective Affinity for QW Trends")
         
-        if model.effective_affinity_history['steps']:
-            steps = model.effective_affinity_history['steps']
-            
-            fig = Figure(figsize=(12, 5))  # Reduced height
-            ax = fig.add_subplot(111)
-            
-            # Colors for each bar
-            bar_colors = ["blue", "green"]
-            
+        if len(steps):
             # Plot effective affinity for QW for each bar
-            for i, bar in enumerate(model.bars):
-                qw_affinities = model.effective_affinity_history['bars'][i]
-                ax.plot(steps, qw_affinities, label=f"{bar.name}", color=bar_colors[i], 
-                       marker='o', markersize=4, linewidth=2)
-            
-            # Set plot properties
-            ax.set_xlabel('Step')
-            ax.set_ylabel('Effective Affinity for QW')
-            ax.set_title('Effective Affinity for QW Comparison Between Bars')
-            ax.set_ylim(0, 1)
-            ax.grid(True, linestyle='--', alpha=0.7)
-            ax.legend()
-            
-            # Set integer x-axis ticks
-            if len(steps) > 1:
-                ax.set_xticks(range(0, max(steps) + 1, max(1, max(steps) // 10)))
-            
-            plt.tight_layout()  # Ensure tight layout
-            solara.FigureMatplotlib(figure=fig)
+            for line, values in zip(lines, affinities):
+                line.set_data(steps, values)
+            update_step_axis(ax, steps)
+            show_figure(model, fig)
         
 
 # Create bar status component
@@ -307,56 +276,39 @@ def EffectiveAffinityTrendsComponent(model):
 def BarStatusComponent(model):
     # Ensure component updates with model state
     update_counter.get()
+    steps, qw_ratios = get_trend_series(model, [f"{bar.reporter_prefix}_QW_Ratio" for bar in model.bars])
     
     # Get current simulation step
     current_step = model.steps
     
+    def create():
+        fig, ax, lines = create_trend_figure([(bar.name, get_bar_color(i)) for i, bar in enumerate(model.bars)])
+        
+        # Add threshold reference lines
+        ax.axhline(y=0.3, color='gray', linestyle='--', alpha=0.5, label='30% threshold')
+        ax.axhline(y=0.6, color='gray', linestyle='--', alpha=0.5, label='60% threshold')
+        
+        ax.set_xlabel('Step')
+        ax.set_ylabel('QW Ratio')
+        ax.set_title('QW Ratio Comparison Between Bars')
+        ax.set_ylim(0, 1)
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.legend(loc="upper right")
+        fig.tight_layout()
+        return fig, (ax, lines)
+    
+    fig, (ax, lines) = use_figure(model, create)
+    
     with solara.Column():
         # Combined QW Ratio Plot for both bars
         solara.Markdown(f"### Combined QW Ratio Comparison (Step: {current_step})")
         
-        if hasattr(model, 'time_series_history') and model.time_series_history['steps']:
-            steps = model.time_series_history['steps']
-            
-            fig = Figure(figsize=(12, 5))  # Reduced height
-            ax = fig.add_subplot(111)
-            
-            # Colors for each bar
-            bar_colors = ["blue", "green"]
-            
+        if len(steps):
             # Plot QW ratio for each bar
-            for i, bar in enumerate(model.bars):
-                qw_ratios = []
-                for j in range(len(steps)):
-                    try:
-                        total = model.time_series_history['bars'][i]['total'][j]
-                        qw_count = model.time_series_history['bars'][i]["QW"][j]
-                        qw_ratio = qw_count / total if total > 0 else 0
-                        qw_ratios.append(qw_ratio)
-                    except (IndexError, KeyError):
-                        qw_ratios.append(0)
-                
-                # Plot line for this bar
-                ax.plot(steps, qw_ratios, label=f"{bar.name}", color=bar_colors[i], marker='o', markersize=4, linewidth=2)
-            
-            # Add threshold reference lines
-            ax.axhline(y=0.3, color='gray', linestyle='--', alpha=0.5, label='30% threshold')
-            ax.axhline(y=0.6, color='gray', linestyle='--', alpha=0.5, label='60% threshold')
-            
-            # Set plot properties
-            ax.set_xlabel('Step')
-            ax.set_ylabel('QW Ratio')
-            ax.set_title('QW Ratio Comparison Between Bars')
-            ax.set_ylim(0, 1)
-            ax.grid(True, linestyle='--', alpha=0.7)
-            ax.legend(loc="upper right")
-            
-            # Set integer x-axis ticks
-            if len(steps) > 1:
-                ax.set_xticks(range(0, max(steps) + 1, max(1, max(steps) // 10)))
-            
-            plt.tight_layout()
-            solara.FigureMatplotlib(figure=fig)
+            for line, values in zip(lines, qw_ratios):
+                line.set_data(steps, values)
+            update_step_axis(ax, steps)
+            show_figure(model, fig)
 
 model_params = {
     "seed": {
@@ -408,6 +360,13 @@ model_params = {
         min=1,
         max=30,
         step=1,
+    ),
+    "num_bars": Slider(
+        label="Number of Bars",
+        value=2,
+        min=1,
+        max=10,
+        step=1,
     )
 }
 
@@ -419,11 +378,160 @@ components = [
     BarProportionTrendsComponent
 ]
 
-model = LGBTQBarModel()
+# Model that triggers a redraw after every step (the trends are read from
+# its data collector); SolaraViz re-creates the model through its class on
+# reset, so the hook is registered here
+class DashboardBarModel(LGBTQBarModel):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.add_step_hook(lambda model: force_update())
+
+model = DashboardBarModel()
 
 page = SolaraViz(
     model,
     components=components,
     model_params=model_params,
     name="Lesbian Bars Simulation"
-)
\ No newline at end of file
+)
+
+# Live mode (solara run app.py:LivePage): the model steps in a background
+# thread (see live.LiveRunner) and the page redraws from the runner's
+# metric ring buffer at most LIVE_FRAME_RATE times per second, and only
+# once the previous frame has been drawn, so large runs are not slowed
+# down by rendering
+LIVE_FRAME_RATE = 2
+
+# Agents drawn on the live map; larger populations show a fixed random sample
+LIVE_MAP_POINTS = 5000
+
+# Live trend panels: (title, reporter suffix or columns, y limits)
+LIVE_TRENDS = [
+    ("QW Ratio", "_QW_Ratio", (0, 1)),
+    ("Total Visitor Count", "_Population", None),
+    ("Effective Affinity for QW", "_QW_EffectiveAffinity", (0, 1)),
+    ("Exited Agents", ["TempExited_Agents", "PermExited_Agents"], None),
+]
+
+
+def create_live_figures(runner):
+    """
+    The live page's figures for one runner: all trends in one figure (one
+    image to encode per frame) and the agent map, as
+    {"trends": (figure, [(axes, lines, columns)]), "agent_map": (figure, (axes, scatters))}
+    """
+    fig = Figure(figsize=(14, 8))
+    panels = []
+    for i, (title, columns, ylim) in enumerate(LIVE_TRENDS):
+        ax = fig.add_subplot(2, 2, i + 1)
+        if isinstance(columns, str):
+            lines = [(name, get_bar_color(bar_id)) for bar_id, name in enumerate(runner.bar_names)]
+            columns = [prefix + columns for prefix in runner.reporter_prefixes]
+        else:
+            lines = [("Temp Exited", "orange"), ("Permanently Exited", "red")]
+        artists = [ax.plot([], [], label=label, color=color, linewidth=2)[0] for label, color in lines]
+        ax.set_xlabel('Step')
+        ax.set_title(title)
+        if ylim is not None:
+            ax.set_ylim(*ylim)
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.legend(loc="upper right")
+        panels.append((ax, artists, columns))
+    fig.tight_layout()
+    
+    bar_positions = get_bar_positions(len(runner.bar_names))
+    return {"trends": (fig, panels), "agent_map": create_agent_map(runner.bar_names, bar_positions)}
+
+
+def draw_live_frame(runner, figures, map_sample, map_jitter):
+    # Hand the ring buffer contents and the latest agent snapshot to the artists
+    steps, metrics = runner.ring.snapshot()
+    _, panels = figures["trends"]
+    for (title, _, ylim), (ax, lines, columns) in zip(LIVE_TRENDS, panels):
+        for name, line in zip(columns, lines):
+            line.set_data(steps, metrics[name])
+        update_step_axis(ax, steps, autoscale_y=ylim is None)
+    
+    step, statuses, current_bars = runner.agent_snapshot
+    _, (ax, scatters) = figures["agent_map"]
+    update_agent_map(ax, scatters, get_bar_positions(len(runner.bar_names)), runner.agent_groups,
+                     statuses, current_bars, map_jitter, step, shown=map_sample)
+
+
+@solara.component
+def LivePage():
+    population_size = solara.use_reactive(50000)
+    alpha = solara.use_reactive(0.5)
+    gamma = solara.use_reactive(0.5)
+    seed = solara.use_reactive(42)
+    # Reset builds a new runner; frame counts redraws
+    run_id, set_run_id = solara.use_state(0)
+    frame, set_frame = solara.use_state(0)
+    # Set while a requested frame has not been drawn yet
+    drawing = solara.use_ref(False)
+    
+    def create_runner():
+        model = LGBTQBarModel(population_size=population_size.value, alpha=alpha.value, gamma=gamma.value,
+                              QW_ratio=0.5, QNW_ratio=0.25, engine="numpy", seed=seed.value)
+        return LiveRunner(model)
+    
+    runner = solara.use_memo(create_runner, [run_id])
+    figures = solara.use_memo(lambda: create_live_figures(runner), [runner])
+    
+    def create_map_layout():
+        # Fixed sample and per-agent offsets, so points do not jump between frames
+        rng = np.random.default_rng()
+        num_agents = len(runner.agent_groups)
+        sample = np.zeros(num_agents, dtype=bool)
+        sample[rng.choice(num_agents, min(num_agents, LIVE_MAP_POINTS), replace=False)] = True
+        return sample, (rng.random((num_agents, 2)) - 0.5) * 0.2
+    
+    map_sample, map_jitter = solara.use_memo(create_map_layout, [runner])
+    
+    # Stop the simulation thread when the runner is replaced or the page closes
+    solara.use_effect(lambda: runner.stop, [runner])
+    
+    def redraw_loop(cancel):
+        # Request a frame at a capped rate, when new steps were published
+        # and the previous frame is done
+        shown = None
+        while not cancel.wait(1.0 / LIVE_FRAME_RATE):
+            if runner.ring.count != shown and not drawing.current:
+                shown = runner.ring.count
+                drawing.current = True
+                set_frame(lambda frame: frame + 1)
+    
+    solara.use_thread(redraw_loop, dependencies=[runner], intrusive_cancel=False)
+    
+    def frame_drawn():
+        drawing.current = False
+    
+    # Effects run once the whole page, images included, has rendered
+    solara.use_effect(frame_drawn, [frame])
+    
+    def toggle():
+        if runner.is_running:
+            runner.pause()
+        else:
+            runner.start()
+        set_frame(lambda frame: frame + 1)
+    
+    draw_live_frame(runner, figures, map_sample, map_jitter)
+    
+    with solara.Column():
+        solara.Markdown("## Lesbian Bars Simulation (live)")
+        with solara.Row():
+            solara.InputInt("Total Agents", value=population_size)
+            solara.InputInt("Random Seed", value=seed)
+            solara.SliderFloat("Structural Weight (α)", value=alpha, min=0.0, max=1.0, step=0.1)
+            solara.SliderFloat("Fixed Affinity Weight (γ)", value=gamma, min=0.1, max=0.9, step=0.1)
+        with solara.Row():
+            solara.Button("Pause" if runner.is_running else "Start", on_click=toggle)
+            solara.Button("Reset", on_click=lambda: set_run_id(run_id + 1))
+            solara.Markdown(f"Step {runner.model.steps}, {runner.rate:.1f} steps/s, "
+                            f"{len(runner.agent_groups)} agents (parameters apply on Reset)")
+        if runner.error is not None:
+            solara.Error(f"Simulation stopped: {runner.error!r}")
+        
+        for key in ["agent_map", "trends"]:
+            solara.FigureMatplotlib(figure=figures[key][0], dependencies=[id(runner), frame], format="png")
@@ -1,76 +1,272 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from model import LGBTQBarModel
-import time
+from model import LGBTQBarModel, result_prefix
+from convergence import ConvergenceMonitor
+from replicates import ReplicateEngine
+from cache import ResultCache, cache_key, DEFAULT_MAX_BYTES
+from seeding import derive_seeds
+from sink import ResultSink, read_results
+
+# Default location of the results file (repository root)
+DEFAULT_OUTPUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "batch_run_results.csv")
 
-def run_batch_experiment():
+# Parameters shared by every run of the gamma experiment
+DEFAULT_FIXED_PARAMS = {
+    'population_size': 200,
+    'alpha': 0.5,
+    'QW_ratio': 0.5,
+    'QNW_ratio': 0.25,
+    'adaptive_update_interval': 10
+}
+
+
+def run_single(job):
     """
-    Run batch experiment to test different gamma values
+    Run one (params, seed) job and return its final results, its per-step
+    reporter columns (when timeseries is set) and wall time. With a
+    convergence dict (ConvergenceMonitor arguments) the run may stop
+    before num_steps
     """
-    # Experiment parameters
-    gamma_values = [0.3, 0.5, 0.7]  # Gamma values to test
-    num_runs = 20  # Number of runs per gamma value
-    num_steps = 100  # Run for 100 steps each time
+    params, run_id, seed, num_steps, timeseries, convergence = job
+    start_time = time.time()
     
-    # Fixed parameters
-    fixed_params = {
-        'population_size': 200,
-        'alpha': 0.5,
-        'QW_ratio': 0.5,
-        'QNW_ratio': 0.25,
-        'adaptive_update_interval': 10
+    # Create model instance; all of its randomness comes from this seed
+    model = LGBTQBarModel(
+        seed=seed,
+        **params
+    )
+    
+    monitor = None
+    if convergence is not None:
+        monitor = ConvergenceMonitor(**convergence)
+        model.add_step_hook(monitor)
+    
+    # Run model
+    for step in range(num_steps):
+        model.step()
+        if not model.running:
+            break
+    
+    # Collect final results - only effective affinity and QW ratio, per bar
+    # (changing these columns needs a new cache.RESULT_LAYOUT_VERSION)
+    final_data = {
+        'gamma': params['gamma'],
+        'run_id': run_id,
     }
+    for bar_id, bar in enumerate(model.bars):
+        prefix = result_prefix(bar.name)
+        final_data[f'{prefix}_qw_effective_affinity'] = bar.calculate_effective_affinity()["QW"]
+        final_data[f'{prefix}_qw_ratio'] = model.get_bar_group_ratio(bar_id, "QW")
+    final_data.update({
+        # Step the run ended at, and why
+        'stop_step': model.steps,
+        'stop_reason': "max_steps" if monitor is None or monitor.stop_reason is None else monitor.stop_reason,
+        # Sequential and synchronous belonging updates give different results,
+        # and so do the two engines (they draw random numbers differently)
+        'update_mode': model.update_mode,
+        'engine': model.engine
+    })
     
-    # Store results
-    results = []
+    # Every collected reporter, one array per column
+    series = None
+    if timeseries:
+        data = model.datacollector.get_model_vars_dataframe()
+        series = {'gamma': params['gamma'], 'run_id': run_id, 'step': np.arange(1, len(data) + 1)}
+        series.update({column: data[column].to_numpy() for column in data.columns})
+    
+    return final_data, series, time.time() - start_time
+
+
+def run_replicates(job):
+    """
+    Run all replicates of one parameter set together on a ReplicateEngine
+    and return per-replicate final results, series (when timeseries is
+    set) and the wall time. Replicate i reproduces run_single with seeds[i]
+    and the numpy engine
+    """
+    params, run_ids, seeds, num_steps, timeseries = job
+    start_time = time.time()
+    engine = ReplicateEngine(seeds, collect=timeseries, **params)
+    for step in range(num_steps):
+        engine.step()
+    
+    rows = engine.get_final_results(run_ids)
+    series = [None] * len(rows)
+    if timeseries:
+        for replicate, run_id in enumerate(run_ids):
+            data = engine.get_model_vars_dataframe(replicate)
+            series[replicate] = {'gamma': params['gamma'], 'run_id': run_id,
+                                 'step': np.arange(1, len(data) + 1)}
+            series[replicate].update({column: data[column].to_numpy() for column in data.columns})
+    
+    return rows, series, time.time() - start_time
+
+
+def run_replicate_jobs(jobs, max_workers=1, chunksize=1):
+    """
+    run_jobs for run_replicates jobs: yields (job, final_data, series,
+    status) for every replicate, in job order
+    """
+    if max_workers == 1:
+        outputs = map(run_replicates, jobs)
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        outputs = executor.map(run_replicates, jobs, chunksize=chunksize)
+    try:
+        for job, (rows, series, run_time) in zip(jobs, outputs):
+            status = f"done ({run_time / len(rows):.2f}s per replicate)"
+            for final_data, replicate_series in zip(rows, series):
+                yield job, final_data, replicate_series, status
+    finally:
+        if max_workers != 1:
+            executor.shutdown()
+
+
+def run_jobs(jobs, max_workers=1, chunksize=1, cache=None, executor=None):
+    """
+    Run jobs over max_workers processes, yielding (job, final_data, series,
+    status) in job order whatever the worker count. Jobs found in the
+    cache (a ResultCache) are replayed instead of simulated. An open
+    executor can be passed in to reuse its workers across calls
+    """
+    # Only jobs missing from the cache are simulated
+    keys = [None] * len(jobs)
+    cached = set()
+    if cache is not None:
+        keys = [cache_key(params, seed, steps, convergence) for params, _, seed, steps, _, convergence in jobs]
+        cached = {index for index, key in enumerate(keys) if cache.contains(key, jobs[index][4])}
+        print(f"{len(cached)} of {len(jobs)} runs found in the cache")
+    pending = [job for index, job in enumerate(jobs) if index not in cached]
+    
+    own_executor = executor is None and max_workers != 1
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    if executor is None:
+        outputs = map(run_single, pending)
+    else:
+        outputs = executor.map(run_single, pending, chunksize=chunksize)
+    
+    try:
+        for index, job in enumerate(jobs):
+            hit = cache.get(keys[index], job[4]) if index in cached else None
+            if hit is not None:
+                final_data, series = hit
+                final_data = dict(final_data, run_id=job[1])
+                if series is not None:
+                    series = dict(gamma=final_data['gamma'], run_id=job[1], **series)
+                status = "cached"
+            else:
+                # An entry evicted since the lookup is simply recomputed
+                final_data, series, run_time = next(outputs) if index not in cached else run_single(job)
+                if cache is not None:
+                    cache.put(keys[index], final_data, series)
+                status = f"done ({run_time:.2f}s)"
+            yield job, final_data, series, status
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+
+def run_batch_experiment(gamma_values=(0.3, 0.5, 0.7), num_runs=20, num_steps=100,
+                         fixed_params=None, max_workers=1, chunksize=1,
+                         output_path=DEFAULT_OUTPUT_PATH, root_seed=None,
+                         sink_path=None, sink_format="parquet", timeseries=False,
+                         cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES, convergence=None,
+                         replicate_batch=False):
+    """
+    Run batch experiment to test different gamma values, spreading the
+    (gamma, seed) jobs over max_workers processes. Run i uses seed i, or
+    the i-th seed derived from root_seed when one is given.
+    
+    With sink_path, results are streamed to partitioned Parquet/Arrow files
+    as runs finish (table "final", plus "timeseries" with every step when
+    timeseries is set) instead of being kept in memory; the function then
+    returns None and the tables are loaded with sink.read_results.
+    
+    With cache_dir, outputs of earlier runs with the same parameters, seed,
+    step count and model code are read from the cache instead of simulated.
+    
+    With convergence, e.g. {"tolerance": 0.01, "patience": 3}, each run
+    stops early once a ConvergenceMonitor finds it has settled; num_steps
+    is then an upper bound and the stop step is in the results.
+    
+    With replicate_batch, the runs of each gamma are stepped together as
+    one ReplicateEngine job (numpy engine rules, so not with
+    engine="object"; no cache or early stopping)
+    """
+    if replicate_batch and (cache_dir is not None or convergence is not None):
+        raise ValueError("replicate_batch cannot be combined with the cache or early stopping")
+    
+    # Fixed parameters
+    if fixed_params is None:
+        fixed_params = DEFAULT_FIXED_PARAMS
+    if replicate_batch and fixed_params.get("engine") == "object":
+        raise ValueError("replicate_batch runs the numpy engine's rules; it cannot reproduce engine='object' runs")
+    
+    # Replicates of different gammas share seeds (common random numbers)
+    if root_seed is None:
+        seeds = list(range(num_runs))
+    else:
+        seeds = derive_seeds(root_seed, num_runs)
+    
+    # One job per (gamma, run_id) pair, in a fixed order, or one per gamma
+    # when replicates are batched
+    if replicate_batch:
+        jobs = [(dict(fixed_params, gamma=gamma), list(range(num_runs)), seeds, num_steps, timeseries)
+                for gamma in gamma_values]
+    else:
+        jobs = [(dict(fixed_params, gamma=gamma), run_id, seeds[run_id], num_steps, timeseries, convergence)
+                for gamma in gamma_values
+                for run_id in range(num_runs)]
     
     print("Starting batch experiment...")
-    print(f"Testing gamma values: {gamma_values}")
+    print(f"Testing gamma values: {list(gamma_values)}")
     print(f"Running {num_runs} times for each gamma, {num_steps} steps each")
+    if convergence is not None:
+        print(f"Stopping runs early once converged: {convergence}")
+    print(f"Using {max_workers} worker(s), chunksize {chunksize}")
     print("-" * 50)
     
-    # Experiment for each gamma value
-    for gamma in gamma_values:
-        print(f"\nTesting gamma = {gamma}")
-        
-        for run_id in range(num_runs):
-            print(f"  Run {run_id + 1}/{num_runs}...", end=" ")
-            start_time = time.time()
-            
-            # Create model instance
-            model = LGBTQBarModel(
-                gamma=gamma,
-                seed=run_id,  # Use run_id as seed for reproducibility
-                **fixed_params
-            )
-            
-            # Run model
-            for step in range(num_steps):
-                model.step()
-            
-            # Collect final results - only effective affinity and QW ratio
-            final_data = {
-                'gamma': gamma,
-                'run_id': run_id,
-                # Women Bar data
-                'women_bar_qw_effective_affinity': model.women_bar.calculate_effective_affinity()["QW"],
-                'women_bar_qw_ratio': model.get_bar_group_ratio(0, "QW"),
-                # Queer Bar data
-                'queer_bar_qw_effective_affinity': model.queer_bar.calculate_effective_affinity()["QW"],
-                'queer_bar_qw_ratio': model.get_bar_group_ratio(1, "QW")
-            }
-            
-            results.append(final_data)
-            
-            end_time = time.time()
-            print(f"Done ({end_time - start_time:.2f}s)")
+    # Store results
+    results = []
+    cache = None if cache_dir is None else ResultCache(cache_dir, cache_max_bytes)
+    sink = None if sink_path is None else ResultSink(sink_path, format=sink_format)
+    start_time = time.time()
+    
+    try:
+        if replicate_batch:
+            outputs = run_replicate_jobs(jobs, max_workers, chunksize)
+        else:
+            outputs = run_jobs(jobs, max_workers, chunksize, cache)
+        for job, final_data, series, status in outputs:
+            print(f"  gamma = {final_data['gamma']}, run {final_data['run_id'] + 1}/{num_runs} {status}")
+            if sink is None:
+                results.append(final_data)
+            else:
+                sink.append("final", final_data)
+                if series is not None:
+                    sink.append("timeseries", series)
+    finally:
+        if sink is not None:
+            sink.close()
+    
+    print(f"All {len(gamma_values) * num_runs} runs finished in {time.time() - start_time:.2f}s")
+    
+    if sink is not None:
+        print(f"\nResults streamed to '{sink_path}'")
+        return None
     
     # Convert to DataFrame
     df = pd.DataFrame(results)
     
     # Save results
-    df.to_csv('/Users/xuewendi/Desktop/batch_run_results.csv', index=False)
-    print(f"\nResults saved to 'batch_run_results.csv'")
+    if output_path is not None:
+        df.to_csv(output_path, index=False)
+        print(f"\nResults saved to '{output_path}'")
     
     return df
 
@@ -82,21 +278,48 @@ def print_summary(df):
     print("RESULTS SUMMARY")
     print("="*50)
     
-    for gamma in [0.3, 0.5, 0.7]:
+    for gamma in sorted(df['gamma'].unique()):
         gamma_data = df[df['gamma'] == gamma]
         
         print(f"\nGamma = {gamma}:")
-        print(f"Women Bar - QW Effective Affinity: {gamma_data['women_bar_qw_effective_affinity'].mean():.3f}")
-        print(f"Women Bar - QW Ratio: {gamma_data['women_bar_qw_ratio'].mean():.3f}")
-        print(f"Queer Bar - QW Effective Affinity: {gamma_data['queer_bar_qw_effective_affinity'].mean():.3f}")
-        print(f"Queer Bar - QW Ratio: {gamma_data['queer_bar_qw_ratio'].mean():.3f}")
+        for prefix in [column[:-len("_qw_ratio")] for column in df.columns if column.endswith("_qw_ratio")]:
+            label = prefix.replace("_", " ").title()
+            print(f"{label} - QW Effective Affinity: {gamma_data[prefix + '_qw_effective_affinity'].mean():.3f}")
+            print(f"{label} - QW Ratio: {gamma_data[prefix + '_qw_ratio'].mean():.3f}")
+        print(f"Stop Step: {gamma_data['stop_step'].mean():.1f}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the gamma batch experiment")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=1, help="jobs sent to a worker at a time")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="path of the results CSV")
+    parser.add_argument("--root-seed", type=int, default=None, help="derive run seeds from this seed")
+    parser.add_argument("--sink", default=None, help="stream results to partitioned files under this directory")
+    parser.add_argument("--sink-format", choices=["parquet", "arrow"], default="parquet")
+    parser.add_argument("--timeseries", action="store_true", help="also write every step's reporters to the sink")
+    parser.add_argument("--steps", type=int, default=100, help="steps per run (upper bound with --converge)")
+    parser.add_argument("--converge", action="store_true", help="stop each run once it has converged")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="largest change per update cycle counted as converged")
+    parser.add_argument("--patience", type=int, default=3, help="converged update cycles in a row before stopping")
+    parser.add_argument("--replicate-batch", action="store_true",
+                        help="step the runs of each gamma together as one array computation")
+    parser.add_argument("--cache", default=None, help="reuse outputs of identical runs cached in this directory")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / 2 ** 20,
+                        help="evict least recently used cache entries beyond this size")
+    args = parser.parse_args()
+    
     # Run batch experiment
-    df = run_batch_experiment()
+    df = run_batch_experiment(max_workers=args.workers, chunksize=args.chunksize,
+                              output_path=args.output, root_seed=args.root_seed,
+                              sink_path=args.sink, sink_format=args.sink_format,
+                              timeseries=args.timeseries, cache_dir=args.cache,
+                              cache_max_bytes=int(args.cache_max_mb * 2 ** 20), num_steps=args.steps,
+                              convergence={"tolerance": args.tolerance, "patience": args.patience}
+                              if args.converge else None, replicate_batch=args.replicate_batch)
+    if df is None:
+        df = read_results(args.sink, "final", args.sink_format)
     
     # Print summary
     print_summary(df)
     
-    print("\nExperiment completed!")
-    print("Results saved to: batch_run_results.csv")
\ No newline at end of file
+    print("\nExperiment completed!")
\ No newline at end of file
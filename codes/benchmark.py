@@ -0,0 +1,195 @@
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+from model import LGBTQBarModel
+
+# Default location of benchmark results (repository root, not tracked)
+DEFAULT_OUTPUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark_results.json")
+
+
+def measure_memory_per_agent(population_size=20000, num_steps=10, **params):
+    """
+    Python heap bytes allocated per agent by building a model and
+    running it for num_steps (so agents carry scores and statuses)
+    """
+    gc.collect()
+    tracemalloc.start()
+    model = LGBTQBarModel(population_size=population_size, seed=0, **params)
+    for step in range(num_steps):
+        model.step()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "population_size": population_size,
+        "bytes_per_agent": current / population_size,
+        "peak_bytes_per_agent": peak / population_size,
+    }
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+def run_case(case):
+    """
+    Time construction, stepping and data collection for one benchmark case
+    """
+    params = dict(case["params"])
+    population_size = params["population_size"]
+    num_steps = case["num_steps"]
+
+    start_time = time.perf_counter()
+    model = LGBTQBarModel(seed=0, **params)
+    construction_time = time.perf_counter() - start_time
+
+    # Step times include data collection, as in a normal run
+    step_times = np.empty(num_steps)
+    for step in range(num_steps):
+        start_time = time.perf_counter()
+        model.step()
+        step_times[step] = time.perf_counter() - start_time
+
+    # Collection alone (reporters plus the collector's append), repeated
+    # on the final state
+    repeats = min(num_steps, 100)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        model.datacollector.collect(model)
+    collect_time = (time.perf_counter() - start_time) / repeats
+
+    total_step_time = step_times.sum()
+    return dict(
+        case,
+        construction_time=construction_time,
+        step_time_mean=float(step_times.mean()),
+        step_time_median=float(np.median(step_times)),
+        step_time_max=float(step_times.max()),
+        collect_time=collect_time,
+        steps_per_sec=num_steps / total_step_time,
+        agent_steps_per_sec=num_steps * population_size / total_step_time,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def run_case_isolated(case):
+    # Each case runs in a fresh process so its peak RSS is its own
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_case, (case,))
+
+
+def make_cases(sizes, intervals, engines, num_steps, long_steps):
+    """
+    Benchmark matrix: population scaling for every engine, update-interval
+    sensitivity, and a long-horizon run
+    """
+    cases = []
+    for engine in engines:
+        for population_size in sizes:
+            cases.append({
+                "name": f"scaling/{engine}/N={population_size}",
+                "params": {"population_size": population_size, "engine": engine},
+                "num_steps": num_steps,
+            })
+        for interval in intervals:
+            cases.append({
+                "name": f"interval/{engine}/interval={interval}",
+                "params": {"population_size": 2000, "engine": engine, "adaptive_update_interval": interval},
+                "num_steps": num_steps,
+            })
+        cases.append({
+            "name": f"long/{engine}/steps={long_steps}",
+            "params": {"population_size": 2000, "engine": engine},
+            "num_steps": long_steps,
+        })
+    return cases
+
+
+def get_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare_results(old_path, new_path, metric="agent_steps_per_sec"):
+    """
+    Print the ratio new/old of a throughput metric for cases present in both files
+    """
+    with open(old_path) as f:
+        old = {case["name"]: case for case in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {case["name"]: case for case in json.load(f)["results"]}
+
+    print(f"{'case':45s} {'old':>12s} {'new':>12s} {'ratio':>7s}")
+    for name in new:
+        if name in old:
+            ratio = new[name][metric] / old[name][metric]
+            print(f"{name:45s} {old[name][metric]:12.0f} {new[name][metric]:12.0f} {ratio:7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark LGBTQBarModel construction, stepping and collection")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 2000, 20000, 100000])
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 10, 30])
+    parser.add_argument("--engines", nargs="+", default=["object", "numpy"])
+    parser.add_argument("--steps", type=int, default=50, help="steps per scaling/interval case")
+    parser.add_argument("--long-steps", type=int, default=2000, help="steps of the long-horizon case")
+    parser.add_argument("--quick", action="store_true", help="small sizes and horizons for a smoke run")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="path of the JSON results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--memory", action="store_true", help="only report heap bytes per agent")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        sys.exit()
+
+    if args.memory:
+        for population_size in [2000, 20000]:
+            result = measure_memory_per_agent(population_size)
+            print(f"N = {population_size}: {result['bytes_per_agent']:.0f} bytes/agent "
+                  f"(peak {result['peak_bytes_per_agent']:.0f})")
+        sys.exit()
+
+    if args.quick:
+        args.sizes, args.steps, args.long_steps = [200, 2000], 10, 100
+
+    results = []
+    for case in make_cases(args.sizes, args.intervals, args.engines, args.steps, args.long_steps):
+        result = run_case_isolated(case)
+        results.append(result)
+        print(f"{case['name']:45s} init {result['construction_time']:7.3f}s  "
+              f"{result['steps_per_sec']:9.1f} steps/s  {result['agent_steps_per_sec']:12.0f} agent-steps/s  "
+              f"collect {result['collect_time'] * 1e6:7.1f}us  peak RSS {result['peak_rss_mb']:7.1f} MB")
+
+    # Add heap bytes per agent for the object engine
+    memory = measure_memory_per_agent(min(20000, max(args.sizes)))
+
+    with open(args.output, "w") as f:
+        json.dump({"metadata": get_metadata(), "memory": memory, "results": results}, f, indent=2)
+    print(f"\nResults saved to '{args.output}'")
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Modules that define simulation behaviour (including when a run stops
+# early); editing any of them changes the code version and so invalidates
+# every cached entry. CLI and I/O code is left out
+MODEL_SOURCES = ["agent.py", "engine.py", "model.py", "seeding.py", "convergence.py"]
+
+# Bumped whenever the layout of run_single's results changes, which the
+# code version no longer covers
+RESULT_LAYOUT_VERSION = 2
+
+# Default cache size limit
+DEFAULT_MAX_BYTES = 1024 * 2 ** 20
+
+code_version_hash = None
+
+
+def code_version():
+    """
+    Hash of the model sources, computed once per process
+    """
+    global code_version_hash
+    if code_version_hash is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in MODEL_SOURCES:
+            with open(os.path.join(directory, name), "rb") as f:
+                digest.update(name.encode() + b"\0" + f.read())
+        code_version_hash = digest.hexdigest()
+    return code_version_hash
+
+
+def cache_key(params, seed, num_steps, convergence=None):
+    """
+    Content address of one run: its parameters, seed, step count, early
+    stopping settings, the model code version and the result layout
+    """
+    description = {"params": params, "seed": seed, "num_steps": num_steps, "code_version": code_version(),
+                   "result_layout": RESULT_LAYOUT_VERSION}
+    if convergence is not None:
+        description["convergence"] = convergence
+    description = json.dumps(description, sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+# On-disk cache of batch run outputs (final metrics and optional time
+# series), one .npz file per key, evicting least recently used entries
+# once the cache grows past max_bytes
+class ResultCache:
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self.entry_paths())
+
+    def entry_paths(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".npz") and not name.startswith("."):
+                    yield os.path.join(directory, name)
+
+    def path(self, key):
+        # Two-level layout keeps directories small for large caches
+        return os.path.join(self.root, key[:2], key + ".npz")
+
+    def contains(self, key, timeseries=False):
+        """
+        Whether get would hit, reading only the entry's metadata. Also marks
+        the entry as recently used, so it is not evicted before it is read
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as stored:
+                metadata = json.loads(str(stored["metadata"]))
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            return False
+        if timeseries and not metadata["has_series"]:
+            return False
+        os.utime(path)
+        return True
+
+    def get(self, key, timeseries=False):
+        """
+        Stored (final_data, series) for a key, or None on a miss. An entry
+        stored without its time series is a miss when one is requested
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as stored:
+                metadata = json.loads(str(stored["metadata"]))
+                if timeseries and not metadata["has_series"]:
+                    self.misses += 1
+                    return None
+                series = None
+                if timeseries:
+                    series = {name[len("series_"):]: stored[name] for name in stored.files
+                              if name.startswith("series_")}
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            self.misses += 1
+            return None
+
+        # Mark as recently used for eviction
+        os.utime(path)
+        self.hits += 1
+        return metadata["final_data"], series
+
+    def put(self, key, final_data, series=None):
+        """
+        Store a run's outputs; series holds per-step arrays (scalars such as
+        gamma and run_id are left out)
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {}
+        if series is not None:
+            arrays = {"series_" + name: values for name, values in series.items() if np.ndim(values) == 1}
+        metadata = {"final_data": final_data, "has_series": series is not None}
+        arrays["metadata"] = np.array(json.dumps(metadata))
+
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        # Write under a hidden name and rename, so a crash never leaves half an entry
+        temporary_path = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+        with open(temporary_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temporary_path, path)
+        self.size += os.path.getsize(path) - previous_size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits in max_bytes
+        """
+        entries = sorted((os.path.getmtime(path), os.path.getsize(path), path) for path in self.entry_paths())
+        for _, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            os.remove(path)
+            self.size -= size
+
+    def clear(self):
+        for path in list(self.entry_paths()):
+            os.remove(path)
+        self.size = 0
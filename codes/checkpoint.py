@@ -0,0 +1,196 @@
+import json
+import os
+from array import array
+import numpy as np
+from agent import IDENTITY_GROUPS, AGENT_STATUSES
+
+# Bumped whenever the checkpoint layout changes
+CHECKPOINT_VERSION = 1
+
+# Parameters that may differ between a checkpoint and the restored model,
+# e.g. to fork gamma/alpha variants from one warmed-up state
+OVERRIDABLE_PARAMS = ["alpha", "gamma", "engine", "profile", "metrics_path", "overwrite_metrics"]
+
+
+def to_json(value):
+    # json.dumps fallback for numpy values and paths in parameters and RNG states
+    if isinstance(value, os.PathLike):
+        return os.fspath(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialize {type(value)}")
+
+
+def get_agent_arrays(model):
+    """
+    Per-agent state as arrays in agent order, from either engine
+    """
+    model.settle_exit_counters()
+    agents = list(model.agents)
+    arrays = {"unique_id": np.array([agent.unique_id for agent in agents], dtype=np.int64)}
+    engine = model.numpy_engine
+    if engine is not None:
+        arrays.update({
+            "group": engine.group,
+            "threshold": engine.threshold,
+            "status": engine.status,
+            "current_bar": engine.current_bar,
+            "exit_counter": engine.exit_counter,
+            "cooldown": engine.cooldown,
+            "exit_attempts": engine.exit_attempts,
+            "belonging": engine.belonging,
+            "last_scores": engine.last_scores,
+        })
+    else:
+        arrays.update({
+            "group": np.array([agent.group_code for agent in agents], dtype=np.int64),
+            "threshold": np.array([agent.threshold for agent in agents]),
+            "status": np.array([agent.status_code for agent in agents], dtype=np.int64),
+            "current_bar": np.array([-1 if agent.current_bar is None else agent.current_bar
+                                     for agent in agents], dtype=np.int64),
+            "exit_counter": np.array([agent.exit_counter for agent in agents], dtype=np.int64),
+            "cooldown": np.array([agent.cooldown_duration for agent in agents], dtype=np.int64),
+            "exit_attempts": np.array([agent.exit_attempts for agent in agents], dtype=np.int64),
+            "belonging": np.array([agent.belonging_row for agent in agents]).reshape(len(agents), -1),
+            "last_scores": np.array([agent.last_bar_scores for agent in agents]).reshape(len(agents), -1),
+        })
+    return arrays
+
+
+def set_agent_arrays(model, arrays):
+    """
+    Load per-agent state arrays (from get_agent_arrays) into the model's engine
+    """
+    engine = model.numpy_engine
+    if engine is not None:
+        for name in ["group", "threshold", "status", "current_bar", "exit_counter",
+                     "cooldown", "exit_attempts", "belonging", "last_scores"]:
+            getattr(engine, name)[:] = arrays[name]
+        model.schedule_agents()
+        return
+
+    for status in AGENT_STATUSES:
+        for group in IDENTITY_GROUPS:
+            model.status_counts[status][group] = 0
+    for i, agent in enumerate(model.agents):
+        agent.group_code = int(arrays["group"][i])
+        agent.threshold = float(arrays["threshold"][i])
+        agent.status_code = int(arrays["status"][i])
+        current_bar = int(arrays["current_bar"][i])
+        agent.current_bar = None if current_bar < 0 else current_bar
+        agent.exit_counter = int(arrays["exit_counter"][i])
+        agent.cooldown_duration = int(arrays["cooldown"][i])
+        agent.exit_attempts = int(arrays["exit_attempts"][i])
+        agent.belonging_row = array("d", arrays["belonging"][i])
+        agent.last_bar_scores = array("d", arrays["last_scores"][i])
+        agent.has_scores = bool((~np.isnan(arrays["last_scores"][i])).any())
+        model.status_counts[agent.status][agent.identity_group] += 1
+    model.schedule_agents()
+
+
+def save_checkpoint(model, path):
+    """
+    Write the full state of a model (agents, bars, RNG states and collected
+    data) to a compressed .npz file
+    """
+    bars = model.bars
+    arrays = {"agent_" + name: values for name, values in get_agent_arrays(model).items()}
+    arrays.update({
+        "bar_adaptive_affinities": model.adaptive_affinities,
+        "bar_count_history": np.array([bar.count_history for bar in bars], dtype=np.int64),
+        "bar_window_counts": np.array([bar.window_counts for bar in bars], dtype=np.int64),
+        "bar_visitor_counts": np.array([[bar.visitor_counts[group] for group in IDENTITY_GROUPS]
+                                        for bar in bars], dtype=np.int64),
+        "bar_counters": np.array([[bar.update_count, bar.history_position, bar.rounds_recorded]
+                                  for bar in bars], dtype=np.int64),
+    })
+
+    # Collected reporters, one array per column
+    data = model.datacollector.get_model_vars_dataframe()
+    for column in data.columns:
+        arrays["data_" + column] = data[column].to_numpy()
+
+    random_state = model.random.getstate()
+    metadata = {
+        "version": CHECKPOINT_VERSION,
+        "params": model.init_params,
+        "steps": model.steps,
+        "running": model.running,
+        "root_seed": model.root_seed,
+        "data_columns": list(data.columns),
+        "random_state": [random_state[0], list(random_state[1]), random_state[2]],
+        "rng_state": model.rng.bit_generator.state,
+        "visitor_history": [bar.visitor_history for bar in bars] if bars[0].keep_full_history else None,
+    }
+    arrays["metadata"] = np.array(json.dumps(metadata, default=to_json))
+
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def load_checkpoint(model_class, path, **overrides):
+    """
+    Rebuild a model from save_checkpoint output. Continuing the restored
+    model gives the same results as the uninterrupted run, unless overrides
+    (alpha, gamma, engine, profile) change its parameters. A memmap run
+    needs a metrics_path other than the saved one, which the restored
+    model's data (collected so far and new) is written to, so the source
+    run's file is never replaced
+    """
+    unknown = set(overrides) - set(OVERRIDABLE_PARAMS)
+    if unknown:
+        raise ValueError(f"Cannot override {sorted(unknown)} when restoring; "
+                         f"allowed: {OVERRIDABLE_PARAMS}")
+
+    with np.load(path) as stored:
+        arrays = {name: stored[name] for name in stored.files}
+    metadata = json.loads(str(arrays.pop("metadata")))
+    if metadata["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {metadata['version']}")
+
+    saved_path = metadata["params"].get("metrics_path")
+    if metadata["params"]["collector"] == "memmap" and (
+            overrides.get("metrics_path") is None
+            or os.path.abspath(overrides["metrics_path"]) == os.path.abspath(saved_path)):
+        raise ValueError("Restoring a memmap run needs a metrics_path override other than "
+                         f"the saved one ({saved_path}), which it would replace")
+
+    # Belonging rows are restored below, so skip the per-agent generation;
+    # only an explicit override may replace an existing metrics file
+    params = dict(metadata["params"], overwrite_metrics=False)
+    params.update(overrides)
+    model = model_class(**dict(params, belonging_init="batched"))
+    model.init_params = params
+    model.steps = metadata["steps"]
+    model.running = metadata["running"]
+    model.root_seed = metadata["root_seed"]
+
+    set_agent_arrays(model, {name[len("agent_"):]: values for name, values in arrays.items()
+                             if name.startswith("agent_")})
+
+    for bar_id, bar in enumerate(model.bars):
+        bar.adaptive_values[:] = arrays["bar_adaptive_affinities"][bar_id]
+        bar.count_history = arrays["bar_count_history"][bar_id].tolist()
+        bar.window_counts = arrays["bar_window_counts"][bar_id].tolist()
+        bar.update_count, bar.history_position, bar.rounds_recorded = arrays["bar_counters"][bar_id].tolist()
+        bar.start_round()
+        bar.add_group_counts(dict(zip(IDENTITY_GROUPS, arrays["bar_visitor_counts"][bar_id].tolist())))
+        if metadata["visitor_history"] is not None:
+            bar.visitor_history = metadata["visitor_history"][bar_id]
+        bar.refresh_effective_affinity()
+    model.refresh_effective_weights()
+
+    # Collected data so far
+    columns = {column: arrays["data_" + column] for column in metadata["data_columns"]}
+    if hasattr(model.datacollector, "load_model_vars"):
+        model.datacollector.load_model_vars(columns)
+    else:
+        # Mesa DataCollector
+        model.datacollector.model_vars = {column: values.tolist() for column, values in columns.items()}
+
+    version, internal_state, gauss_next = metadata["random_state"]
+    model.random.setstate((version, tuple(internal_state), gauss_next))
+    model.rng.bit_generator.state = metadata["rng_state"]
+    return model
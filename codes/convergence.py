@@ -0,0 +1,61 @@
+import numpy as np
+
+
+# Step hook that stops a run (model.running = False) once it has settled:
+# the windowed bar group ratios, the adaptive affinities and the exit
+# fractions each change by at most tolerance between consecutive adaptive
+# update cycles, for patience cycles in a row. A run where every agent has
+# permanently exited is stopped straight away.
+#
+#     monitor = ConvergenceMonitor(tolerance=0.01, patience=3)
+#     model.add_step_hook(monitor)
+#     while model.running and model.steps < max_steps:
+#         model.step()
+class ConvergenceMonitor:
+    def __init__(self, tolerance=0.01, patience=3):
+        self.tolerance = tolerance
+        self.patience = patience
+        self.previous = None
+        self.stable_cycles = 0
+        # Largest change at the end of each cycle, as (step, change)
+        self.changes = []
+        self.stop_step = None
+        self.stop_reason = None
+
+    def snapshot(self, model):
+        """
+        Quantities compared between cycles, as one flat array
+        """
+        ratios = []
+        for bar in model.bars:
+            total = sum(bar.window_counts)
+            ratios.extend(count / total if total > 0 else 0.0 for count in bar.window_counts)
+        population = len(model.agents)
+        exits = [model.count_temp_exited_agents() / population,
+                 model.count_permanently_exited_agents() / population]
+        return np.concatenate([ratios, model.adaptive_affinities.ravel(), exits])
+
+    def stop(self, model, reason):
+        model.running = False
+        self.stop_step = model.steps
+        self.stop_reason = reason
+
+    def __call__(self, model):
+        if not model.running:
+            return
+        if model.count_permanently_exited_agents() == len(model.agents):
+            self.stop(model, "all_exited")
+            return
+
+        # Every bar shares the update interval, and its counter is reset
+        # on the step that closes a cycle
+        if model.bars[0].update_count != 0:
+            return
+        current = self.snapshot(model)
+        if self.previous is not None:
+            change = float(np.abs(current - self.previous).max())
+            self.changes.append((model.steps, change))
+            self.stable_cycles = self.stable_cycles + 1 if change <= self.tolerance else 0
+            if self.stable_cycles >= self.patience:
+                self.stop(model, "converged")
+        self.previous = current
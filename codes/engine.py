@@ -0,0 +1,293 @@
+import numpy as np
+from time import perf_counter
+from agent import IDENTITY_GROUPS, AGENT_STATUSES, ACTIVE, TEMP_EXITED, PERM_EXITED
+
+
+def weighted_choice_from_uniforms(weights, uniforms):
+    """
+    Draw one column index per row of a non-negative weight matrix,
+    with probability proportional to the weights in that row, given one
+    uniform in [0, 1) per row. Rows whose weights sum to zero get -1.
+    """
+    cumulative = np.cumsum(weights, axis=1)
+    total = cumulative[:, -1]
+    u = uniforms * total
+    chosen = (cumulative <= u[:, None]).sum(axis=1)
+    chosen = np.minimum(chosen, weights.shape[1] - 1)
+    chosen[total <= 0] = -1
+    return chosen
+
+
+# Choice and scoring rules of PersonAgent as batched array operations over
+# R populations of N agents: one for NumpyEngine, one per seed for
+# replicates.ReplicateEngine. Subclasses hold num_replicates, num_agents,
+# num_bars and the per-agent arrays (group, threshold, cooldown, belonging,
+# status, exit_counter, exit_attempts, last_scores), shaped (N, ...) or
+# (R, N, ...), and provide the random draws and the effective affinities
+class PopulationKernels:
+    def draw_uniforms(self, rows):
+        # One uniform in [0, 1) per flat (R * N) row index, in row order
+        raise NotImplementedError
+
+    def draw_integers(self, rows, high):
+        raise NotImplementedError
+
+    def effective_affinities(self):
+        # (R, K, 3) effective affinity of every bar for every group
+        raise NotImplementedError
+
+    def advance_cooldowns(self, rows):
+        """
+        Advance the cooldowns of the temporarily exited agents at the given
+        flat (R * N) rows. Agents whose cooldown is over return, or leave
+        for good after their third exit. Returns the returning rows
+        """
+        status = self.status.ravel()
+        exit_counter = self.exit_counter.ravel()
+
+        exit_counter[rows] += 1
+        done = rows[exit_counter[rows] >= self.cooldown.ravel()[rows]]
+        leaving_for_good = self.exit_attempts.ravel()[done] >= 2
+        status[done[leaving_for_good]] = PERM_EXITED
+        returning = done[~leaving_for_good]
+        status[returning] = ACTIVE
+        exit_counter[returning] = 0
+        self.last_scores.reshape(-1, self.num_bars)[returning] = np.nan
+        return returning
+
+    def choose_bars(self, steps, rows):
+        """
+        Bar choices of the active agents at the given flat rows (ascending).
+        Agents with no bar above their threshold exit temporarily instead.
+        Returns (entered rows, their bars, exiting rows)
+        """
+        status = self.status.ravel()
+        last_scores = self.last_scores.reshape(-1, self.num_bars)
+        group = self.group.ravel()
+        chosen = np.full(len(rows), -1, dtype=np.int64)
+
+        # During initial steps or with no previous scores: weight by bar affinity
+        if steps < 5:
+            warm = np.ones(len(rows), dtype=bool)
+        else:
+            warm = np.isnan(last_scores[rows]).all(axis=1)
+        idx = rows[warm]
+        if len(idx):
+            replicate = idx // self.num_agents
+            weights = self.effective_affinities().transpose(0, 2, 1)[replicate, group[idx]]
+            picks = weighted_choice_from_uniforms(weights, self.draw_uniforms(idx))
+            # If all weights are zero, pick randomly
+            zero = picks < 0
+            picks[zero] = self.draw_integers(idx[zero], self.num_bars)
+            chosen[warm] = picks
+
+        # After initial rounds: choose among bars scoring above the threshold
+        positions = np.flatnonzero(~warm)
+        exiting = rows[:0]
+        if len(positions):
+            idx = rows[positions]
+            scores = last_scores[idx]
+            with np.errstate(invalid="ignore"):
+                valid = scores >= self.threshold.ravel()[idx, None]
+            has_valid = valid.any(axis=1)
+
+            # No valid bar found: temporarily exit
+            exiting = idx[~has_valid]
+            status[exiting] = TEMP_EXITED
+            self.exit_counter.ravel()[exiting] = 0
+            self.exit_attempts.ravel()[exiting] += 1
+
+            idx = idx[has_valid]
+            valid = valid[has_valid]
+            weights = np.where(valid, scores[has_valid], 0.0)
+            picks = weighted_choice_from_uniforms(weights, self.draw_uniforms(idx))
+            zero = picks < 0
+            if zero.any():
+                picks[zero] = weighted_choice_from_uniforms(valid[zero].astype(float), self.draw_uniforms(idx[zero]))
+            chosen[positions[has_valid]] = picks
+
+        entered = chosen >= 0
+        return rows[entered], chosen[entered], exiting
+
+    def update_belonging_synchronous(self, idx, bars):
+        """
+        Synchronous mode: score every arrival (flat rows idx, ascending, at
+        bars) against the final composition of its bar. Returns the
+        (R, K, 3) arrival counts
+        """
+        n_groups = len(IDENTITY_GROUPS)
+        R, K = self.num_replicates, self.num_bars
+        effective = self.effective_affinities()
+
+        replicate = idx // self.num_agents
+        groups = self.group.ravel()[idx]
+        counts = np.bincount((replicate * K + bars) * n_groups + groups,
+                             minlength=R * K * n_groups).reshape(R, K, n_groups)
+        ratios = counts / np.maximum(counts.sum(axis=2, keepdims=True), 1)
+
+        social_belonging = (self.belonging.reshape(-1, n_groups)[idx] * ratios[replicate, bars]).sum(axis=1)
+        bar_affinity = effective[replicate, bars, groups]
+        alpha = self.alpha
+        self.last_scores.reshape(-1, K)[idx, bars] = alpha * bar_affinity + (1 - alpha) * social_belonging
+        return counts
+
+    def update_belonging(self, idx, bars):
+        """
+        Score every arrival (flat rows idx, ascending, at bars) against the
+        composition of its bar when it entered, in agent order. Returns the
+        (R, K, 3) arrival counts
+        """
+        n_groups = len(IDENTITY_GROUPS)
+        R, K = self.num_replicates, self.num_bars
+        effective = self.effective_affinities()
+
+        # Arrivals grouped by (population, bar), keeping agent order within each
+        replicate = idx // self.num_agents
+        keys = replicate * K + bars
+        order = np.argsort(keys, kind="stable")
+        idx, keys, replicate = idx[order], keys[order], replicate[order]
+        bars = keys - replicate * K
+        groups = self.group.ravel()[idx]
+
+        # Composition seen by each arrival: everyone who entered the same bar
+        # before, plus themselves (a cumulative count restarted at each bar)
+        arrivals = np.zeros((len(idx), n_groups))
+        arrivals[np.arange(len(idx)), groups] = 1.0
+        seen = np.cumsum(arrivals, axis=0)
+        bar_start = np.searchsorted(keys, keys, side="left")
+        before_bar = np.zeros((len(idx) + 1, n_groups))
+        before_bar[1:] = seen
+        seen -= before_bar[bar_start]
+        ratios = seen / (np.arange(len(idx)) - bar_start + 1)[:, None]
+
+        social_belonging = (self.belonging.reshape(-1, n_groups)[idx] * ratios).sum(axis=1)
+        bar_affinity = effective[replicate, bars, groups]
+        alpha = self.alpha
+        self.last_scores.reshape(-1, K)[idx, bars] = alpha * bar_affinity + (1 - alpha) * social_belonging
+
+        return np.bincount(keys * n_groups + groups, minlength=R * K * n_groups).reshape(R, K, n_groups)
+
+
+# Structure-of-arrays engine: runs the same choice rules as PersonAgent
+# as batched array operations over the whole population
+class NumpyEngine(PopulationKernels):
+    def __init__(self, model):
+        self.model = model
+        self.rng = model.rng
+        self.num_replicates = 1
+        self.num_bars = len(model.bars)
+
+        agents = list(model.agents)
+        n = len(agents)
+        self.num_agents = n
+
+        # Static per-agent attributes
+        self.group = np.array([a.group_code for a in agents], dtype=np.int64)
+        self.threshold = np.array([a.threshold for a in agents], dtype=float)
+        self.cooldown = np.array([a.cooldown_duration for a in agents], dtype=np.int64)
+
+        # Only the row for the agent's own identity group is ever read
+        self.belonging = np.array([a.belonging_row for a in agents], dtype=float).reshape(n, len(IDENTITY_GROUPS))
+
+        # Dynamic per-agent state (NaN marks a bar with no score yet)
+        self.status = np.full(n, ACTIVE, dtype=np.int64)
+        self.exit_counter = np.zeros(n, dtype=np.int64)
+        self.exit_attempts = np.zeros(n, dtype=np.int64)
+        self.current_bar = np.full(n, -1, dtype=np.int64)
+        self.last_scores = np.full((n, self.num_bars), np.nan)
+
+        # Only active agents are stepped; temporarily exited ones wait on a
+        # timing wheel (see schedule_agents) and leave it when their cooldown
+        # ends, so exit_counter is only current after settle_exit_counters
+        self.active = np.arange(n)
+        self.exit_wheel = {}
+        self.status_group_counts = np.zeros((len(AGENT_STATUSES), len(IDENTITY_GROUPS)), dtype=np.int64)
+
+    @property
+    def alpha(self):
+        return self.model.alpha
+
+    def draw_uniforms(self, rows):
+        return self.rng.random(len(rows))
+
+    def draw_integers(self, rows, high):
+        return self.rng.integers(0, high, len(rows))
+
+    def effective_affinities(self):
+        return self.model.get_effective_affinities()[None]
+
+    def schedule_agents(self):
+        """
+        Rebuild the active rows and the exit wheel, which holds temporarily
+        exited rows under the step their cooldown ends, from the status and
+        exit_counter arrays
+        """
+        steps = self.model.steps
+        self.active = np.flatnonzero(self.status == ACTIVE)
+        self.exit_wheel = {}
+        waiting = np.flatnonzero(self.status == TEMP_EXITED)
+        self.add_to_wheel(waiting, steps + self.cooldown[waiting] - self.exit_counter[waiting])
+        self.update_status_counts()
+
+    def add_to_wheel(self, rows, return_steps):
+        for return_step in np.unique(return_steps):
+            self.exit_wheel.setdefault(int(return_step), []).append(rows[return_steps == return_step])
+
+    def settle_exit_counters(self):
+        # Bring the exit counters of the rows on the wheel up to date
+        for return_step, parts in self.exit_wheel.items():
+            for rows in parts:
+                self.exit_counter[rows] = self.cooldown[rows] - (return_step - self.model.steps)
+
+    def step(self, profiler=None):
+        start = perf_counter()
+        steps = self.model.steps
+
+        # Rows whose cooldown ends this step, counters set one short of it
+        parts = self.exit_wheel.pop(steps, [])
+        due = np.sort(np.concatenate(parts)) if parts else self.active[:0]
+        self.exit_counter[due] = self.cooldown[due] - 1
+        returning = self.advance_cooldowns(due)
+        rows = np.insert(self.active, np.searchsorted(self.active, returning), returning)
+
+        entered, bars, exiting = self.choose_bars(steps, rows)
+        self.current_bar[entered] = bars
+        self.add_to_wheel(exiting, steps + self.cooldown[exiting])
+        self.active = rows[self.status[rows] == ACTIVE]
+        self.move_status_counts(due, TEMP_EXITED)
+        self.move_status_counts(exiting, ACTIVE)
+        middle = perf_counter()
+        if self.model.update_mode == "synchronous":
+            counts = self.update_belonging_synchronous(entered, bars)[0]
+        else:
+            counts = self.update_belonging(entered, bars)[0]
+
+        # Hand the per-group arrival counts to the bars
+        for bar_id in np.flatnonzero(counts.sum(axis=1)):
+            self.model.bars[bar_id].add_group_counts(
+                {g: int(counts[bar_id, i]) for i, g in enumerate(IDENTITY_GROUPS)})
+        if profiler is not None:
+            profiler.add_time("choose_bar", middle - start)
+            profiler.add_time("calculate_belonging", perf_counter() - middle)
+
+    def update_status_counts(self):
+        # Recount the per-(status, group) counters over all rows
+        n_groups = len(IDENTITY_GROUPS)
+        counts = np.bincount(self.status * n_groups + self.group, minlength=len(AGENT_STATUSES) * n_groups)
+        self.status_group_counts[:] = counts.reshape(len(AGENT_STATUSES), n_groups)
+        self.publish_status_counts()
+
+    def move_status_counts(self, rows, old_status):
+        # Move rows that left old_status to their current status in the counters
+        n_groups = len(IDENTITY_GROUPS)
+        if len(rows) == 0:
+            return
+        self.status_group_counts[old_status] -= np.bincount(self.group[rows], minlength=n_groups)
+        self.status_group_counts += np.bincount(self.status[rows] * n_groups + self.group[rows],
+                                                minlength=len(AGENT_STATUSES) * n_groups).reshape(-1, n_groups)
+        self.publish_status_counts()
+
+    def publish_status_counts(self):
+        for s, status in enumerate(AGENT_STATUSES):
+            for g, group in enumerate(IDENTITY_GROUPS):
+                self.model.status_counts[status][group] = int(self.status_group_counts[s, g])
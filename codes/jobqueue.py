@@ -0,0 +1,444 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import pandas as pd
+from batch_run import run_single, DEFAULT_FIXED_PARAMS
+from seeding import derive_seeds
+from sweep import make_design, point_params, DESIGN_METHODS, DEFAULT_POINTS
+
+# Default worker settings, stored in the job table so every worker of a
+# sweep uses the same ones
+DEFAULT_HEARTBEAT_INTERVAL = 10.0
+DEFAULT_STALE_AFTER = 60.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Seconds a connection waits for another worker's lock before giving up
+BUSY_TIMEOUT = 60.0
+
+STATUSES = ["pending", "running", "done", "failed"]
+
+# One row per (params, seed) run. The unique key makes submitting the same
+# grid twice a no-op. Seeds are text, as derived seeds use all 64 bits
+# (SQLite integers are signed). Timestamps are time.time() of the writing host
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    point_id INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    seed TEXT NOT NULL,
+    num_steps INTEGER NOT NULL,
+    convergence TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    heartbeat REAL,
+    finished_at REAL,
+    run_time REAL,
+    result TEXT,
+    error TEXT,
+    UNIQUE (params, seed, num_steps, convergence)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, job_id);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+def connect(path):
+    """
+    Open the job table in autocommit mode; writes that must be atomic run
+    in an explicit BEGIN IMMEDIATE transaction. The default rollback
+    journal is kept: WAL needs shared memory and so only works on one host
+    """
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def write_transaction(connection, function, *args):
+    """
+    Call function(connection, *args) holding the database write lock, so
+    no other worker can claim or update jobs in between
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        result = function(connection, *args)
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+    return result
+
+
+def grid_jobs(gamma_values=(0.3, 0.5, 0.7), num_runs=20, num_steps=100, fixed_params=None,
+              root_seed=None, convergence=None):
+    """
+    (point_id, params, run_id, seed, num_steps, convergence) for the runs of
+    run_batch_experiment, one point per gamma value
+    """
+    fixed_params = DEFAULT_FIXED_PARAMS if fixed_params is None else fixed_params
+    seeds = list(range(num_runs)) if root_seed is None else derive_seeds(root_seed, num_runs)
+    return [(point_id, dict(fixed_params, gamma=gamma), run_id, seeds[run_id], num_steps, convergence)
+            for point_id, gamma in enumerate(gamma_values)
+            for run_id in range(num_runs)]
+
+
+def design_jobs(design, num_runs=5, num_steps=100, fixed_params=None, root_seed=None, convergence=None,
+                space=None):
+    """
+    Jobs for the points of a sweep design (see sweep.make_design), with the
+    replicate seeds of run_sweep
+    """
+    seeds = list(range(num_runs)) if root_seed is None else derive_seeds(root_seed, num_runs)
+    return [(point_id, point_params(row, fixed_params, space), run_id, seeds[run_id], num_steps, convergence)
+            for point_id, row in enumerate(design.to_dict("records"))
+            for run_id in range(num_runs)]
+
+
+def submit_jobs(path, jobs, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL, stale_after=DEFAULT_STALE_AFTER,
+                max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Add jobs to the job table at path (created if missing) and store the
+    worker settings. Jobs already in the table are skipped; returns the
+    number added
+    """
+    if stale_after <= heartbeat_interval:
+        raise ValueError("stale_after must be longer than the heartbeat interval")
+
+    def insert(connection):
+        before = connection.total_changes
+        connection.executemany(
+            "INSERT OR IGNORE INTO jobs (point_id, params, run_id, seed, num_steps, convergence) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(point_id, json.dumps(params, sort_keys=True), run_id, str(seed), num_steps,
+              json.dumps(convergence, sort_keys=True))
+             for point_id, params, run_id, seed, num_steps, convergence in jobs])
+        added = connection.total_changes - before
+        connection.executemany("INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)",
+                               [("heartbeat_interval", heartbeat_interval), ("stale_after", stale_after),
+                                ("max_attempts", max_attempts)])
+        return added
+
+    connection = connect(path)
+    try:
+        return write_transaction(connection, insert)
+    finally:
+        connection.close()
+
+
+def read_settings(connection):
+    settings = {"heartbeat_interval": DEFAULT_HEARTBEAT_INTERVAL, "stale_after": DEFAULT_STALE_AFTER,
+                "max_attempts": DEFAULT_MAX_ATTEMPTS}
+    settings.update(connection.execute("SELECT name, value FROM settings").fetchall())
+    settings["max_attempts"] = int(settings["max_attempts"])
+    return settings
+
+
+def reclaim_stale(connection, stale_after, max_attempts, now=None):
+    """
+    Put running jobs whose heartbeat is older than stale_after seconds back
+    to pending (their worker died or lost the filesystem), or mark them
+    failed once they have been claimed max_attempts times. Returns the
+    number of jobs reclaimed
+    """
+    now = time.time() if now is None else now
+    stale = connection.execute("SELECT job_id, worker, attempts FROM jobs WHERE status = 'running' AND heartbeat < ?",
+                               (now - stale_after,)).fetchall()
+    for job_id, worker, attempts in stale:
+        error = f"no heartbeat from {worker} for {stale_after:.0f}s"
+        if attempts >= max_attempts:
+            connection.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                               (f"{error} ({attempts} attempts)", now, job_id))
+        else:
+            connection.execute("UPDATE jobs SET status = 'pending', worker = NULL, error = ? WHERE job_id = ?",
+                               (error, job_id))
+    return len(stale)
+
+
+def claim_job(connection, worker, stale_after=DEFAULT_STALE_AFTER, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Atomically take the first pending job for worker, after reclaiming stale
+    ones. Returns (job_id, job), job in run_single's format, or None when
+    nothing is pending
+    """
+    def claim(connection):
+        now = time.time()
+        reclaim_stale(connection, stale_after, max_attempts, now)
+        row = connection.execute("SELECT job_id, params, run_id, seed, num_steps, convergence FROM jobs "
+                                 "WHERE status = 'pending' ORDER BY job_id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        job_id, params, run_id, seed, num_steps, convergence = row
+        connection.execute("UPDATE jobs SET status = 'running', worker = ?, claimed_at = ?, heartbeat = ?, "
+                           "attempts = attempts + 1 WHERE job_id = ?", (worker, now, now, job_id))
+        return job_id, (json.loads(params), run_id, int(seed), num_steps, False, json.loads(convergence))
+
+    return write_transaction(connection, claim)
+
+
+def complete_job(connection, job_id, final_data, run_time):
+    """
+    Store a finished job's results. Runs are deterministic, so a result is
+    kept even if the job was reclaimed meanwhile; a second copy is dropped.
+    Returns whether the result was stored
+    """
+    result = json.dumps(final_data, default=lambda value: value.item())
+    cursor = connection.execute("UPDATE jobs SET status = 'done', result = ?, run_time = ?, finished_at = ?, "
+                                "error = NULL WHERE job_id = ? AND status != 'done'",
+                                (result, run_time, time.time(), job_id))
+    return cursor.rowcount == 1
+
+
+def fail_job(connection, job_id, worker, error):
+    """
+    Mark a job whose run raised as failed. The model is deterministic, so it
+    is not retried (see retry_failed)
+    """
+    connection.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                       "WHERE job_id = ? AND worker = ? AND status = 'running'",
+                       (error, time.time(), job_id, worker))
+
+
+def retry_failed(path):
+    """
+    Put failed jobs back to pending with their attempts reset, e.g. after
+    fixing the cause. Returns the number of jobs requeued
+    """
+    connection = connect(path)
+    try:
+        cursor = connection.execute("UPDATE jobs SET status = 'pending', worker = NULL, attempts = 0 "
+                                    "WHERE status = 'failed'")
+        return cursor.rowcount
+    finally:
+        connection.close()
+
+
+# Background thread refreshing the heartbeat of the job its worker is
+# running, so that other workers can tell a long run from a dead worker
+class Heartbeat:
+    def __init__(self, path, worker, interval=DEFAULT_HEARTBEAT_INTERVAL):
+        self.path = path
+        self.worker = worker
+        self.interval = interval
+        self.job_id = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        # sqlite connections belong to the thread that opened them
+        connection = connect(self.path)
+        try:
+            while not self.stopped.wait(self.interval):
+                job_id = self.job_id
+                if job_id is None:
+                    continue
+                try:
+                    connection.execute("UPDATE jobs SET heartbeat = ? WHERE job_id = ? AND worker = ? "
+                                       "AND status = 'running'", (time.time(), job_id, self.worker))
+                except sqlite3.OperationalError:
+                    # Locked past the busy timeout; the next beat tries again
+                    pass
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def progress(connection, window=300.0):
+    """
+    Job counts per status, workers with a recent heartbeat, and the finish
+    rate (jobs/s) over the last window seconds with the time left at that rate
+    """
+    settings = read_settings(connection)
+    now = time.time()
+    counts = dict.fromkeys(STATUSES, 0)
+    counts.update(connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    workers = connection.execute("SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = 'running' "
+                                 "AND heartbeat >= ?", (now - settings["stale_after"],)).fetchone()[0]
+    first_claim, last_finish, recent = connection.execute(
+        "SELECT MIN(claimed_at), MAX(finished_at), COUNT(*) FROM jobs WHERE status = 'done' AND finished_at >= ?",
+        (now - window,)).fetchone()
+    # Measured from the first claim when the sweep started within the window,
+    # and up to the last finish once nothing is left
+    remaining = counts["pending"] + counts["running"]
+    end = now if remaining or last_finish is None else last_finish
+    elapsed = min(window, end - first_claim) if first_claim is not None else window
+    rate = recent / elapsed if elapsed > 0 else 0.0
+    return {
+        "total": sum(counts.values()),
+        **counts,
+        "workers": workers,
+        "rate": rate,
+        "eta": remaining / rate if rate > 0 else None,
+    }
+
+
+def format_progress(report):
+    finished = report["done"] + report["failed"]
+    line = (f"{finished}/{report['total']} finished ({report['done']} done, {report['failed']} failed), "
+            f"{report['running']} running on {report['workers']} worker(s), {report['pending']} pending")
+    if report["rate"] > 0:
+        line += f", {report['rate'] * 60:.1f} jobs/min"
+    if report["eta"]:
+        line += f", about {report['eta'] / 60:.1f} min left"
+    return line
+
+
+def run_worker(path, worker=None, max_jobs=None, poll_interval=5.0, progress_interval=30.0):
+    """
+    Claim and run jobs from the job table at path until none are pending or
+    running, or max_jobs have been run. While other workers still hold jobs,
+    waits poll_interval seconds between claims to pick up any that go stale.
+    Prints a line per job, with the sweep's progress at most every
+    progress_interval seconds (progress scans the whole table).
+    Returns the number of jobs run
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}" if worker is None else worker
+    connection = connect(path)
+    settings = read_settings(connection)
+    heartbeat = Heartbeat(path, worker, settings["heartbeat_interval"])
+    jobs_run = 0
+    last_progress = None
+    try:
+        while max_jobs is None or jobs_run < max_jobs:
+            claimed = claim_job(connection, worker, settings["stale_after"], settings["max_attempts"])
+            if claimed is None:
+                if connection.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0] == 0:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            job_id, job = claimed
+            heartbeat.job_id = job_id
+            try:
+                final_data, _, run_time = run_single(job)
+            except Exception:
+                fail_job(connection, job_id, worker, traceback.format_exc())
+                status = "failed"
+            else:
+                stored = complete_job(connection, job_id, final_data, run_time)
+                status = f"done ({run_time:.2f}s)" if stored else "already done elsewhere"
+            finally:
+                heartbeat.job_id = None
+            jobs_run += 1
+            line = f"[{worker}] job {job_id} {status}"
+            if last_progress is None or time.monotonic() - last_progress >= progress_interval:
+                line += f"; {format_progress(progress(connection))}"
+                last_progress = time.monotonic()
+            print(line, flush=True)
+    finally:
+        heartbeat.stop()
+        connection.close()
+    return jobs_run
+
+
+def load_results(path):
+    """
+    One row per finished job, in job order: point id, parameters and
+    run_single's final results
+    """
+    connection = connect(path)
+    try:
+        rows = connection.execute("SELECT point_id, params, result FROM jobs WHERE status = 'done' "
+                                  "ORDER BY job_id").fetchall()
+    finally:
+        connection.close()
+    return pd.DataFrame([{"point_id": point_id, **json.loads(params), **json.loads(result)}
+                         for point_id, params, result in rows])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run batch jobs from a shared SQLite job table, with any number of workers on any hosts")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="add the gamma grid (or a sweep design) to the job table")
+    submit.add_argument("path", help="job table file, on a filesystem every worker host can reach")
+    submit.add_argument("--gamma", type=float, nargs="+", default=[0.3, 0.5, 0.7], help="gamma values of the grid")
+    submit.add_argument("--method", choices=DESIGN_METHODS, default=None,
+                        help="submit a sweep.py design instead of the gamma grid")
+    submit.add_argument("--points", type=int, default=None,
+                        help="design points (levels per parameter for grid); default "
+                             + ", ".join(f"{method} {points}" for method, points in DEFAULT_POINTS.items()))
+    submit.add_argument("--runs", type=int, default=20, help="replicates per point")
+    submit.add_argument("--steps", type=int, default=100, help="steps per run (upper bound with --converge)")
+    submit.add_argument("--converge", action="store_true", help="stop each run once it has converged")
+    submit.add_argument("--root-seed", type=int, default=None, help="derive run seeds (and the design) from this seed")
+    submit.add_argument("--heartbeat", type=float, default=DEFAULT_HEARTBEAT_INTERVAL,
+                        help="seconds between a worker's heartbeats")
+    submit.add_argument("--stale-after", type=float, default=DEFAULT_STALE_AFTER,
+                        help="reclaim running jobs without a heartbeat for this many seconds")
+    submit.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="fail a job after its worker was lost this many times")
+
+    work = commands.add_parser("work", help="run jobs until none are left")
+    work.add_argument("path")
+    work.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes on this host")
+    work.add_argument("--max-jobs", type=int, default=None, help="stop each worker after this many jobs")
+    work.add_argument("--poll", type=float, default=5.0, help="seconds between claims while others hold jobs")
+    work.add_argument("--progress", type=float, default=30.0,
+                      help="seconds between each worker's progress reports")
+
+    status = commands.add_parser("status", help="print progress")
+    status.add_argument("path")
+    status.add_argument("--watch", type=float, default=None, help="repeat every this many seconds until finished")
+
+    retry = commands.add_parser("retry", help="requeue failed jobs")
+    retry.add_argument("path")
+
+    export = commands.add_parser("export", help="write the finished jobs' results to a CSV")
+    export.add_argument("path")
+    export.add_argument("--output", required=True, help="path of the results CSV")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        convergence = {"tolerance": 0.01, "patience": 3} if args.converge else None
+        if args.method is None:
+            jobs = grid_jobs(args.gamma, args.runs, args.steps, root_seed=args.root_seed, convergence=convergence)
+        else:
+            num_points = DEFAULT_POINTS[args.method] if args.points is None else args.points
+            design = make_design(args.method, num_points, seed=args.root_seed)
+            jobs = design_jobs(design, args.runs, args.steps, root_seed=args.root_seed, convergence=convergence)
+        added = submit_jobs(args.path, jobs, args.heartbeat, args.stale_after, args.max_attempts)
+        print(f"Added {added} of {len(jobs)} jobs to '{args.path}'")
+
+    elif args.command == "work":
+        processes = [multiprocessing.Process(target=run_worker, args=(args.path,),
+                                             kwargs={"max_jobs": args.max_jobs, "poll_interval": args.poll,
+                                                     "progress_interval": args.progress})
+                     for _ in range(args.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    elif args.command == "status":
+        while True:
+            connection = connect(args.path)
+            report = progress(connection)
+            connection.close()
+            print(format_progress(report), flush=True)
+            if args.watch is None or report["pending"] + report["running"] == 0:
+                break
+            time.sleep(args.watch)
+
+    elif args.command == "retry":
+        print(f"Requeued {retry_failed(args.path)} failed jobs")
+
+    elif args.command == "export":
+        df = load_results(args.path)
+        df.to_csv(args.output, index=False)
+        print(f"{len(df)} results saved to '{args.output}'")
@@ -0,0 +1,153 @@
+import threading
+from time import perf_counter, sleep
+import numpy as np
+
+
+def get_agent_states(model):
+    """
+    (identity group code, status code, current bar or -1) arrays for all
+    agents, read from the numpy engine's arrays when it is used
+    """
+    engine = model.numpy_engine
+    if engine is not None:
+        return engine.group, engine.status, engine.current_bar
+    agents = list(model.agents)
+    groups = np.fromiter((agent.group_code for agent in agents), dtype=np.int64, count=len(agents))
+    statuses = np.fromiter((agent.status_code for agent in agents), dtype=np.int64, count=len(agents))
+    current_bars = np.fromiter((-1 if agent.current_bar is None else agent.current_bar for agent in agents),
+                               dtype=np.int64, count=len(agents))
+    return groups, statuses, current_bars
+
+
+def latest_metrics(model):
+    """
+    Reporter values of the last step, read back from the model's data
+    collector instead of being computed a second time
+    """
+    collector = model.datacollector
+    if hasattr(collector, "get_column"):
+        return {name: collector.get_column(name)[-1] for name in collector.columns}
+    # Mesa DataCollector
+    return {name: values[-1] for name, values in collector.model_vars.items()}
+
+
+# Fixed-capacity ring buffer of per-step metric records: one float row of
+# reporter values per step, written by the simulation thread and read by
+# the dashboard. Once full, the oldest steps are overwritten
+class MetricsRing:
+    def __init__(self, columns, capacity=5000):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.values = np.zeros((capacity, len(self.columns)))
+        self.steps = np.zeros(capacity, dtype=np.int64)
+        # Number of records appended so far
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, step, metrics):
+        row = [metrics[name] for name in self.columns]
+        with self.lock:
+            position = self.count % self.capacity
+            self.values[position] = row
+            self.steps[position] = step
+            self.count += 1
+
+    def snapshot(self):
+        """
+        (steps, {column: values}) of the stored records, oldest first
+        """
+        with self.lock:
+            stored = min(self.count, self.capacity)
+            order = (np.arange(stored) + self.count - stored) % self.capacity
+            steps = self.steps[order]
+            values = self.values[order]
+        return steps, {name: values[:, i] for i, name in enumerate(self.columns)}
+
+
+# Steps a model in a background thread at its own rate and publishes every
+# step's reporters to a MetricsRing, plus a copy of the agents' statuses
+# and bars at most every snapshot_interval seconds. Readers never touch the
+# model while it runs, so drawing does not slow the simulation down.
+#
+#     runner = LiveRunner(LGBTQBarModel(population_size=50000, engine="numpy"))
+#     runner.start()
+#     steps, metrics = runner.ring.snapshot()
+#     runner.stop()
+class LiveRunner:
+    def __init__(self, model, capacity=5000, max_steps=None, steps_per_second=None, snapshot_interval=0.2):
+        self.model = model
+        self.max_steps = max_steps
+        self.steps_per_second = steps_per_second
+        self.snapshot_interval = snapshot_interval
+        self.ring = MetricsRing(model.reporter_dtypes(), capacity)
+        self.bar_names = [bar.name for bar in model.bars]
+        self.reporter_prefixes = [bar.reporter_prefix for bar in model.bars]
+        # Identity groups never change; statuses and bars are copied
+        self.agent_groups = get_agent_states(model)[0].copy()
+        self.agent_snapshot = None
+        self.take_snapshot()
+
+        # Stepping runs while `active` is set; `stopped` ends the thread
+        self.active = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.error = None
+        self.rate = 0.0
+
+    def take_snapshot(self):
+        _, statuses, current_bars = get_agent_states(self.model)
+        self.agent_snapshot = (self.model.steps, statuses.copy(), current_bars.copy())
+
+    @property
+    def finished(self):
+        return not self.model.running or (self.max_steps is not None and self.model.steps >= self.max_steps)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.active.set()
+
+    def pause(self):
+        self.active.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.active.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    @property
+    def is_running(self):
+        return self.active.is_set() and not self.stopped.is_set() and not self.finished
+
+    def run(self):
+        last_snapshot = perf_counter()
+        # Steps per second, measured over about one second
+        rate_start, rate_steps = last_snapshot, self.model.steps
+        try:
+            while not self.stopped.is_set():
+                if self.finished or not self.active.is_set():
+                    self.active.clear()
+                    self.take_snapshot()
+                    self.active.wait()
+                    rate_start, rate_steps = perf_counter(), self.model.steps
+                    continue
+
+                step_start = perf_counter()
+                self.model.step()
+                self.ring.append(self.model.steps, latest_metrics(self.model))
+
+                now = perf_counter()
+                if now - last_snapshot >= self.snapshot_interval:
+                    self.take_snapshot()
+                    last_snapshot = now
+                if now - rate_start >= 1.0:
+                    self.rate = (self.model.steps - rate_steps) / (now - rate_start)
+                    rate_start, rate_steps = now, self.model.steps
+                if self.steps_per_second:
+                    sleep(max(0.0, 1.0 / self.steps_per_second - (now - step_start)))
+        except Exception as error:
+            # Surfaced by the dashboard instead of dying silently in the thread
+            self.error = error
+            self.active.clear()
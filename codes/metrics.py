@@ -0,0 +1,176 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# Columnar per-step metrics store with the DataCollector interface used in
+# this project: one preallocated NumPy buffer per reporter, grown by doubling
+class MetricsCollector:
+    def __init__(self, columns, initial_capacity=128):
+        """
+        columns maps each reporter name to its NumPy dtype
+        """
+        self.columns = list(columns)
+        self.dtypes = dict(columns)
+        self.length = 0
+        self.buffers = {name: np.empty(initial_capacity, dtype=self.dtypes[name])
+                        for name in self.columns}
+
+    def grow(self):
+        for name, buffer in self.buffers.items():
+            grown = np.empty(2 * len(buffer), dtype=buffer.dtype)
+            grown[:self.length] = buffer[:self.length]
+            self.buffers[name] = grown
+
+    def collect(self, model):
+        # All metrics of a step come from one call
+        values = model.compute_metrics()
+        if self.length == len(self.buffers[self.columns[0]]):
+            self.grow()
+        for name in self.columns:
+            self.buffers[name][self.length] = values[name]
+        self.length += 1
+
+    def load_model_vars(self, columns):
+        # Replace the collected values, e.g. when restoring a checkpoint
+        self.length = len(columns[self.columns[0]]) if self.columns else 0
+        for name in self.columns:
+            buffer = np.empty(max(self.length, 1) * 2, dtype=self.dtypes[name])
+            buffer[:self.length] = columns[name]
+            self.buffers[name] = buffer
+
+    def get_column(self, name):
+        # View of one reporter's values so far, without copying
+        return self.buffers[name][:self.length]
+
+    def get_model_vars_dataframe(self):
+        return pd.DataFrame({name: self.buffers[name][:self.length].copy() for name in self.columns})
+
+
+# File layout of MemmapCollector / MetricsFile: an 8-byte magic, the number
+# of rows written (uint64), the size of a JSON header (uint64) describing
+# the columns, the header itself, then one packed record per step from
+# data_offset on
+MEMMAP_MAGIC = b"LBARTS\x00\x01"
+MEMMAP_PREFIX_BYTES = 24
+MEMMAP_ALIGNMENT = 4096
+
+
+# Read access to a metrics file written by MemmapCollector. Nothing is
+# loaded on opening: columns are views into the memory-mapped file, and
+# only the pages of the rows sliced are read. A file still being written
+# can be read; the row count is read from the file on every access
+class MetricsFile:
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.mode = mode
+        with open(path, "rb") as f:
+            prefix = f.read(MEMMAP_PREFIX_BYTES)
+            if prefix[:len(MEMMAP_MAGIC)] != MEMMAP_MAGIC:
+                raise ValueError(f"{path} is not a metrics file")
+            header = json.loads(f.read(int.from_bytes(prefix[16:24], "little")))
+        self.columns = [name for name, _ in header["columns"]]
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in header["columns"]}
+        self.row_dtype = np.dtype([(name, self.dtypes[name]) for name in self.columns])
+        self.data_offset = header["data_offset"]
+        self.row_count = np.memmap(path, dtype="<u8", mode=mode, offset=8, shape=(1,))
+        self.map_rows()
+
+    def map_rows(self):
+        capacity = (os.path.getsize(self.path) - self.data_offset) // self.row_dtype.itemsize
+        if capacity == 0:
+            self.rows = np.zeros(0, dtype=self.row_dtype)
+        else:
+            self.rows = np.memmap(self.path, dtype=self.row_dtype, mode=self.mode, offset=self.data_offset,
+                                  shape=(capacity,))
+
+    @property
+    def length(self):
+        return int(self.row_count[0])
+
+    def __len__(self):
+        return self.length
+
+    def written_rows(self):
+        # Remap if the writer has grown the file since it was opened
+        length = self.length
+        if length > len(self.rows):
+            self.map_rows()
+        return self.rows[:length]
+
+    def get_column(self, name, start=None, stop=None):
+        # View of one reporter's values over a range of rows, without reading the rest
+        return self.written_rows()[name][start:stop]
+
+    def get_model_vars_dataframe(self, start=None, stop=None):
+        rows = self.written_rows()[start:stop]
+        return pd.DataFrame({name: np.array(rows[name]) for name in self.columns})
+
+    def close(self):
+        self.rows = None
+        self.row_count = None
+
+
+# DataCollector-compatible store writing every step's reporters straight
+# into a preallocated memory-mapped file (see MetricsFile for the layout),
+# so per-step data costs no RAM and survives the process. The file doubles
+# in size when full and is trimmed to the rows written on close.
+#
+#     model = LGBTQBarModel(collector="memmap", metrics_path="run.metrics")
+#     ...
+#     MetricsFile("run.metrics").get_column("WomenBar_QW_Ratio", 50000, 60000)
+class MemmapCollector(MetricsFile):
+    def __init__(self, path, columns, initial_capacity=1024, overwrite=False):
+        """
+        columns maps each reporter name to its NumPy dtype. An existing file
+        at path raises FileExistsError unless overwrite is set
+        """
+        header = {"columns": [[name, np.dtype(dtype).str] for name, dtype in columns.items()]}
+        header_size = len(json.dumps(dict(header, data_offset=0)))
+        # Room for data_offset's digits, then round up to the alignment
+        data_offset = -(-(MEMMAP_PREFIX_BYTES + header_size + 20) // MEMMAP_ALIGNMENT) * MEMMAP_ALIGNMENT
+        header_bytes = json.dumps(dict(header, data_offset=data_offset)).encode()
+        row_size = np.dtype([(name, dtype) for name, dtype in columns.items()]).itemsize
+        with open(path, "wb" if overwrite else "xb") as f:
+            f.write(MEMMAP_MAGIC + (0).to_bytes(8, "little") + len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            f.truncate(data_offset + max(initial_capacity, 1) * row_size)
+        super().__init__(path, mode="r+")
+
+    def resize(self, capacity):
+        # Drop the mapping before changing the file size, then map it again
+        if isinstance(self.rows, np.memmap):
+            self.rows.flush()
+        self.rows = None
+        with open(self.path, "r+b") as f:
+            f.truncate(self.data_offset + capacity * self.row_dtype.itemsize)
+        self.map_rows()
+
+    def collect(self, model):
+        values = model.compute_metrics()
+        length = self.length
+        if length == len(self.rows):
+            self.resize(2 * max(length, 1))
+        # Written in place into the mapped row
+        self.rows[length] = tuple(values[name] for name in self.columns)
+        self.row_count[0] = length + 1
+
+    def load_model_vars(self, columns):
+        # Replace the collected values, e.g. when restoring a checkpoint
+        length = len(columns[self.columns[0]]) if self.columns else 0
+        if length > len(self.rows):
+            self.resize(length)
+        for name in self.columns:
+            self.rows[name][:length] = columns[name]
+        self.row_count[0] = length
+
+    def flush(self):
+        if isinstance(self.rows, np.memmap):
+            self.rows.flush()
+        self.row_count.flush()
+
+    def close(self):
+        self.flush()
+        self.resize(self.length)
+        super().close()
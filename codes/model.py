@@ -1,8 +1,101 @@
+import heapq
+from operator import attrgetter
 import mesa
 from mesa.datacollection import DataCollector
-from agent import IDENTITY_GROUPS, BASE_BELONGING_MATRIX, Bar, PersonAgent
-from mesa.visualization.utils import force_update
+from agent import (IDENTITY_GROUPS, GROUP_INDEX, AGENT_STATUSES, ACTIVE, TEMP_EXITED, BASE_BELONGING_MATRIX,
+                   Bar, PersonAgent, generate_belonging_rows)
+from checkpoint import save_checkpoint, load_checkpoint
+from engine import NumpyEngine
+from metrics import MetricsCollector, MemmapCollector
+from profiling import StepProfiler
+from seeding import substream
 import numpy as np
+from time import perf_counter
+
+# Bar archetypes with fixed configurations
+# Women-only bar
+WOMEN_ONLY_BAR_AFFINITY = {
+    "QW": 1.0,    # Fully welcome Queer Women
+    "NQW": 0.7,   # Mostly welcome Non-Queer Women
+    "QNW": 0.2    # not welcome Queer Non-Women
+}
+
+# Queer-friendly bar
+QUEER_FRIENDLY_BAR_AFFINITY = {
+    "QW": 1.0,    # Fully welcome Queer Women
+    "NQW": 0.2,   # not welcome Non-Queer Women
+    "QNW": 0.7    # msostly welcome Queer Non-Women
+}
+
+
+def default_bar_configs(num_bars=2):
+    """
+    (name, reporter prefix, fixed affinity) for a scene of num_bars bars
+    alternating between the women-only and queer-friendly archetypes
+    """
+    archetypes = [
+        ("women_only_bar", "WomenBar", WOMEN_ONLY_BAR_AFFINITY),
+        ("queer_friendly_bar", "QueerBar", QUEER_FRIENDLY_BAR_AFFINITY),
+    ]
+    configs = []
+    for bar_id in range(num_bars):
+        name, prefix, affinity = archetypes[bar_id % 2]
+        copy_number = bar_id // 2 + 1
+        if copy_number > 1:
+            name = f"{name}_{copy_number}"
+            prefix = f"{prefix}{copy_number}"
+        configs.append((name, prefix, affinity))
+    return configs
+
+
+def make_bar_configs(num_bars=2, bar_affinities=None, bar_names=None):
+    """
+    (name, reporter prefix, fixed affinity) of every bar: the default scene
+    alternates the women-only and queer-friendly archetypes; bar_affinities
+    gives each bar's fixed affinity as a {group: value} dict or a row in
+    IDENTITY_GROUPS order
+    """
+    if bar_affinities is None:
+        return default_bar_configs(num_bars)
+    if bar_names is None:
+        bar_names = [f"bar_{bar_id}" for bar_id in range(len(bar_affinities))]
+    bar_configs = []
+    for bar_id, affinity in enumerate(bar_affinities):
+        if not isinstance(affinity, dict):
+            affinity = {group: float(affinity[i]) for i, group in enumerate(IDENTITY_GROUPS)}
+        bar_configs.append((bar_names[bar_id], f"Bar{bar_id}", affinity))
+    return bar_configs
+
+
+# Batch result columns of the default bars keep their original short names
+RESULT_PREFIXES = {"women_only_bar": "women_bar", "queer_friendly_bar": "queer_bar"}
+
+
+def result_prefix(bar_name):
+    # Prefix of a bar's batch result columns, e.g. "women_bar_qw_ratio"
+    return RESULT_PREFIXES.get(bar_name, bar_name)
+
+
+def reporter_dtypes(reporter_prefixes):
+    # Reporter names, in DataCollector order, with their column types
+    dtypes = {}
+    for prefix in reporter_prefixes:
+        for group in IDENTITY_GROUPS:
+            dtypes[f"{prefix}_{group}_Ratio"] = np.float64
+        dtypes[f"{prefix}_Population"] = np.int64
+        for group in IDENTITY_GROUPS:
+            dtypes[f"{prefix}_{group}_AdaptiveAffinity"] = np.float64
+        dtypes[f"{prefix}_QW_EffectiveAffinity"] = np.float64
+    dtypes["TempExited_Agents"] = np.int64
+    dtypes["PermExited_Agents"] = np.int64
+    for group in IDENTITY_GROUPS:
+        dtypes[f"Active_{group}"] = np.int64
+    return dtypes
+
+
+# Belonging update modes, see LGBTQBarModel.__init__
+UPDATE_MODES = ["sequential", "synchronous"]
+
 
 class LGBTQBarModel(mesa.Model):
     def __init__(self, 
@@ -13,18 +106,69 @@ class LGBTQBarModel(mesa.Model):
                  QW_ratio=0.4,
                  QNW_ratio=0.3,
                  adaptive_update_interval=10,
+                 engine="object",
+                 update_mode="sequential",
+                 keep_full_history=False,
+                 collector="numpy",
+                 metrics_path=None,
+                 overwrite_metrics=False,
+                 num_bars=2,
+                 bar_affinities=None,
+                 bar_names=None,
+                 belonging_init="batched",
+                 profile=False,
                  seed=None):
 
         super().__init__(seed=seed)
+        
+        # Constructor arguments, kept for checkpoints
+        self.init_params = dict(
+            population_size=population_size, alpha=alpha, gamma=gamma,
+            init_identity_ratios=init_identity_ratios, QW_ratio=QW_ratio, QNW_ratio=QNW_ratio,
+            adaptive_update_interval=adaptive_update_interval, engine=engine, update_mode=update_mode,
+            keep_full_history=keep_full_history, collector=collector, metrics_path=metrics_path,
+            overwrite_metrics=overwrite_metrics, num_bars=num_bars,
+            bar_affinities=bar_affinities, bar_names=bar_names, belonging_init=belonging_init,
+            profile=profile, seed=seed)
+        
+        # All randomness goes through self.random / self.rng, which Mesa seeds
+        # from `seed`; extra independent streams are derived from root_seed
+        self.root_seed = seed if seed is not None else self.random.getrandbits(64)
         self.num_agents = population_size
         self.alpha = alpha  # Weight of bar affinity in belonging calculation
-        self.gamma = gamma  # Learning rate for adaptive affinity updates
+        self._gamma = gamma  # Learning rate for adaptive affinity updates
         self.running = True
         self.agent_threshold = 0.55
         
+        # Step engine: "object" runs PersonAgent methods one agent at a time,
+        # "numpy" runs the same rules as batched array operations
+        if engine not in ("object", "numpy"):
+            raise ValueError(f"Unknown engine: {engine}")
+        self.engine = engine
+        
+        # Belonging update: "sequential" scores each arrival against the bar
+        # as filled so far (agent order matters), "synchronous" lets every
+        # agent choose first and scores all arrivals against the final
+        # composition of the round. Results of the two modes differ
+        if update_mode not in UPDATE_MODES:
+            raise ValueError(f"Unknown update_mode: {update_mode}")
+        self.update_mode = update_mode
+        
+        # Optional per-phase step timers, None when profiling is off
+        self.profiler = StepProfiler() if profile else None
+        
+        # Functions called with the model at the end of every step,
+        # e.g. to redraw a dashboard; empty when running headless
+        self.step_hooks = []
+        
         # Store for synchronization
         self.bar_choices = {}  # Store each agent's choice {agent_id: bar_id}
         
+        # Number of agents per status and identity group, kept up to date
+        # as agents change status
+        self.status_counts = {status: {group: 0 for group in IDENTITY_GROUPS}
+                              for status in AGENT_STATUSES}
+        
         # Set initial identity group ratios
         if init_identity_ratios is None:
             NQW_ratio = 1.0 - QW_ratio - QNW_ratio
@@ -35,31 +179,33 @@ class LGBTQBarModel(mesa.Model):
                 "QNW": QNW_ratio
             }
         
-        # Create the two bars with fixed configurations
-        # Women-only bar
-        women_only_bar_affinity = {
-            "QW": 1.0,    # Fully welcome Queer Women
-            "NQW": 0.7,   # Mostly welcome Non-Queer Women
-            "QNW": 0.2    # not welcome Queer Non-Women
-        }
-        
-        # Queer-friendly bar
-        queer_friendly_bar_affinity = {
-            "QW": 1.0,    # Fully welcome Queer Women
-            "NQW": 0.2,   # not welcome Non-Queer Women
-            "QNW": 0.7    # msostly welcome Queer Non-Women
-        }
-        
-        # Create the two bars
-        self.women_bar = Bar(women_only_bar_affinity, name="women_only_bar", 
-                            adaptive_update_interval=adaptive_update_interval, gamma=self.gamma)
-        self.queer_bar = Bar(queer_friendly_bar_affinity, name="queer_friendly_bar", 
-                            adaptive_update_interval=adaptive_update_interval, gamma=self.gamma)
-        
-        # Keep bars list for compatibility with existing code
-        self.bars = [self.women_bar, self.queer_bar]
+        # Bar configurations (see make_bar_configs)
+        bar_configs = make_bar_configs(num_bars, bar_affinities, bar_names)
         
-        # Create Agents
+        # (K, 3) fixed, adaptive and effective affinity arrays; each bar works on its row
+        num_bars = len(bar_configs)
+        self.fixed_affinities = np.empty((num_bars, len(IDENTITY_GROUPS)))
+        self.adaptive_affinities = np.empty((num_bars, len(IDENTITY_GROUPS)))
+        self.effective_affinities = np.empty((num_bars, len(IDENTITY_GROUPS)))
+        
+        # Create the bars
+        self.bars = []
+        for bar_id, (name, prefix, affinity) in enumerate(bar_configs):
+            bar = Bar(affinity, name=name, reporter_prefix=prefix,
+                      adaptive_update_interval=adaptive_update_interval, gamma=self.gamma,
+                      keep_full_history=keep_full_history, on_gamma_change=self.refresh_effective_weights,
+                      affinity_rows=(self.fixed_affinities[bar_id], self.adaptive_affinities[bar_id],
+                                     self.effective_affinities[bar_id]))
+            self.bars.append(bar)
+        self.refresh_effective_weights()
+        
+        # Keep named bars for compatibility with existing code
+        if bar_affinities is None and num_bars >= 2:
+            self.women_bar = self.bars[0]
+            self.queer_bar = self.bars[1]
+        
+        # Draw agent attributes
+        agent_specs = []
         for i in range(self.num_agents):
             # Assign identity group based on ratios
             r = self.random.random()
@@ -72,58 +218,138 @@ class LGBTQBarModel(mesa.Model):
                     assigned_group = group
                     break
             
-            # Setting individual thresholds
+            # Setting individual thresholds and cooldowns
             base_threshold = self.agent_threshold 
             threshold = self.random.uniform(base_threshold-0.15, base_threshold+0.15)
+            cooldown_duration = self.random.randint(5, 15)
+            agent_specs.append((assigned_group, threshold, cooldown_duration))
+        
+        # Personal belonging rows: "batched" draws all of them in one call from
+        # the model's generator, "per_agent" reproduces the original values
+        # from a generator seeded with each agent's unique_id
+        if belonging_init == "batched":
+            group_codes = [GROUP_INDEX[group] for group, _, _ in agent_specs]
+            belonging_rows = generate_belonging_rows(group_codes, self.rng)
+        elif belonging_init == "per_agent":
+            belonging_rows = [None] * self.num_agents
+        else:
+            raise ValueError(f"Unknown belonging_init: {belonging_init}")
+        
+        # Create Agents
+        for (assigned_group, threshold, cooldown_duration), belonging_row in zip(agent_specs, belonging_rows):
+            agent = PersonAgent(self, assigned_group, threshold, cooldown_duration, belonging_row)
+        
+        # Move agent state into arrays for the numpy engine
+        self.numpy_engine = NumpyEngine(self) if engine == "numpy" else None
+        self.schedule_agents()
             
-            # Create Agent
-            agent = PersonAgent(self, assigned_group, threshold)
-            
-        # Set data collector with simplified bar references
-        model_reporters = {
-            "WomenBar_QW_Ratio": lambda m: self.get_bar_group_ratio(0, "QW"),
-            "WomenBar_NQW_Ratio": lambda m: self.get_bar_group_ratio(0, "NQW"),
-            "WomenBar_QNW_Ratio": lambda m: self.get_bar_group_ratio(0, "QNW"),
-            "WomenBar_Population": lambda m: self.get_bar_population(0),
-            "WomenBar_QW_AdaptiveAffinity": lambda m: self.women_bar.adaptive_affinity["QW"],
-            "WomenBar_NQW_AdaptiveAffinity": lambda m: self.women_bar.adaptive_affinity["NQW"],
-            "WomenBar_QNW_AdaptiveAffinity": lambda m: self.women_bar.adaptive_affinity["QNW"],
-            "WomenBar_QW_EffectiveAffinity": lambda m: self.women_bar.calculate_effective_affinity()["QW"],
-            "QueerBar_QW_Ratio": lambda m: self.get_bar_group_ratio(1, "QW"),
-            "QueerBar_NQW_Ratio": lambda m: self.get_bar_group_ratio(1, "NQW"),
-            "QueerBar_QNW_Ratio": lambda m: self.get_bar_group_ratio(1, "QNW"),
-            "QueerBar_Population": lambda m: self.get_bar_population(1),
-            "QueerBar_QW_AdaptiveAffinity": lambda m: self.queer_bar.adaptive_affinity["QW"],
-            "QueerBar_NQW_AdaptiveAffinity": lambda m: self.queer_bar.adaptive_affinity["NQW"],
-            "QueerBar_QNW_AdaptiveAffinity": lambda m: self.queer_bar.adaptive_affinity["QNW"],
-            "QueerBar_QW_EffectiveAffinity": lambda m: self.queer_bar.calculate_effective_affinity()["QW"],
-            "TempExited_Agents": lambda m: self.count_temp_exited_agents(),
-            "PermExited_Agents": lambda m: self.count_permanently_exited_agents(),  
-            "Active_QW": lambda m: self.count_active_by_group("QW"),
-            "Active_NQW": lambda m: self.count_active_by_group("NQW"),
-            "Active_QNW": lambda m: self.count_active_by_group("QNW")
-        }
-            
-        self.datacollector = DataCollector(model_reporters=model_reporters)
+        # Set data collector with reporters generated for every bar
+        model_reporters = {}
+        for bar_id, bar in enumerate(self.bars):
+            model_reporters.update(self.make_bar_reporters(bar_id))
+        model_reporters.update({
+            "TempExited_Agents": lambda m: m.count_temp_exited_agents(),
+            "PermExited_Agents": lambda m: m.count_permanently_exited_agents(),  
+            "Active_QW": lambda m: m.count_active_by_group("QW"),
+            "Active_NQW": lambda m: m.count_active_by_group("NQW"),
+            "Active_QNW": lambda m: m.count_active_by_group("QNW")
+        })
         
-    def get_bar_group_ratio(self, bar_id, group):
+        # "numpy" computes all reporters in one pass into columnar buffers,
+        # "memmap" writes the same rows to a memory-mapped file at
+        # metrics_path (for very long runs; an existing file is only replaced
+        # with overwrite_metrics), "mesa" evaluates the reporter functions
+        # with Mesa's DataCollector
+        if collector == "numpy":
+            self.datacollector = MetricsCollector(self.reporter_dtypes())
+        elif collector == "memmap":
+            if metrics_path is None:
+                raise ValueError("collector='memmap' needs a metrics_path")
+            self.datacollector = MemmapCollector(metrics_path, self.reporter_dtypes(), overwrite=overwrite_metrics)
+        elif collector == "mesa":
+            self.datacollector = DataCollector(model_reporters=model_reporters)
+        else:
+            raise ValueError(f"Unknown collector: {collector}")
+        
+    def make_bar_reporters(self, bar_id):
+        # Mesa reporter functions for one bar, named after its reporter prefix
         bar = self.bars[bar_id]
-        ratios = bar.get_current_population_ratios()
-        return ratios[group]
+        prefix = bar.reporter_prefix
+        reporters = {}
+        for group in IDENTITY_GROUPS:
+            reporters[f"{prefix}_{group}_Ratio"] = lambda m, group=group: bar.get_group_ratio(group)
+        reporters[f"{prefix}_Population"] = lambda m: bar.population
+        for group in IDENTITY_GROUPS:
+            reporters[f"{prefix}_{group}_AdaptiveAffinity"] = lambda m, group=group: bar.adaptive_affinity[group]
+        reporters[f"{prefix}_QW_EffectiveAffinity"] = lambda m: bar.calculate_effective_affinity()["QW"]
+        return reporters
+    
+    @property
+    def gamma(self):
+        return self._gamma
+    
+    @gamma.setter
+    def gamma(self, value):
+        # Changing gamma invalidates every bar's cached effective affinity;
+        # each bar then refreshes the model's choice weights
+        self._gamma = value
+        for bar in self.bars:
+            bar.gamma = value
+    
+    def refresh_effective_weights(self):
+        # Per-group lists of bar affinities used as choice weights by agents
+        self.effective_weights = {group: self.effective_affinities[:, i].tolist()
+                                  for i, group in enumerate(IDENTITY_GROUPS)}
+    
+    def get_effective_affinities(self):
+        # (K, 3) effective affinity of every bar for every group; kept up to
+        # date by the bars, treat as read-only
+        return self.effective_affinities
+    
+    def add_step_hook(self, hook):
+        self.step_hooks.append(hook)
+    
+    def substream(self, *key):
+        # Independent generator for an integer key path, e.g. (agent.unique_id,)
+        return substream(self.root_seed, *key)
+    
+    def get_bar_group_ratio(self, bar_id, group):
+        return self.bars[bar_id].get_group_ratio(group)
     
     def get_bar_population(self, bar_id):
-        return len(self.bars[bar_id].current_visitors)
+        return self.bars[bar_id].population
     
     def count_temp_exited_agents(self):
-        return sum(1 for agent in self.agents if agent.status == "temp_exited")
+        return sum(self.status_counts["temp_exited"].values())
     
     def count_permanently_exited_agents(self):
-        return sum(1 for agent in self.agents 
-                  if agent.status == "permanently_exited" or agent.permanent_exit)
+        return sum(self.status_counts["permanently_exited"].values())
     
     def count_active_by_group(self, group):
-        return sum(1 for agent in self.agents 
-                  if agent.identity_group == group and agent.status == "active")
+        return self.status_counts["active"][group]
+    
+    def reporter_dtypes(self):
+        return reporter_dtypes([bar.reporter_prefix for bar in self.bars])
+    
+    def compute_metrics(self):
+        # All reporter values for the current step in one pass over the
+        # bars and the status counters
+        metrics = {}
+        effective_qw = self.effective_affinities[:, IDENTITY_GROUPS.index("QW")]
+        for bar_id, bar in enumerate(self.bars):
+            prefix = bar.reporter_prefix
+            ratios = bar.get_current_population_ratios()
+            for group in IDENTITY_GROUPS:
+                metrics[f"{prefix}_{group}_Ratio"] = ratios[group]
+            metrics[f"{prefix}_Population"] = bar.population
+            for i, group in enumerate(IDENTITY_GROUPS):
+                metrics[f"{prefix}_{group}_AdaptiveAffinity"] = self.adaptive_affinities[bar_id, i]
+            metrics[f"{prefix}_QW_EffectiveAffinity"] = effective_qw[bar_id]
+        metrics["TempExited_Agents"] = self.count_temp_exited_agents()
+        metrics["PermExited_Agents"] = self.count_permanently_exited_agents()
+        for group in IDENTITY_GROUPS:
+            metrics[f"Active_{group}"] = self.status_counts["active"][group]
+        return metrics
     
     def get_average_belonging_matrix(self):
         # Initialize average matrix with zeros
@@ -141,8 +367,8 @@ class LGBTQBarModel(mesa.Model):
             group = agent.identity_group
             group_counts[group] += 1
             
-            for to_group in IDENTITY_GROUPS:
-                sum_matrix[group][to_group] += agent.belonging_matrix[group][to_group]
+            for i, to_group in enumerate(IDENTITY_GROUPS):
+                sum_matrix[group][to_group] += agent.belonging_row[i]
         
         # Calculate averages
         avg_matrix = {}
@@ -167,8 +393,8 @@ class LGBTQBarModel(mesa.Model):
         # Collect all belonging values
         for agent in self.agents:
             group = agent.identity_group
-            for to_group in IDENTITY_GROUPS:
-                all_values[group][to_group].append(agent.belonging_matrix[group][to_group])
+            for i, to_group in enumerate(IDENTITY_GROUPS):
+                all_values[group][to_group].append(agent.belonging_row[i])
         
         # Calculate statistics
         stats = {}
@@ -195,15 +421,103 @@ class LGBTQBarModel(mesa.Model):
         
         return stats
     
+    def save_checkpoint(self, path):
+        # Full model state as a compressed .npz file (see checkpoint.py)
+        save_checkpoint(self, path)
+    
+    @classmethod
+    def from_checkpoint(cls, path, **overrides):
+        # Restore a model saved with save_checkpoint; overrides may change
+        # alpha, gamma, engine or profile, e.g. to fork variants from one state;
+        # a memmap run also needs a new metrics_path
+        return load_checkpoint(cls, path, **overrides)
+    
+    def enable_profiling(self):
+        # Start recording per-phase step timings (see profiling.StepProfiler)
+        self.profiler = StepProfiler()
+        return self.profiler
+    
+    def schedule_agents(self):
+        """
+        Rebuild the list of active agents and the exit wheel, which holds
+        temporarily exited agents under the step their cooldown ends, from
+        the agents' statuses and exit counters. Only these agents are
+        stepped; permanently exited ones are never visited again
+        """
+        if self.numpy_engine is not None:
+            self.numpy_engine.schedule_agents()
+            return
+        self.active_agents = [agent for agent in self.agents if agent.status_code == ACTIVE]
+        self.exit_wheel = {}
+        for agent in self.agents:
+            if agent.status_code == TEMP_EXITED:
+                return_step = self.steps + agent.cooldown_duration - agent.exit_counter
+                self.exit_wheel.setdefault(return_step, []).append(agent)
+    
+    def settle_exit_counters(self):
+        # Agents on the exit wheel only count their cooldown when it ends;
+        # bring their exit counters up to date (e.g. for a checkpoint)
+        if self.numpy_engine is not None:
+            self.numpy_engine.settle_exit_counters()
+            return
+        for return_step, agents in self.exit_wheel.items():
+            for agent in agents:
+                agent.exit_counter = agent.cooldown_duration - (return_step - self.steps)
+    
+    def scheduled_agents(self):
+        # Agents to step this round, in agent order: the active ones and
+        # those whose cooldown ends now, with their counters one short of
+        # it so that choose_bar ends the cooldown
+        due = self.exit_wheel.pop(self.steps, None)
+        if not due:
+            return self.active_agents
+        for agent in due:
+            agent.exit_counter = agent.cooldown_duration - 1
+        order = attrgetter("unique_id")
+        return list(heapq.merge(self.active_agents, sorted(due, key=order), key=order))
+    
+    def reschedule_agents(self, agents):
+        # After the agent phase: keep the agents still active and put the
+        # ones that just exited on the wheel
+        self.active_agents = []
+        for agent in agents:
+            if agent.status_code == ACTIVE:
+                self.active_agents.append(agent)
+            elif agent.status_code == TEMP_EXITED:
+                self.exit_wheel.setdefault(self.steps + agent.cooldown_duration, []).append(agent)
+    
+    def synchronous_agent_step(self, agents, profiler=None):
+        """
+        Agent phase of the synchronous mode for the object engine: every
+        agent chooses first, then all arrivals are scored against the
+        final composition of their bar
+        """
+        start = perf_counter()
+        arrivals = []
+        for agent in agents:
+            chosen_bar_id = agent.choose_bar()
+            if chosen_bar_id is not None:
+                agent.current_bar = chosen_bar_id
+                self.bars[chosen_bar_id].add_visitors([agent.identity_group])
+                arrivals.append(agent)
+        middle = perf_counter()
+        
+        for agent in arrivals:
+            bar_id = agent.current_bar
+            agent.update_last_score(bar_id, agent.calculate_belonging(self.bars[bar_id]))
+        if profiler is not None:
+            profiler.add_time("choose_bar", middle - start)
+            profiler.add_time("calculate_belonging", perf_counter() - middle)
+    
     def step(self):
-        # Clear current visitors from both bars
-        self.women_bar.current_visitors = []
-        self.queer_bar.current_visitors = []
+        profiler = self.profiler
+        step_start = perf_counter()
+        
+        # Clear current visitors and counts from all bars
+        for bar in self.bars:
+            bar.start_round()
 
         def agent_step(agent):
-            if agent.status == "permanently_exited" or agent.permanent_exit:
-                return
-                
             # Agent chooses bar
             chosen_bar_id = agent.choose_bar()
             if chosen_bar_id is not None:
@@ -216,14 +530,58 @@ class LGBTQBarModel(mesa.Model):
                 belonging_score = agent.calculate_belonging(bar)
                 agent.update_last_score(chosen_bar_id, belonging_score)
         
-        self.agents.do(agent_step)
+        def profiled_agent_step(agent):
+            # Same as agent_step, timing the choice and belonging phases
+            start = perf_counter()
+            chosen_bar_id = agent.choose_bar()
+            profiler.add_time("choose_bar", perf_counter() - start)
+            if chosen_bar_id is not None:
+                start = perf_counter()
+                agent.current_bar = chosen_bar_id
+                bar = self.bars[chosen_bar_id]
+                bar.add_visitors([agent.identity_group])
+                belonging_score = agent.calculate_belonging(bar)
+                agent.update_last_score(chosen_bar_id, belonging_score)
+                profiler.add_time("calculate_belonging", perf_counter() - start)
         
-        # End current round for both bars
-        self.women_bar.end_round()
-        self.queer_bar.end_round()
+        if self.numpy_engine is not None:
+            self.numpy_engine.step(profiler)
+        else:
+            agents = self.scheduled_agents()
+            if self.update_mode == "synchronous":
+                self.synchronous_agent_step(agents, profiler)
+            elif profiler is None:
+                for agent in agents:
+                    agent_step(agent)
+            else:
+                for agent in agents:
+                    profiled_agent_step(agent)
+            self.reschedule_agents(agents)
+        phase_start = perf_counter()
+        
+        # End current round for all bars
+        adaptive_updates = 0
+        for bar in self.bars:
+            adaptive_updates += bar.end_round()
+        if adaptive_updates:
+            self.refresh_effective_weights()
+        phase_end = perf_counter()
+        if profiler is not None:
+            profiler.add_time("end_round", phase_end - phase_start)
+        phase_start = phase_end
         
         # Collect data
         self.datacollector.collect(self)
+        phase_end = perf_counter()
+        if profiler is not None:
+            profiler.add_time("collect", phase_end - phase_start)
+        phase_start = phase_end
+        
+        # Run step hooks (e.g. visualization updates)
+        for hook in self.step_hooks:
+            hook(self)
         
-        # Force update visualization
-        force_update()
\ No newline at end of file
+        if profiler is not None:
+            phase_end = perf_counter()
+            profiler.add_time("step_hooks", phase_end - phase_start)
+            profiler.record_step(self, phase_end - step_start, adaptive_updates)
@@ -0,0 +1,50 @@
+import pandas as pd
+
+# Phases of LGBTQBarModel.step, in execution order
+STEP_PHASES = ["choose_bar", "calculate_belonging", "end_round", "collect", "step_hooks"]
+
+
+# Per-phase timers and counters for LGBTQBarModel.step, enabled with
+# LGBTQBarModel(profile=True) or model.enable_profiling()
+class StepProfiler:
+    def __init__(self):
+        self.records = []
+        self.phase_times = {phase: 0.0 for phase in STEP_PHASES}
+
+    def add_time(self, phase, seconds):
+        self.phase_times[phase] += seconds
+
+    def record_step(self, model, total_time, adaptive_updates):
+        """
+        Close the current step: store its phase times and counters
+        """
+        record = {"step": model.steps, "total": total_time}
+        record.update(self.phase_times)
+        record["active"] = sum(model.status_counts["active"].values())
+        record["temp_exited"] = model.count_temp_exited_agents()
+        record["permanently_exited"] = model.count_permanently_exited_agents()
+        record["adaptive_updates"] = adaptive_updates
+        self.records.append(record)
+        self.phase_times = {phase: 0.0 for phase in STEP_PHASES}
+
+    def get_dataframe(self, cumulative=False):
+        """
+        One row per step with the time spent in each phase (seconds) and the
+        step's counters; cumulative=True gives running totals instead
+        """
+        df = pd.DataFrame(self.records, columns=["step", "total"] + STEP_PHASES +
+                          ["active", "temp_exited", "permanently_exited", "adaptive_updates"])
+        if cumulative:
+            columns = ["total"] + STEP_PHASES + ["adaptive_updates"]
+            df[columns] = df[columns].cumsum()
+        return df
+
+    def summary(self):
+        """
+        Total and share of step time per phase over the whole run
+        """
+        df = self.get_dataframe()
+        totals = df[STEP_PHASES].sum()
+        other = df["total"].sum() - totals.sum()
+        totals["other"] = other
+        return pd.DataFrame({"seconds": totals, "share": totals / df["total"].sum()})
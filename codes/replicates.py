@@ -0,0 +1,179 @@
+import copy
+import numpy as np
+import pandas as pd
+from agent import IDENTITY_GROUPS, AGENT_STATUSES, ACTIVE, TEMP_EXITED, PERM_EXITED
+from engine import PopulationKernels
+from model import LGBTQBarModel, result_prefix
+
+QW = IDENTITY_GROUPS.index("QW")
+
+
+# Steps R replicates of LGBTQBarModel (same parameters, different seeds)
+# together: agent state is held as (R, N) arrays, bar state as (R, K, 3)
+# arrays, and every step is one set of array operations over all of them.
+#
+# Each replicate starts from the state of LGBTQBarModel(seed=seed, **params)
+# and draws from that model's generator in the same order as NumpyEngine,
+# so replicate r reproduces the numpy-engine run with seeds[r] exactly; the
+# choice and scoring kernels are NumpyEngine's.
+class ReplicateEngine(PopulationKernels):
+    def __init__(self, seeds, collect=True, **params):
+        self.seeds = list(seeds)
+        self.params = params
+        self.num_replicates = len(self.seeds)
+        self.steps = 0
+
+        # Build each replicate's initial state with the model itself, keeping
+        # only its arrays and its generator
+        agent_arrays = {name: [] for name in ["group", "threshold", "cooldown", "belonging"]}
+        self.rngs = []
+        for seed in self.seeds:
+            model = LGBTQBarModel(seed=seed, **dict(params, engine="numpy"))
+            for name in agent_arrays:
+                agent_arrays[name].append(getattr(model.numpy_engine, name))
+            self.rngs.append(copy.deepcopy(model.rng))
+        self.alpha = model.alpha
+        self.update_mode = model.update_mode
+        self.gamma = model.gamma
+        self.interval = model.bars[0].adaptive_update_interval
+        self.reporter_prefixes = [bar.reporter_prefix for bar in model.bars]
+        self.result_prefixes = [result_prefix(bar.name) for bar in model.bars]
+        self.reporter_dtypes = model.reporter_dtypes()
+
+        R = self.num_replicates
+        self.num_agents = len(agent_arrays["group"][0])
+        self.num_bars = len(model.bars)
+        self.group = np.stack(agent_arrays["group"])
+        self.threshold = np.stack(agent_arrays["threshold"])
+        self.cooldown = np.stack(agent_arrays["cooldown"])
+        self.belonging = np.stack(agent_arrays["belonging"])
+
+        # Dynamic agent state (NaN marks a bar with no score yet)
+        shape = (R, self.num_agents)
+        self.status = np.full(shape, ACTIVE, dtype=np.int64)
+        self.exit_counter = np.zeros(shape, dtype=np.int64)
+        self.exit_attempts = np.zeros(shape, dtype=np.int64)
+        self.current_bar = np.full(shape, -1, dtype=np.int64)
+        self.last_scores = np.full(shape + (self.num_bars,), np.nan)
+
+        # Bar state: affinities, this round's counts and the ring buffer of
+        # the last `interval` rounds with its rolling sum
+        n_groups = len(IDENTITY_GROUPS)
+        self.fixed = model.fixed_affinities.copy()
+        self.adaptive = np.repeat(model.adaptive_affinities[None], R, axis=0)
+        self.effective = np.repeat(model.effective_affinities[None], R, axis=0)
+        self.counts = np.zeros((R, self.num_bars, n_groups), dtype=np.int64)
+        self.count_history = np.zeros((self.interval, R, self.num_bars, n_groups), dtype=np.int64)
+        self.window_counts = np.zeros((R, self.num_bars, n_groups), dtype=np.int64)
+        self.history_position = 0
+        self.rounds_recorded = 0
+        self.update_count = 0
+
+        # Per-step reporters, one (R,) array per column and step
+        self.collect = collect
+        self.history = {name: [] for name in self.reporter_dtypes} if collect else None
+
+    def draw_uniforms(self, rows):
+        # Each replicate draws its rows' uniforms from its own generator
+        counts = np.bincount(rows // self.num_agents, minlength=self.num_replicates)
+        return np.concatenate([rng.random(count) for rng, count in zip(self.rngs, counts)])
+
+    def draw_integers(self, rows, high):
+        counts = np.bincount(rows // self.num_agents, minlength=self.num_replicates)
+        return np.concatenate([rng.integers(0, high, count) for rng, count in zip(self.rngs, counts)])
+
+    def effective_affinities(self):
+        return self.effective
+
+    def end_round(self):
+        # Record the round in the ring buffer and, every interval rounds,
+        # set the adaptive affinity to the window's average group ratios
+        oldest = self.count_history[self.history_position]
+        self.window_counts += self.counts - oldest
+        self.count_history[self.history_position] = self.counts
+        self.history_position = (self.history_position + 1) % self.interval
+        self.rounds_recorded += 1
+
+        self.update_count += 1
+        if self.update_count >= self.interval:
+            if self.rounds_recorded > 0:
+                total = self.window_counts.sum(axis=2, keepdims=True)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    self.adaptive[:] = np.where(total > 0, self.window_counts / total, 0.0)
+                self.effective[:] = self.gamma * self.fixed + (1 - self.gamma) * self.adaptive
+            self.update_count = 0
+
+    def step(self):
+        self.steps += 1
+        self.advance_cooldowns(np.flatnonzero(self.status.ravel() == TEMP_EXITED))
+        entered, bars, _ = self.choose_bars(self.steps, np.flatnonzero(self.status.ravel() == ACTIVE))
+        self.current_bar.ravel()[entered] = bars
+        if self.update_mode == "synchronous":
+            self.counts[:] = self.update_belonging_synchronous(entered, bars)
+        else:
+            self.counts[:] = self.update_belonging(entered, bars)
+        self.end_round()
+        if self.collect:
+            for name, values in self.compute_metrics().items():
+                self.history[name].append(values)
+
+    def status_counts(self):
+        # (R, statuses, groups) number of agents
+        n_groups = len(IDENTITY_GROUPS)
+        n_statuses = len(AGENT_STATUSES)
+        replicate = np.arange(self.num_replicates)[:, None]
+        codes = (replicate * n_statuses + self.status) * n_groups + self.group
+        counts = np.bincount(codes.ravel(), minlength=self.num_replicates * n_statuses * n_groups)
+        return counts.reshape(self.num_replicates, n_statuses, n_groups)
+
+    def compute_metrics(self):
+        """
+        The model's reporters for the current step, one (R,) array each
+        """
+        metrics = {}
+        population = self.counts.sum(axis=2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratios = np.where(population[..., None] > 0, self.counts / population[..., None], 0.0)
+        for bar_id, prefix in enumerate(self.reporter_prefixes):
+            for i, group in enumerate(IDENTITY_GROUPS):
+                metrics[f"{prefix}_{group}_Ratio"] = ratios[:, bar_id, i]
+            metrics[f"{prefix}_Population"] = population[:, bar_id]
+            for i, group in enumerate(IDENTITY_GROUPS):
+                metrics[f"{prefix}_{group}_AdaptiveAffinity"] = self.adaptive[:, bar_id, i].copy()
+            metrics[f"{prefix}_QW_EffectiveAffinity"] = self.effective[:, bar_id, QW].copy()
+        status_counts = self.status_counts()
+        metrics["TempExited_Agents"] = status_counts[:, TEMP_EXITED].sum(axis=1)
+        metrics["PermExited_Agents"] = status_counts[:, PERM_EXITED].sum(axis=1)
+        for i, group in enumerate(IDENTITY_GROUPS):
+            metrics[f"Active_{group}"] = status_counts[:, ACTIVE, i]
+        return metrics
+
+    def get_model_vars_dataframe(self, replicate):
+        """
+        Collected reporters of one replicate, as the model's datacollector gives them
+        """
+        return pd.DataFrame({name: np.array([values[replicate] for values in self.history[name]],
+                                            dtype=self.reporter_dtypes[name])
+                             for name in self.reporter_dtypes})
+
+    def get_final_results(self, run_ids=None):
+        """
+        One batch_run result row per replicate for the current state
+        """
+        run_ids = range(self.num_replicates) if run_ids is None else run_ids
+        population = self.counts.sum(axis=2)
+        rows = []
+        for replicate, run_id in enumerate(run_ids):
+            row = {'gamma': self.params.get('gamma', self.gamma), 'run_id': run_id}
+            for bar_id, name in enumerate(self.result_prefixes):
+                qw_ratio = 0.0
+                if population[replicate, bar_id] > 0:
+                    qw_ratio = self.counts[replicate, bar_id, QW] / population[replicate, bar_id]
+                row[f'{name}_qw_effective_affinity'] = float(self.effective[replicate, bar_id, QW])
+                row[f'{name}_qw_ratio'] = float(qw_ratio)
+            row['stop_step'] = self.steps
+            row['stop_reason'] = "max_steps"
+            row['update_mode'] = self.update_mode
+            row['engine'] = "numpy"
+            rows.append(row)
+        return rows
@@ -0,0 +1,38 @@
+import hashlib
+import random
+import numpy as np
+
+
+def seed_entropy(seed):
+    """
+    Turn a model seed into the non-negative integer entropy that
+    numpy's SeedSequence expects
+    """
+    if isinstance(seed, (int, np.integer)) and seed >= 0:
+        return int(seed)
+    digest = hashlib.sha256(repr(seed).encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def derive_seed(root_seed, *key):
+    """
+    Derive an independent 64-bit seed from a root seed and an integer key
+    path, e.g. derive_seed(root, job_id) or derive_seed(root, 1, agent_id)
+    """
+    sequence = np.random.SeedSequence(seed_entropy(root_seed), spawn_key=tuple(int(k) for k in key))
+    low, high = sequence.generate_state(2, dtype=np.uint32)
+    return int(low) | (int(high) << 32)
+
+
+def derive_seeds(root_seed, n):
+    """
+    Derive n independent seeds from one root seed, e.g. one per batch job
+    """
+    return [derive_seed(root_seed, i) for i in range(n)]
+
+
+def substream(root_seed, *key):
+    """
+    Independent random.Random generator for the given key path
+    """
+    return random.Random(derive_seed(root_seed, *key))
@@ -0,0 +1,144 @@
+import json
+import os
+import time
+import uuid
+import pandas as pd
+
+# pyarrow is only needed when results are streamed to disk
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# File extension of each supported format
+SINK_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# Per-table file with the partition column types; hive directory names
+# alone would read back as strings. The "_" prefix hides it from pyarrow
+PARTITIONING_FILE = "_partitioning.json"
+
+
+def partition_dir(root, table, partition_by, row):
+    # Hive-style directory of a row, e.g. <root>/final/gamma=0.3
+    parts = [f"{name}={row[name]}" for name in partition_by]
+    return os.path.join(root, table, *parts)
+
+
+# Appends batch results to columnar files as runs finish. A table is
+# written out once it buffers chunk_rows rows, which bounds memory for the
+# large timeseries table, or when it was last written flush_seconds ago,
+# so a crash only loses the runs finished in the last flush_seconds even
+# for small tables such as "final" (one row per run)
+class ResultSink:
+    def __init__(self, root, partition_by=("gamma",), chunk_rows=50000, flush_seconds=10.0, format="parquet"):
+        """
+        Tables are written under root/<table>/<name>=<value>/..., one
+        directory level per parameter in partition_by. flush_seconds=0
+        writes every appended batch of rows immediately
+        """
+        if pa is None:
+            raise ImportError("ResultSink needs pyarrow (pip install pyarrow)")
+        if format not in SINK_FORMATS:
+            raise ValueError(f"Unknown sink format '{format}', expected one of {list(SINK_FORMATS)}")
+        self.root = root
+        self.partition_by = list(partition_by)
+        self.chunk_rows = chunk_rows
+        self.flush_seconds = flush_seconds
+        self.format = format
+        # Unique file prefix, so repeated sweeps into one root never collide
+        self.sink_id = uuid.uuid4().hex[:12]
+        self.files_written = 0
+        self.buffers = {}
+        self.buffered_rows = {}
+        # time.monotonic() of each table's last write
+        self.created = time.monotonic()
+        self.last_flush = {}
+        self.tables_described = set()
+
+    def append(self, table, columns):
+        """
+        Buffer rows for a table, given as a dict of equal-length columns
+        (lists or arrays) or of scalars for a single row
+        """
+        frame = pd.DataFrame(columns) if self.is_columnar(columns) else pd.DataFrame([columns])
+        self.buffers.setdefault(table, []).append(frame)
+        self.buffered_rows[table] = self.buffered_rows.get(table, 0) + len(frame)
+        if (self.buffered_rows[table] >= self.chunk_rows
+                or time.monotonic() - self.last_flush.get(table, self.created) >= self.flush_seconds):
+            self.flush(table)
+
+    @staticmethod
+    def is_columnar(columns):
+        return any(hasattr(values, "__len__") and not isinstance(values, str) for values in columns.values())
+
+    def flush(self, table=None):
+        """
+        Write buffered rows (of one table, or of all tables) to one file per partition
+        """
+        tables = list(self.buffers) if table is None else [table]
+        for table in tables:
+            frames = self.buffers.pop(table, [])
+            self.buffered_rows.pop(table, None)
+            self.last_flush[table] = time.monotonic()
+            if not frames:
+                continue
+            data = pd.concat(frames, ignore_index=True)
+            if table not in self.tables_described:
+                self.describe_partitioning(table, data)
+            if self.partition_by:
+                groups = data.groupby(self.partition_by, sort=False)
+            else:
+                groups = [((), data)]
+            for _, part in groups:
+                directory = partition_dir(self.root, table, self.partition_by, part.iloc[0])
+                self.write_file(directory, part.drop(columns=self.partition_by))
+
+    def describe_partitioning(self, table, data):
+        types = pa.Schema.from_pandas(data[self.partition_by], preserve_index=False)
+        os.makedirs(os.path.join(self.root, table), exist_ok=True)
+        with open(os.path.join(self.root, table, PARTITIONING_FILE), "w") as f:
+            json.dump({name: str(types.field(name).type) for name in self.partition_by}, f)
+        self.tables_described.add(table)
+
+    def write_file(self, directory, frame):
+        os.makedirs(directory, exist_ok=True)
+        name = f"part-{self.sink_id}-{self.files_written:05d}{SINK_FORMATS[self.format]}"
+        path = os.path.join(directory, name)
+        arrow_table = pa.Table.from_pandas(frame, preserve_index=False)
+        # Write under a hidden name first so readers never see half a file
+        temporary_path = os.path.join(directory, "." + name)
+        if self.format == "parquet":
+            pq.write_table(arrow_table, temporary_path)
+        else:
+            feather.write_feather(arrow_table, temporary_path, compression="uncompressed")
+        os.replace(temporary_path, path)
+        self.files_written += 1
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_results(root, table="final", format="parquet", filter=None):
+    """
+    Load a table written by ResultSink as a DataFrame, with the partition
+    parameters as columns. filter is an optional pyarrow.dataset expression,
+    e.g. ds.field("gamma") == 0.5, so only matching partitions are read
+    """
+    if pa is None:
+        raise ImportError("read_results needs pyarrow (pip install pyarrow)")
+    table_dir = os.path.join(root, table)
+    with open(os.path.join(table_dir, PARTITIONING_FILE)) as f:
+        types = json.load(f)
+    schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in types.items()])
+    dataset = ds.dataset(table_dir, format="feather" if format == "arrow" else format,
+                         partitioning=ds.partitioning(schema, flavor="hive"))
+    return dataset.to_table(filter=filter).to_pandas()
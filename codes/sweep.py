@@ -0,0 +1,271 @@
+import argparse
+import itertools
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from batch_run import run_jobs
+from cache import ResultCache, DEFAULT_MAX_BYTES
+from seeding import derive_seeds
+from sink import ResultSink
+
+# scipy is only needed for the Latin hypercube and Sobol designs
+try:
+    from scipy.stats import qmc
+except ImportError:
+    qmc = None
+
+# Default location of the sweep results (repository root)
+DEFAULT_OUTPUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sweep_results.csv")
+
+# Swept parameters and their (low, high) ranges
+SWEEP_SPACE = {
+    "alpha": (0.0, 1.0),
+    "gamma": (0.0, 1.0),
+    "QW_ratio": (0.0, 1.0),
+    "QNW_ratio": (0.0, 1.0),
+    "adaptive_update_interval": (1, 30),
+    "population_size": (100, 1000),
+}
+
+# Parameters rounded to integers after scaling
+INTEGER_PARAMS = ["adaptive_update_interval", "population_size"]
+
+DESIGN_METHODS = ["grid", "lhs", "sobol"]
+
+# Default --points of each design; for grid it is levels per parameter
+DEFAULT_POINTS = {"grid": 3, "lhs": 64, "sobol": 64}
+
+# Largest grid design make_design builds
+MAX_GRID_POINTS = 10 ** 6
+
+
+def scale_points(unit_points, space):
+    """
+    Map points of the unit cube to parameter values, one column per parameter
+    """
+    points = pd.DataFrame(np.asarray(unit_points).reshape(-1, len(space)), columns=list(space))
+    for name, (low, high) in space.items():
+        points[name] = low + points[name] * (high - low)
+        if name in INTEGER_PARAMS:
+            points[name] = points[name].round().astype(int)
+    return points
+
+
+def unit_points(points, space):
+    # Inverse of scale_points, used to measure distances between points
+    return np.column_stack([(points[name] - low) / (high - low) if high > low else 0.0 * points[name]
+                            for name, (low, high) in space.items()])
+
+
+def reject_invalid(points):
+    """
+    Drop points whose identity ratios leave no room for NQW agents (QW + QNW > 1)
+    """
+    if "QW_ratio" in points and "QNW_ratio" in points:
+        points = points[points["QW_ratio"] + points["QNW_ratio"] <= 1.0]
+    return points.reset_index(drop=True)
+
+
+def make_design(method, num_points, space=None, seed=None):
+    """
+    Valid design points (see reject_invalid) for grid, lhs or sobol.
+
+    grid takes num_points levels per parameter, up to MAX_GRID_POINTS
+    points in all. lhs and sobol return at least num_points valid points,
+    keeping every valid draw so that rejection thins rather than distorts
+    the design: lhs redraws one whole, larger Latin hypercube until enough
+    of it is valid, and sobol doubles its draws, so the points used are
+    always a balanced power-of-two prefix of the sequence
+    """
+    space = SWEEP_SPACE if space is None else space
+    if method not in DESIGN_METHODS:
+        raise ValueError(f"Unknown design '{method}', expected one of {DESIGN_METHODS}")
+    if method == "grid":
+        if num_points ** len(space) > MAX_GRID_POINTS:
+            raise ValueError(f"A grid of {num_points} levels over {len(space)} parameters has "
+                             f"{num_points ** len(space)} points (at most {MAX_GRID_POINTS})")
+        levels = np.linspace(0.0, 1.0, num_points) if num_points > 1 else np.array([0.5])
+        points = scale_points(list(itertools.product(levels, repeat=len(space))), space)
+        return reject_invalid(points.drop_duplicates())
+
+    if qmc is None:
+        raise ImportError(f"The {method} design needs scipy (pip install scipy)")
+    if method == "lhs":
+        sampler = qmc.LatinHypercube(d=len(space), seed=seed)
+        num_draws = num_points
+        points = reject_invalid(scale_points(sampler.random(num_draws), space))
+        while len(points) < num_points:
+            # Size the next hypercube from the valid fraction seen so far
+            num_draws = max(num_draws + 1, math.ceil(num_draws * num_points / max(len(points), 1)))
+            points = reject_invalid(scale_points(sampler.random(num_draws), space))
+        return points
+
+    sampler = qmc.Sobol(d=len(space), scramble=True, seed=seed)
+    unit = sampler.random_base2(max(math.ceil(math.log2(num_points)), 1))
+    points = reject_invalid(scale_points(unit, space))
+    while len(points) < num_points:
+        # Drawing as many points again keeps a power-of-two prefix
+        unit = np.vstack([unit, sampler.random(len(unit))])
+        points = reject_invalid(scale_points(unit, space))
+    return points
+
+
+def refine_points(points, responses, num_new, space=None, boundary_level=None, neighbors=4):
+    """
+    New points halfway between neighbouring points whose responses differ
+    most, i.e. across regime boundaries. With boundary_level, only pairs
+    on opposite sides of that level count (e.g. where the women bar's QW
+    ratio collapses below it). Midpoints of valid points are valid, since
+    QW + QNW <= 1 is convex
+    """
+    space = SWEEP_SPACE if space is None else space
+    unit = unit_points(points, space)
+    responses = np.asarray(responses, dtype=float)
+    distances = np.sqrt(((unit[:, None, :] - unit[None, :, :]) ** 2).sum(axis=2))
+    np.fill_diagonal(distances, np.inf)
+
+    pairs = set()
+    for i in range(len(unit)):
+        for j in np.argsort(distances[i])[:neighbors]:
+            pairs.add((min(i, j), max(i, j)))
+    scored = []
+    for i, j in pairs:
+        if np.isnan(responses[i]) or np.isnan(responses[j]):
+            continue
+        if boundary_level is not None and (responses[i] - boundary_level) * (responses[j] - boundary_level) >= 0:
+            continue
+        scored.append((abs(responses[i] - responses[j]), i, j))
+    scored.sort(reverse=True)
+
+    midpoints = [(unit[i] + unit[j]) / 2 for _, i, j in scored[:num_new]]
+    if not midpoints:
+        return points.iloc[:0].copy()
+    new_points = scale_points(midpoints, space).drop_duplicates()
+    # Skip points already run (integer rounding can map a midpoint onto one)
+    existing = set(map(tuple, points[list(space)].to_numpy().tolist()))
+    keep = [tuple(row) not in existing for row in new_points.to_numpy().tolist()]
+    return new_points[keep].reset_index(drop=True)
+
+
+def point_params(row, fixed_params=None, space=None):
+    """
+    Model parameters of one design point: the fixed parameters updated with
+    the point's swept values, integer parameters rounded
+    """
+    space = SWEEP_SPACE if space is None else space
+    params = dict(fixed_params or {}, **{name: row[name] for name in space if name in row})
+    return {name: int(value) if name in INTEGER_PARAMS else value for name, value in params.items()}
+
+
+def run_sweep(design, num_runs=5, num_steps=100, fixed_params=None, batch_size=64,
+              max_workers=1, chunksize=1, root_seed=None, convergence=None,
+              cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES, sink_path=None, sink_format="parquet",
+              response="women_bar_qw_ratio", refine_rounds=0, refine_size=16, boundary_level=None,
+              space=None):
+    """
+    Run num_runs replicates of every design point, batch_size points at a
+    time, then refine_rounds rounds of refine_size new points placed by
+    refine_points on the mean response.
+
+    Returns (points, runs): one row per point with its parameters, round
+    and mean response, and one row per run (None when runs are streamed
+    to sink_path, table "sweep" partitioned by round)
+    """
+    space = SWEEP_SPACE if space is None else space
+    fixed_params = {} if fixed_params is None else fixed_params
+    # Points share replicate seeds (common random numbers), as in batch_run
+    seeds = list(range(num_runs)) if root_seed is None else derive_seeds(root_seed, num_runs)
+    cache = None if cache_dir is None else ResultCache(cache_dir, cache_max_bytes)
+    sink = None if sink_path is None else ResultSink(sink_path, partition_by=("round",), format=sink_format)
+    # One pool for the whole sweep, so batches do not restart the workers
+    executor = None if max_workers == 1 else ProcessPoolExecutor(max_workers=max_workers)
+
+    all_points = []
+    runs = []
+    start_time = time.time()
+    try:
+        points = reject_invalid(design.copy())
+        for round_id in range(refine_rounds + 1):
+            if len(points) == 0:
+                break
+            first_id = sum(len(done) for done in all_points)
+            points.insert(0, "point_id", range(first_id, first_id + len(points)))
+            points["round"] = round_id
+            means = []
+            for batch_start in range(0, len(points), batch_size):
+                batch = points.iloc[batch_start:batch_start + batch_size]
+                jobs = []
+                for row in batch.to_dict("records"):
+                    params = point_params(row, fixed_params, space)
+                    jobs += [(params, run_id, seeds[run_id], num_steps, False, convergence)
+                             for run_id in range(num_runs)]
+
+                batch_rows = []
+                for job, final_data, _, _ in run_jobs(jobs, max_workers, chunksize, cache, executor):
+                    batch_rows.append(dict(job[0], **final_data))
+                batch_runs = pd.DataFrame(batch_rows)
+                batch_runs.insert(0, "point_id", np.repeat(batch["point_id"].to_numpy(), num_runs))
+                batch_runs["round"] = round_id
+                means.extend(batch_runs.groupby("point_id", sort=False)[response].mean())
+                if sink is None:
+                    runs.append(batch_runs)
+                else:
+                    sink.append("sweep", {column: batch_runs[column].to_numpy() for column in batch_runs})
+                print(f"  round {round_id}: {min(batch_start + batch_size, len(points))}/{len(points)} points "
+                      f"({time.time() - start_time:.1f}s)")
+
+            points[response] = means
+            all_points.append(points)
+            if round_id < refine_rounds:
+                done = pd.concat(all_points, ignore_index=True)
+                points = refine_points(done, done[response], refine_size, space, boundary_level)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if sink is not None:
+            sink.close()
+
+    points = pd.concat(all_points, ignore_index=True)
+    return points, (None if sink is not None else pd.concat(runs, ignore_index=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep LGBTQBarModel parameters with a space-filling design")
+    parser.add_argument("--method", choices=DESIGN_METHODS, default="lhs")
+    parser.add_argument("--points", type=int, default=None,
+                        help="design points (levels per parameter for grid); default "
+                             + ", ".join(f"{method} {points}" for method, points in DEFAULT_POINTS.items()))
+    parser.add_argument("--runs", type=int, default=5, help="replicates per point")
+    parser.add_argument("--steps", type=int, default=100, help="steps per run (upper bound with --converge)")
+    parser.add_argument("--batch-size", type=int, default=64, help="points scheduled at a time")
+    parser.add_argument("--refine-rounds", type=int, default=0, help="rounds of adaptive refinement")
+    parser.add_argument("--refine-size", type=int, default=16, help="new points per refinement round")
+    parser.add_argument("--boundary", type=float, default=None,
+                        help="refine across this level of the response (e.g. 0.25 for a QW collapse)")
+    parser.add_argument("--response", default="women_bar_qw_ratio", help="result column driving refinement")
+    parser.add_argument("--converge", action="store_true", help="stop each run once it has converged")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=1, help="jobs sent to a worker at a time")
+    parser.add_argument("--root-seed", type=int, default=None, help="derive run seeds and the design from this seed")
+    parser.add_argument("--cache", default=None, help="reuse outputs of identical runs cached in this directory")
+    parser.add_argument("--sink", default=None, help="stream run results to partitioned files under this directory")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="path of the per-run results CSV")
+    args = parser.parse_args()
+
+    num_points = DEFAULT_POINTS[args.method] if args.points is None else args.points
+    design = make_design(args.method, num_points, seed=args.root_seed)
+    print(f"{args.method} design with {len(design)} valid points, {args.runs} runs each")
+    points, runs = run_sweep(design, num_runs=args.runs, num_steps=args.steps, batch_size=args.batch_size,
+                             max_workers=args.workers, chunksize=args.chunksize, root_seed=args.root_seed,
+                             convergence={"tolerance": 0.01, "patience": 3} if args.converge else None,
+                             cache_dir=args.cache, sink_path=args.sink, response=args.response,
+                             refine_rounds=args.refine_rounds, refine_size=args.refine_size,
+                             boundary_level=args.boundary)
+    if runs is not None:
+        runs.to_csv(args.output, index=False)
+        print(f"\nResults saved to '{args.output}'")
+    print(f"\n{len(points)} points in {points['round'].nunique()} round(s)")
+    print(points.groupby("round")[args.response].describe())
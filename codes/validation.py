@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+from aggregate import AggregateBarModel
+from model import LGBTQBarModel
+
+# Reporters compared between engines at the final step
+COMPARED_REPORTERS = [
+    "WomenBar_QW_Ratio",
+    "WomenBar_Population",
+    "WomenBar_QW_EffectiveAffinity",
+    "QueerBar_QW_Ratio",
+    "QueerBar_Population",
+    "QueerBar_QW_EffectiveAffinity",
+    "TempExited_Agents",
+    "PermExited_Agents",
+]
+
+
+def run_final_reporters(engine, seed, num_steps, **params):
+    """
+    Run one model and return its final-step reporter values
+    """
+    model = LGBTQBarModel(engine=engine, seed=seed, **params)
+    for step in range(num_steps):
+        model.step()
+    return model.datacollector.get_model_vars_dataframe().iloc[-1]
+
+
+def check_reproducibility(seed=0, num_steps=100, **params):
+    """
+    Check that runs with the same seed give identical DataCollector frames,
+    both for repeated runs and for two models stepped in lockstep in one process
+    """
+    def run(model):
+        for step in range(num_steps):
+            model.step()
+        return model.datacollector.get_model_vars_dataframe()
+    
+    for engine in ("object", "numpy"):
+        first = run(LGBTQBarModel(engine=engine, seed=seed, **params))
+        second = run(LGBTQBarModel(engine=engine, seed=seed, **params))
+        if not first.equals(second):
+            return False
+        
+        # Interleaved models must not share random state
+        a = LGBTQBarModel(engine=engine, seed=seed, **params)
+        b = LGBTQBarModel(engine=engine, seed=seed + 1, **params)
+        for step in range(num_steps):
+            a.step()
+            b.step()
+        if not a.datacollector.get_model_vars_dataframe().equals(first):
+            return False
+    return True
+
+
+def compare_engines(num_runs=30, num_steps=100, z_tolerance=4.0, **params):
+    """
+    Check that the numpy engine is statistically equivalent to the object
+    engine: for each reporter, the difference of the final-step means over
+    num_runs seeds must stay within z_tolerance standard errors
+    """
+    finals = {
+        engine: pd.DataFrame([run_final_reporters(engine, seed, num_steps, **params)
+                              for seed in range(num_runs)])
+        for engine in ("object", "numpy")
+    }
+    return compare_finals(finals, "object", "numpy", z_tolerance)
+
+
+def compare_update_modes(num_runs=30, num_steps=100, engine="numpy", z_tolerance=4.0, **params):
+    """
+    Compare the synchronous update mode with the sequential one over the
+    same seeds. The modes are different models, so large z values show
+    where the synchronous approximation shifts the results
+    """
+    finals = {
+        mode: pd.DataFrame([run_final_reporters(engine, seed, num_steps, update_mode=mode, **params)
+                            for seed in range(num_runs)])
+        for mode in ("sequential", "synchronous")
+    }
+    return compare_finals(finals, "sequential", "synchronous", z_tolerance)
+
+
+def compare_finals(finals, first, second, z_tolerance):
+    """
+    Per-reporter Welch z statistic of the difference of final-step means
+    between finals[first] and finals[second]
+    """
+    rows = []
+    for reporter in COMPARED_REPORTERS:
+        a = finals[first][reporter]
+        b = finals[second][reporter]
+        std_err = np.sqrt(a.var(ddof=1) / len(a) + b.var(ddof=1) / len(b))
+        diff = b.mean() - a.mean()
+        z = diff / std_err if std_err > 0 else 0.0
+        rows.append({
+            "reporter": reporter,
+            f"{first}_mean": a.mean(),
+            f"{second}_mean": b.mean(),
+            "z": z,
+            "ok": abs(z) <= z_tolerance,
+        })
+    return pd.DataFrame(rows)
+
+
+def compare_aggregate(num_runs=30, num_steps=100, population_size=2000, z_tolerance=2.0,
+                      engine="numpy", aggregate_params=None, **params):
+    """
+    Compare the mean-field AggregateBarModel with agent runs of the same
+    parameters at a moderate population. The aggregate gives one expected
+    path, so its final value is compared with the spread of the agent runs:
+    z is its distance from their mean in standard deviations across runs.
+    Where the agent model has several outcomes (e.g. QW agents settling in
+    either bar), the mean is not a single run's path and z is large
+    """
+    agent_finals = pd.DataFrame([run_final_reporters(engine, seed, num_steps, population_size=population_size,
+                                                     **params)
+                                 for seed in range(num_runs)])
+    model = AggregateBarModel(population_size=population_size, **params, **(aggregate_params or {}))
+    for step in range(num_steps):
+        model.step()
+    aggregate_final = model.datacollector.get_model_vars_dataframe().iloc[-1]
+
+    rows = []
+    for reporter in COMPARED_REPORTERS:
+        a = agent_finals[reporter]
+        diff = aggregate_final[reporter] - a.mean()
+        std = a.std(ddof=1)
+        z = diff / std if std > 0 else (0.0 if abs(diff) < 1e-9 else np.inf)
+        rows.append({
+            "reporter": reporter,
+            "agent_mean": a.mean(),
+            "agent_std": std,
+            "aggregate": aggregate_final[reporter],
+            "z": z,
+            "ok": abs(z) <= z_tolerance,
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    if not check_reproducibility():
+        raise SystemExit("Runs with the same seed differ")
+    print("Runs with the same seed are identical")
+    
+    for gamma in [0.3, 0.5, 0.7]:
+        print(f"\nGamma = {gamma}")
+        result = compare_engines(gamma=gamma, QW_ratio=0.5, QNW_ratio=0.25)
+        print(result.to_string(index=False))
+        if not result["ok"].all():
+            raise SystemExit("Engines disagree")
+        
+        # Both engines must also agree in the synchronous mode
+        result = compare_engines(gamma=gamma, QW_ratio=0.5, QNW_ratio=0.25, update_mode="synchronous")
+        if not result["ok"].all():
+            print(result.to_string(index=False))
+            raise SystemExit("Engines disagree in the synchronous mode")
+        
+        # Informational: how far the synchronous mode is from the sequential one
+        print(f"\nSynchronous vs sequential, gamma = {gamma}")
+        print(compare_update_modes(gamma=gamma, QW_ratio=0.5, QNW_ratio=0.25).to_string(index=False))
+        
+        # The mean-field aggregate engine must stay within the spread of agent runs
+        print(f"\nAggregate vs agent runs, gamma = {gamma}")
+        result = compare_aggregate(gamma=gamma, QW_ratio=0.5, QNW_ratio=0.25)
+        print(result.to_string(index=False))
+        if not result["ok"].all():
+            raise SystemExit("The aggregate engine disagrees with the agent runs")
@@ -0,0 +1,11 @@
+import pytest
+from aggregate import AggregateBarModel, MAX_BARS
+
+
+def test_bar_limit():
+    model = AggregateBarModel(population_size=10**6, num_bars=MAX_BARS)
+    model.step()
+    with pytest.raises(ValueError):
+        AggregateBarModel(num_bars=MAX_BARS + 1)
+    with pytest.raises(ValueError):
+        AggregateBarModel(bar_affinities=[[0.5, 0.3, 0.2]] * (MAX_BARS + 1))
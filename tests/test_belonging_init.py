@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from agent import IDENTITY_GROUPS
+from model import LGBTQBarModel
+
+
+def test_per_agent_rows_match_unique_id_generator():
+    # "per_agent" must give the values of the original RandomState(unique_id) path
+    model = LGBTQBarModel(population_size=50, belonging_init="per_agent", seed=3)
+    for agent in model.agents:
+        matrix = agent.generate_belonging_matrix()
+        expected = [matrix[agent.identity_group][group] for group in IDENTITY_GROUPS]
+        assert list(agent.belonging_row) == expected
+
+
+def test_batched_rows_are_clipped_and_seeded():
+    rows = [list(agent.belonging_row) for agent in LGBTQBarModel(population_size=50, seed=3).agents]
+    assert np.all((np.array(rows) >= 0.0) & (np.array(rows) <= 1.0))
+    assert rows == [list(agent.belonging_row) for agent in LGBTQBarModel(population_size=50, seed=3).agents]
+
+
+@pytest.mark.parametrize("engine", ["object", "numpy"])
+def test_empty_population_steps(engine):
+    model = LGBTQBarModel(population_size=0, engine=engine, seed=1)
+    for step in range(15):
+        model.step()
+    assert len(model.datacollector.get_model_vars_dataframe()) == 15
@@ -0,0 +1,72 @@
+import pytest
+from metrics import MetricsFile
+from model import LGBTQBarModel
+
+PARAMS = {"population_size": 150, "QW_ratio": 0.5, "QNW_ratio": 0.25}
+
+
+def run(model, num_steps):
+    for step in range(num_steps):
+        model.step()
+    return model
+
+
+@pytest.mark.parametrize("update_mode", ["sequential", "synchronous"])
+@pytest.mark.parametrize("collector", ["numpy", "mesa"])
+@pytest.mark.parametrize("engine", ["object", "numpy"])
+def test_resumed_run_matches_uninterrupted(tmp_path, engine, collector, update_mode):
+    params = dict(PARAMS, engine=engine, collector=collector, update_mode=update_mode, seed=5)
+    uninterrupted = run(LGBTQBarModel(**params), 100)
+
+    model = run(LGBTQBarModel(**params), 50)
+    model.save_checkpoint(tmp_path / "checkpoint.npz")
+    restored = run(LGBTQBarModel.from_checkpoint(tmp_path / "checkpoint.npz"), 50)
+    assert restored.steps == uninterrupted.steps
+    assert restored.datacollector.get_model_vars_dataframe().equals(
+        uninterrupted.datacollector.get_model_vars_dataframe())
+
+
+@pytest.mark.parametrize("engine", ["object", "numpy"])
+def test_memmap_run_restored_to_new_file(tmp_path, engine):
+    uninterrupted = run(LGBTQBarModel(**PARAMS, engine=engine, seed=5), 100)
+
+    model = run(LGBTQBarModel(**PARAMS, engine=engine, collector="memmap",
+                              metrics_path=tmp_path / "source.metrics", seed=5), 50)
+    model.save_checkpoint(tmp_path / "checkpoint.npz")
+    model.datacollector.close()
+    restored = run(LGBTQBarModel.from_checkpoint(tmp_path / "checkpoint.npz",
+                                                 metrics_path=tmp_path / "restored.metrics"), 50)
+    restored.datacollector.flush()
+
+    expected = uninterrupted.datacollector.get_model_vars_dataframe()
+    assert MetricsFile(tmp_path / "restored.metrics").get_model_vars_dataframe().equals(expected)
+    # The source run's file is left as it was
+    assert MetricsFile(tmp_path / "source.metrics").get_model_vars_dataframe().equals(expected.iloc[:50])
+
+
+def test_memmap_restore_needs_new_metrics_path(tmp_path):
+    model = run(LGBTQBarModel(**PARAMS, collector="memmap", metrics_path=tmp_path / "source.metrics", seed=5), 10)
+    model.save_checkpoint(tmp_path / "checkpoint.npz")
+    with pytest.raises(ValueError):
+        LGBTQBarModel.from_checkpoint(tmp_path / "checkpoint.npz")
+    with pytest.raises(ValueError):
+        LGBTQBarModel.from_checkpoint(tmp_path / "checkpoint.npz", metrics_path=tmp_path / "source.metrics")
+
+
+@pytest.mark.parametrize("engine", ["object", "numpy"])
+def test_gamma_fork_matches_gamma_change_in_place(tmp_path, engine):
+    # A fork continues like the parent run with gamma changed at the save step
+    reference = run(LGBTQBarModel(**PARAMS, engine=engine, seed=5), 50)
+    reference.save_checkpoint(tmp_path / "checkpoint.npz")
+    reference.gamma = 0.8
+    run(reference, 50)
+
+    fork = run(LGBTQBarModel.from_checkpoint(tmp_path / "checkpoint.npz", gamma=0.8), 50)
+    assert fork.gamma == 0.8
+    assert fork.datacollector.get_model_vars_dataframe().equals(reference.datacollector.get_model_vars_dataframe())
+
+
+def test_non_overridable_parameter_rejected(tmp_path):
+    run(LGBTQBarModel(**PARAMS, seed=5), 5).save_checkpoint(tmp_path / "checkpoint.npz")
+    with pytest.raises(ValueError, match="population_size"):
+        LGBTQBarModel.from_checkpoint(tmp_path / "checkpoint.npz", population_size=300)
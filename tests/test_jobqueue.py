@@ -0,0 +1,56 @@
+import multiprocessing
+import time
+import pandas as pd
+from batch_run import DEFAULT_FIXED_PARAMS, run_batch_experiment
+from jobqueue import claim_job, connect, grid_jobs, load_results, reclaim_stale, run_worker, submit_jobs
+
+FIXED_PARAMS = dict(DEFAULT_FIXED_PARAMS, population_size=60)
+
+
+def test_workers_run_each_job_once(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    jobs = grid_jobs((0.3, 0.7), num_runs=3, num_steps=20, fixed_params=FIXED_PARAMS)
+    assert submit_jobs(path, jobs) == len(jobs)
+    # Submitting the same grid again adds nothing
+    assert submit_jobs(path, jobs) == 0
+
+    workers = [multiprocessing.Process(target=run_worker, args=(path, f"worker-{index}"),
+                                       kwargs={"poll_interval": 0.1})
+               for index in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    connection = connect(path)
+    rows = connection.execute("SELECT status, attempts FROM jobs").fetchall()
+    connection.close()
+    assert rows == [("done", 1)] * len(jobs)
+
+    expected = run_batch_experiment((0.3, 0.7), num_runs=3, num_steps=20, fixed_params=FIXED_PARAMS,
+                                    output_path=None)
+    results = load_results(path)
+    pd.testing.assert_frame_equal(
+        results[expected.columns].sort_values(["gamma", "run_id"], ignore_index=True),
+        expected.sort_values(["gamma", "run_id"], ignore_index=True))
+
+
+def test_stale_jobs_are_reclaimed_then_failed(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    submit_jobs(path, grid_jobs((0.5,), num_runs=1, num_steps=5, fixed_params=FIXED_PARAMS))
+    connection = connect(path)
+
+    def status():
+        return connection.execute("SELECT status, attempts FROM jobs").fetchone()
+
+    # A worker that claims the job and then dies stops its heartbeat
+    assert claim_job(connection, "lost-worker") is not None
+    assert reclaim_stale(connection, stale_after=60.0, max_attempts=2) == 0
+    assert reclaim_stale(connection, stale_after=60.0, max_attempts=2, now=time.time() + 120) == 1
+    assert status() == ("pending", 1)
+
+    assert claim_job(connection, "lost-worker") is not None
+    assert reclaim_stale(connection, stale_after=60.0, max_attempts=2, now=time.time() + 120) == 1
+    assert status() == ("failed", 2)
+    connection.close()
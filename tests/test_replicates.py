@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+from batch_run import run_batch_experiment
+from model import LGBTQBarModel
+from replicates import ReplicateEngine
+
+PARAMS = {"population_size": 150, "QW_ratio": 0.5, "QNW_ratio": 0.25, "gamma": 0.5}
+SEEDS = [3, 7, 11]
+
+
+@pytest.mark.parametrize("update_mode", ["sequential", "synchronous"])
+def test_replicates_match_numpy_engine_runs(update_mode):
+    replicates = ReplicateEngine(SEEDS, update_mode=update_mode, **PARAMS)
+    for step in range(60):
+        replicates.step()
+
+    for replicate, seed in enumerate(SEEDS):
+        model = LGBTQBarModel(seed=seed, engine="numpy", update_mode=update_mode, **PARAMS)
+        for step in range(60):
+            model.step()
+        assert replicates.get_model_vars_dataframe(replicate).equals(model.datacollector.get_model_vars_dataframe())
+
+
+def test_replicate_batch_matches_numpy_engine_batch():
+    fixed_params = dict(PARAMS, engine="numpy")
+    del fixed_params["gamma"]
+    expected = run_batch_experiment((0.3, 0.7), num_runs=3, num_steps=20, fixed_params=fixed_params,
+                                    output_path=None)
+    batched = run_batch_experiment((0.3, 0.7), num_runs=3, num_steps=20, fixed_params=fixed_params,
+                                   output_path=None, replicate_batch=True)
+    assert (batched["engine"] == "numpy").all()
+    pd.testing.assert_frame_equal(batched, expected)
+
+
+def test_replicate_batch_rejects_object_engine():
+    with pytest.raises(ValueError):
+        run_batch_experiment((0.5,), num_runs=2, num_steps=5, fixed_params=dict(PARAMS, engine="object"),
+                             output_path=None, replicate_batch=True)
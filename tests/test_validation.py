@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from validation import (COMPARED_REPORTERS, check_reproducibility, compare_aggregate, compare_engines,
+                        compare_update_modes)
+
+# Gamma values checked by validation.py, with its identity ratios
+GAMMAS = [0.3, 0.5, 0.7]
+PARAMS = {"QW_ratio": 0.5, "QNW_ratio": 0.25}
+
+
+def failing(result):
+    # Rows outside the tolerance, shown in the assertion message
+    return result[~result["ok"]].to_string(index=False)
+
+
+def test_same_seed_is_reproducible():
+    assert check_reproducibility()
+
+
+@pytest.mark.parametrize("update_mode", ["sequential", "synchronous"])
+@pytest.mark.parametrize("gamma", GAMMAS)
+def test_numpy_engine_matches_object_engine(gamma, update_mode):
+    result = compare_engines(gamma=gamma, update_mode=update_mode, **PARAMS)
+    assert result["ok"].all(), failing(result)
+
+
+@pytest.mark.parametrize("gamma", GAMMAS)
+def test_update_mode_comparison(gamma):
+    # The modes are different models, so only the comparison itself is checked
+    result = compare_update_modes(gamma=gamma, **PARAMS)
+    assert list(result["reporter"]) == COMPARED_REPORTERS
+    assert np.isfinite(result[["sequential_mean", "synchronous_mean", "z"]].to_numpy()).all()
+
+
+@pytest.mark.parametrize("gamma", GAMMAS)
+def test_aggregate_engine_within_agent_spread(gamma):
+    result = compare_aggregate(gamma=gamma, **PARAMS)
+    assert result["ok"].all(), failing(result)